@@ -1,23 +1,73 @@
 #! /usr/bin/env python
 from __future__ import (absolute_import, division, with_statement)
+from itertools import count
+import os
+
+# Whether classes decorated with @typechecked check types.  Set the
+# ALGAE_TYPECHECK environment variable to 0 (or false, no, off) before import
+# to turn checks off, replacing typechecked properties with plain storage.
+typechecks_enabled = os.environ.get("ALGAE_TYPECHECK", "1").strip().lower() \
+    not in ("0", "false", "no", "off")
+
+# Orders typechecked properties by definition, since class dicts are unordered
+# before Python 3.6.
+_creation_order = count()
 
 class typechecked_property(object):
-    """An object descriptor supporting a typechecked property."""
+    """An object descriptor supporting a typechecked property.
+
+By default, values are stored in the instance's __dict__.  If slot is
+specified, values are instead stored in the named slot, which the owning class
+must declare in __slots__; this lets classes using typechecked properties avoid
+a per-instance __dict__:
+
+    class Point(object):
+        __slots__ = ["_x", "_y"]
+        x = typechecked_property(int, slot="_x")
+        y = typechecked_property(int, slot="_y")
+"""
 
     unset = object()
 
-    def __init__(self, types, name=None, deletion=False):
+    def __new__(cls, types, name=None, deletion=False, slot=None):
+        # Slot-backed properties get their own class so neither kind pays for
+        # a storage check on each access.
+        if cls is typechecked_property and slot is not None:
+            cls = slotted_typechecked_property
+        return super(typechecked_property, cls).__new__(cls)
+
+    def __init__(self, types, name=None, deletion=False, slot=None):
         """Creates a property on the specified class which implements type
-checking when the property is set."""
+checking when the property is set.
+
+types may be a single type or a tuple of types."""
         super(typechecked_property, self).__init__()
-        self.types = types
-        if name is not None:
+        if isinstance(types, type):
+            types = (types,)
+        self.types = tuple(types)
+
+        # isinstance is fastest when passed a bare type.
+        if len(self.types) == 1:
+            self.check_types = self.types[0]
+        else:
+            self.check_types = self.types
+
+        if slot is not None:
+            self.name = slot
+        elif name is not None:
             self.name = name
         else:
             self.name = "typechecked_%x" % id(self)
         self.deletion = deletion
+        self.order = next(_creation_order)
         return
 
+    def type_error(self, value):
+        return TypeError(
+            "Cannot set attribute to %s: allowed types are %s" %
+            (type(value).__name__,
+             ", ".join([t.__name__ for t in self.types])))
+
     def __get__(self, instance, owner):
         if instance is None:
             raise AttributeError("Unknown attribute")
@@ -27,11 +77,8 @@ checking when the property is set."""
         return result
 
     def __set__(self, instance, value):
-        if not isinstance(value, self.types):
-            raise TypeError(
-                "Cannot set attribute to %s: allowed types are %s" %
-                (type(value).__name__,
-                 ", ".join([t.__name__ for t in self.types])))
+        if not isinstance(value, self.check_types):
+            raise self.type_error(value)
         instance.__dict__[self.name] = value
         return
 
@@ -40,7 +87,178 @@ checking when the property is set."""
             raise TypeError("Cannot delete attribute")
         del instance.__dict__[self.name]
 # end typechecked_property
-    
+
+class slotted_typechecked_property(typechecked_property):
+    """A typechecked property whose value is stored in a slot.
+
+This wraps the slot's member descriptor, which is found on the owning class
+when the property is first used (or, on Python 3.6 and later, when the owning
+class is created)."""
+
+    def __init__(self, types, name=None, deletion=False, slot=None):
+        super(slotted_typechecked_property, self).__init__(
+            types, name=name, deletion=deletion, slot=slot)
+        self.member = unresolved_slot(self)
+        return
+
+    def __set_name__(self, owner, name):
+        self.resolve(owner)
+        return
+
+    def resolve(self, owner):
+        """Find the member descriptor for our slot on owner or its bases."""
+        for cls in owner.__mro__:
+            member = cls.__dict__.get(self.name)
+            if member is not None and member is not self:
+                self.member = member
+                return member
+        raise TypeError("%s does not declare slot %r" %
+                        (owner.__name__, self.name))
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            raise AttributeError("Unknown attribute")
+        return self.member.__get__(instance, owner)
+
+    def __set__(self, instance, value):
+        if not isinstance(value, self.check_types):
+            raise self.type_error(value)
+        self.member.__set__(instance, value)
+        return
+
+    def __delete__(self, instance):
+        if not self.deletion:
+            raise TypeError("Cannot delete attribute")
+        self.member.__delete__(instance)
+# end slotted_typechecked_property
+
+class unresolved_slot(object):
+    """Stands in for a slotted property's member descriptor until the owning
+class is known, then replaces itself with the real one."""
+
+    def __init__(self, prop):
+        super(unresolved_slot, self).__init__()
+        self.prop = prop
+        return
+
+    def __get__(self, instance, owner):
+        return self.prop.resolve(type(instance)).__get__(instance, owner)
+
+    def __set__(self, instance, value):
+        self.prop.resolve(type(instance)).__set__(instance, value)
+        return
+
+    def __delete__(self, instance):
+        self.prop.resolve(type(instance)).__delete__(instance)
+# end unresolved_slot
+
+def _class_attribute(cls, name):
+    # Look up name on cls or its bases without invoking descriptors.
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return None
+
+def typechecked(cls=None, enabled=None):
+    """Class decorator which compiles the typechecked properties of a class
+into a single validating initializer.
+
+The generated function takes the fields in definition order (including those
+inherited from typechecked base classes), checks each value's type, and stores
+it directly, without going through each property's __set__:
+
+    @typechecked
+    class Point(object):
+        __slots__ = ["_x", "_y"]
+        x = typechecked_property(int, slot="_x")
+        y = typechecked_property(int, slot="_y")
+
+    p = Point(1, 2)
+
+It is installed as _init_fields(self, ...), and as __init__ unless the class
+defines its own __init__ (which may then call self._init_fields(...)).  The
+field names are recorded in __typechecked_fields__.
+
+If enabled is False (or is None and typechecks_enabled is False), type checks
+are turned off: slot-backed properties are replaced by the slots' own member
+descriptors, dict-backed properties are removed so the values live in the
+instance __dict__ under the field name, and the initializer stores values
+without checking them, so attribute access costs the same as on an unchecked
+class."""
+    if cls is None:
+        return lambda cls: typechecked(cls, enabled=enabled)
+
+    if enabled is None:
+        enabled = typechecks_enabled
+
+    fields = {}
+    for base in reversed(cls.__mro__[1:]):
+        fields.update(base.__dict__.get("__typechecked_properties__", {}))
+    for name, value in list(cls.__dict__.items()):
+        if isinstance(value, typechecked_property):
+            fields[name] = value
+    names = sorted(fields, key=lambda name: fields[name].order)
+
+    # The generated code's own names start with __tc_ so they can't collide
+    # with field names (a class body would mangle such a name).
+    namespace = {}
+    lines = ["def _init_fields(%s):" % ", ".join(["__tc_self"] + names)]
+    uses_dict = False
+    for name in names:
+        prop = fields[name]
+        active = _class_attribute(cls, name)
+        if enabled:
+            # Restore the property if a base class had checks turned off.
+            if active is not prop:
+                setattr(cls, name, prop)
+            namespace["__tc_types_" + name] = prop.check_types
+            namespace["__tc_prop_" + name] = prop
+            lines.append("    if not isinstance(%s, __tc_types_%s):" %
+                         (name, name))
+            lines.append("        raise __tc_prop_%s.type_error(%s)" %
+                         (name, name))
+
+        if isinstance(prop, slotted_typechecked_property):
+            member = prop.resolve(cls)
+            namespace["__tc_set_" + name] = member.__set__
+            lines.append("    __tc_set_%s(__tc_self, %s)" % (name, name))
+            if not enabled:
+                setattr(cls, name, member)
+        else:
+            uses_dict = True
+            if enabled:
+                key = prop.name
+            elif name in cls.__dict__:
+                delattr(cls, name)
+                key = name
+            elif active is prop:
+                # Inherited from a class with checks on, so the property still
+                # governs the attribute.
+                key = prop.name
+            else:
+                key = name
+            lines.append("    __tc_values[%r] = %s" % (key, name))
+
+    if uses_dict:
+        if _class_attribute(cls, "__dict__") is None:
+            raise TypeError("%s has dict-backed typechecked properties but "
+                            "its instances have no __dict__" % cls.__name__)
+        lines.insert(1, "    __tc_values = __tc_self.__dict__")
+    if len(lines) == 1:
+        lines.append("    pass")
+
+    exec(compile("\n".join(lines) + "\n", "<typechecked %s>" % cls.__name__,
+                 "exec"), namespace)
+    init_fields = namespace["_init_fields"]
+    init_fields.__doc__ = "Initialize the fields %s." % ", ".join(names)
+
+    cls._init_fields = init_fields
+    if "__init__" not in cls.__dict__:
+        cls.__init__ = init_fields
+    cls.__typechecked_fields__ = tuple(names)
+    cls.__typechecked_properties__ = fields
+    return cls
+
 # Local variables:
 # mode: Python
 # tab-width: 8
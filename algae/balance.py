@@ -0,0 +1,240 @@
+"""
+Rank-balanced policies for RedBlackTree: pass balance="avl" or
+balance="wavl" to use them.
+
+Both store a rank on each node (RankedTreeNode), where a missing child has
+rank -1 and a leaf rank 0; the rank difference of a child is its parent's
+rank minus its own.  The terminology and rebalancing cases follow Haeupler,
+Sen and Tarjan, "Rank-Balanced Trees", ACM Transactions on Algorithms 11(4),
+2015.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.rbtree import BalancePolicy, RankedTreeNode, red_black
+
+def rank(node):
+    """rank(node) -> int: the rank of node, or -1 if node is None."""
+    return -1 if node is None else node.rank
+
+class AVLBalance(BalancePolicy):
+    """
+    AVL balancing: each node's rank is its height, and the heights of a
+    node's two subtrees differ by at most one.  Trees are at most about
+    1.44 lg n deep.
+    """
+    name = "avl"
+    node_class = RankedTreeNode
+
+    def insert_fixup(self, tree, node):
+        node.rank = 0
+        self.retrace(tree, node.parent)
+        return
+
+    def delete_fixup(self, tree, child, parent, removed):
+        self.retrace(tree, parent)
+        return
+
+    def retrace(self, tree, node):
+        """
+        Restore heights and balance from node up to the root, stopping once
+        a subtree's height is unchanged.
+        """
+        while node is not None:
+            old_rank = node.rank
+            node = self.rebalance(tree, node)
+            if node.rank == old_rank:
+                break
+            node = node.parent
+        return
+
+    def rebalance(self, tree, node):
+        """
+        Rotate at node if its subtrees' heights differ by two, update the
+        heights of the nodes moved, and return the subtree's new root.
+        """
+        left = node.left
+        right = node.right
+        difference = rank(left) - rank(right)
+
+        if difference > 1:
+            if rank(left.left) < rank(left.right):
+                tree._rotate_left(left)
+                self.link_node(left)
+                self.link_node(left.parent)
+            tree._rotate_right(node)
+        elif difference < -1:
+            if rank(right.right) < rank(right.left):
+                tree._rotate_right(right)
+                self.link_node(right)
+                self.link_node(right.parent)
+            tree._rotate_left(node)
+        else:
+            self.link_node(node)
+            return node
+
+        self.link_node(node)
+        self.link_node(node.parent)
+        return node.parent
+
+    def link_node(self, node):
+        node.red = False
+        node.rank = 1 + max(rank(node.left), rank(node.right))
+        return
+
+    def verify_node(self, node):
+        left = rank(node.left)
+        right = rank(node.right)
+        if node.rank != 1 + max(left, right):
+            raise AssertionError("node %d has rank %d but height %d" %
+                                 (id(node), node.rank, 1 + max(left, right)))
+        if abs(left - right) > 1:
+            raise AssertionError("node %d is unbalanced: subtree heights %d "
+                                 "and %d" % (id(node), left, right))
+        return
+
+class WAVLBalance(BalancePolicy):
+    """
+    Weak AVL balancing: every rank difference is 1 or 2, and every leaf has
+    rank 0.  Built by insertions alone, a WAVL tree is an AVL tree; deletions
+    may leave it up to 2 lg n deep, but take at most two rotations each.
+    """
+    name = "wavl"
+    node_class = RankedTreeNode
+
+    def insert_fixup(self, tree, node):
+        node.rank = 0
+        parent = node.parent
+
+        # While node is a 0-child, promote its parent or rotate.
+        while parent is not None and parent.rank == node.rank:
+            if parent.left is node:
+                sibling = parent.right
+            else:
+                sibling = parent.left
+
+            if parent.rank - rank(sibling) == 1:
+                # The parent is 0,1: promote it and move up.
+                parent.rank += 1
+                node = parent
+                parent = node.parent
+                continue
+
+            # The parent is 0,2.
+            if parent.left is node:
+                inner = node.right
+                if inner is None or node.rank - inner.rank == 2:
+                    tree._rotate_right(parent)
+                    parent.rank -= 1
+                else:
+                    tree._rotate_left(node)
+                    tree._rotate_right(parent)
+                    inner.rank += 1
+                    node.rank -= 1
+                    parent.rank -= 1
+            else:
+                inner = node.left
+                if inner is None or node.rank - inner.rank == 2:
+                    tree._rotate_left(parent)
+                    parent.rank -= 1
+                else:
+                    tree._rotate_right(node)
+                    tree._rotate_left(parent)
+                    inner.rank += 1
+                    node.rank -= 1
+                    parent.rank -= 1
+            break
+        return
+
+    def delete_fixup(self, tree, child, parent, removed):
+        if parent is None:
+            return
+
+        if parent.left is None and parent.right is None and parent.rank > 0:
+            # parent is now a 2,2 leaf.
+            parent.rank = 0
+            child = parent
+            parent = child.parent
+
+        # While child is a 3-child, demote its parent or rotate.
+        while parent is not None and parent.rank - rank(child) == 3:
+            child_is_left = parent.left is child
+            if child_is_left:
+                sibling = parent.right
+            else:
+                sibling = parent.left
+
+            if parent.rank - rank(sibling) == 2:
+                # The parent is 3,2: demote it and move up.
+                parent.rank -= 1
+                child = parent
+                parent = child.parent
+                continue
+
+            if (sibling.rank - rank(sibling.left) == 2 and
+                sibling.rank - rank(sibling.right) == 2):
+                # The parent is 3,1 and the sibling 2,2: demote both.
+                parent.rank -= 1
+                sibling.rank -= 1
+                child = parent
+                parent = child.parent
+                continue
+
+            if child_is_left:
+                outer = sibling.right
+                inner = sibling.left
+            else:
+                outer = sibling.left
+                inner = sibling.right
+
+            if sibling.rank - rank(outer) == 1:
+                if child_is_left:
+                    tree._rotate_left(parent)
+                else:
+                    tree._rotate_right(parent)
+                sibling.rank += 1
+                parent.rank -= 1
+                if parent.left is None and parent.right is None:
+                    parent.rank -= 1
+            else:
+                if child_is_left:
+                    tree._rotate_right(sibling)
+                    tree._rotate_left(parent)
+                else:
+                    tree._rotate_left(sibling)
+                    tree._rotate_right(parent)
+                inner.rank += 2
+                sibling.rank -= 1
+                parent.rank -= 2
+            break
+        return
+
+    def link_node(self, node):
+        # Balanced trees are AVL trees, whose heights are valid WAVL ranks.
+        node.red = False
+        node.rank = 1 + max(rank(node.left), rank(node.right))
+        return
+
+    def verify_node(self, node):
+        for child in (node.left, node.right):
+            difference = node.rank - rank(child)
+            if difference not in (1, 2):
+                raise AssertionError(
+                    "node %d has a child with rank difference %d" %
+                    (id(node), difference))
+        if node.left is None and node.right is None and node.rank != 0:
+            raise AssertionError("leaf node %d has rank %d" %
+                                 (id(node), node.rank))
+        return
+
+avl = AVLBalance()
+wavl = WAVLBalance()
+
+# The policies RedBlackTree(balance=...) accepts by name.
+policies = {red_black.name: red_black, avl.name: avl, wavl.name: wavl}
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -1,6 +1,10 @@
 from __future__ import (absolute_import, division, with_statement)
 
+from algae.durable import DurableRedBlackTree
+from algae.expiring import ExpiringDict
+from algae.indexed import IndexedTable
 from algae.rbtree import RedBlackTree
+from algae.sharded import ShardedSortedMap
 
 # Local variables:
 # mode: Python
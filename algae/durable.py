@@ -0,0 +1,433 @@
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.functions import identity
+from algae.rbtree import RedBlackTree
+from operator import lt
+from struct import Struct
+from time import time
+from zlib import crc32
+import os
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Protocol 2 is readable by both Python 2 and 3.
+pickle_protocol = 2
+
+# Each log record is framed with its payload length and CRC-32 so a torn
+# write at the end of the log can be detected and discarded.
+record_header = Struct("<II")
+
+wal_magic = "algae-wal"
+format_version = 1
+
+# The checkpoint header is fixed-size so the item count can be filled in
+# after the items are written: magic, version, generation, count.
+checkpoint_magic = b"algae-checkpoint"
+checkpoint_header = Struct("<16sIQQ")
+
+# Log operations.
+op_set = 0
+op_delete = 1
+op_split = 2
+op_delete_range = 3
+
+class DurableRedBlackTree(RedBlackTree):
+    """
+    A RedBlackTree whose contents survive a crash.
+
+    Each assignment, deletion, split and range deletion is appended to a
+    write-ahead log in the tree's directory before it is applied.  The log
+    is flushed and fsync()ed every sync_every records and, if sync_interval
+    is set, on the first write made sync_interval or more seconds after the
+    last sync (group commit).  The interval is only checked when a record is
+    written or maybe_sync() is called, so a tree left idle keeps its unsynced
+    records until the next write, maybe_sync(), sync() or close(); call
+    maybe_sync() periodically to bound that delay.  Operations since the
+    last sync may be lost in a crash; sync_every=1, the default, syncs every
+    operation.
+
+    checkpoint() writes the whole tree to disk in sorted order and starts a
+    new, empty log.  It runs automatically every checkpoint_every logged
+    operations if that is set.  On opening, the tree is recovered by linking
+    the checkpointed nodes into a balanced tree in linear time, without any
+    comparisons, then replaying the log.  A partially written record at the
+    end of the log is discarded.
+
+    Keys and values must be picklable.  The cmp and key functions are not
+    stored, so the tree must be reopened with the ones it was created with.
+    Trees returned by split() and copy() are ordinary in-memory trees.
+    """
+    checkpoint_name = "checkpoint"
+    wal_name = "wal"
+    checkpoint_batch = 4096
+
+    def __init__(self, path, cmp=lt, key=identity, sync_every=1,
+                 sync_interval=None, checkpoint_every=None, balance=None):
+        """
+        DurableRedBlackTree(path, cmp=operator.lt, key=identity, sync_every=1,
+                            sync_interval=None, checkpoint_every=None,
+                            balance=None)
+
+        Open the tree stored in the directory path, creating it if necessary.
+        """
+        super(DurableRedBlackTree, self).__init__(cmp=cmp, key=key,
+                                                  balance=balance)
+        if sync_every < 1:
+            raise ValueError("sync_every must be positive: %r" %
+                             (sync_every,))
+
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.checkpoint_every = checkpoint_every
+        self.wal = None
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.generation = self.__load_checkpoint()
+        self.__replay_wal()
+        return
+
+    @property
+    def checkpoint_path(self):
+        return os.path.join(self.path, self.checkpoint_name)
+
+    @property
+    def wal_path(self):
+        return os.path.join(self.path, self.wal_name)
+
+    def _new_like(self):
+        cmp, key = self.ordering()
+        return RedBlackTree(cmp=cmp, key=key, balance=self.balance)
+
+    def __load_checkpoint(self):
+        # Load the checkpoint, if any, and return its generation.
+        try:
+            fd = open(self.checkpoint_path, "rb")
+        except (IOError, OSError):
+            return 0
+
+        with fd:
+            header = fd.read(checkpoint_header.size)
+            if len(header) < checkpoint_header.size:
+                raise ValueError("%s is truncated" % self.checkpoint_path)
+            magic, version, generation, count = checkpoint_header.unpack(
+                header)
+            if magic != checkpoint_magic or version != format_version:
+                raise ValueError("%s is not a version %d checkpoint" %
+                                 (self.checkpoint_path, format_version))
+
+            nodes = []
+            while True:
+                batch = pickle.load(fd)
+                if batch is None:
+                    break
+                nodes.extend([self._new_node(key, value)
+                              for key, value in batch])
+
+        if len(nodes) != count:
+            raise ValueError("%s is truncated: expected %d items, found %d" %
+                             (self.checkpoint_path, count, len(nodes)))
+
+        self.root = self._link_balanced(nodes)
+        return generation
+
+    def __replay_wal(self):
+        # Replay the log on top of the checkpoint, then open it for appending.
+        # The log is discarded if it predates the checkpoint (the process
+        # stopped between writing a checkpoint and starting its new log).
+        good_length = 0
+        replayed = 0
+        replay = False
+        try:
+            fd = open(self.wal_path, "rb")
+        except (IOError, OSError):
+            fd = None
+
+        if fd is not None:
+            with fd:
+                records = read_records(fd)
+                for payload, end in records:
+                    magic, version, generation = payload
+                    if magic != wal_magic or version != format_version:
+                        raise ValueError("%s is not a version %d log" %
+                                         (self.wal_path, format_version))
+                    if generation > self.generation:
+                        raise ValueError(
+                            "%s is newer than the checkpoint; the checkpoint "
+                            "is missing or stale" % (self.wal_path,))
+                    replay = generation == self.generation
+                    good_length = end
+                    break
+
+                if replay:
+                    for payload, end in records:
+                        self.__apply(payload)
+                        good_length = end
+                        replayed += 1
+
+        if replay:
+            self.wal = open(self.wal_path, "r+b")
+            self.wal.truncate(good_length)
+            self.wal.seek(good_length)
+            self.logged = replayed
+        else:
+            self.__start_wal()
+        self.unsynced = 0
+        self.last_sync = time()
+        return
+
+    def __start_wal(self):
+        if self.wal is not None:
+            self.wal.close()
+        self.wal = open(self.wal_path, "wb")
+        write_record(self.wal, (wal_magic, format_version, self.generation))
+        self.wal.flush()
+        os.fsync(self.wal.fileno())
+        sync_directory(self.path)
+        self.logged = 0
+        return
+
+    def __apply(self, payload):
+        op = payload[0]
+        if op == op_set:
+            RedBlackTree.__setitem__(self, payload[1], payload[2])
+        elif op == op_delete:
+            if self.find_node(payload[1]) is not None:
+                RedBlackTree.__delitem__(self, payload[1])
+        elif op == op_split:
+            RedBlackTree.split(self, payload[1], payload[2])
+        elif op == op_delete_range:
+            RedBlackTree.delete_range(self, *decode_range(payload[1:]))
+        else:
+            raise ValueError("Unknown log operation %r" % (op,))
+        return
+
+    def __check_open(self):
+        if self.wal is None:
+            raise ValueError("Operation on a closed DurableRedBlackTree")
+        return
+
+    def __log(self, payload):
+        self.__check_open()
+        write_record(self.wal, payload)
+        self.unsynced += 1
+        self.logged += 1
+        if (self.unsynced >= self.sync_every or
+            (self.sync_interval is not None and
+             time() - self.last_sync >= self.sync_interval)):
+            self.sync()
+        return
+
+    def __maybe_checkpoint(self):
+        if (self.checkpoint_every is not None and
+            self.logged >= self.checkpoint_every):
+            self.checkpoint()
+        return
+
+    def __setitem__(self, key, value):
+        # Look the key up first so an incomparable key fails before it is
+        # logged.
+        node = self.find_node(key)
+        self.__log((op_set, key, value))
+        if node is not None:
+            node.value = value
+        else:
+            super(DurableRedBlackTree, self).__setitem__(key, value)
+        self.__maybe_checkpoint()
+        return
+
+    def __delitem__(self, key):
+        if self.find_node(key) is None:
+            raise KeyError("Unknown key: %r" % (key,))
+        self.__log((op_delete, key))
+        super(DurableRedBlackTree, self).__delitem__(key)
+        self.__maybe_checkpoint()
+        return
+
+    def split(self, key, inclusive=False):
+        self.__log((op_split, key, inclusive))
+        result = super(DurableRedBlackTree, self).split(key, inclusive)
+        self.__maybe_checkpoint()
+        return result
+
+    def delete_range(self, start=RedBlackTree.unspecified,
+                     stop=RedBlackTree.unspecified):
+        self.__log((op_delete_range,) + encode_range(start, stop))
+        result = super(DurableRedBlackTree, self).delete_range(start, stop)
+        self.__maybe_checkpoint()
+        return result
+
+    def sync(self):
+        """
+        dt.sync()
+
+        Flush logged operations to disk and fsync() them.
+        """
+        self.__check_open()
+        self.wal.flush()
+        os.fsync(self.wal.fileno())
+        self.unsynced = 0
+        self.last_sync = time()
+        return
+
+    def maybe_sync(self):
+        """
+        dt.maybe_sync() -> bool
+
+        Sync if there are unsynced operations and sync_interval seconds have
+        passed since the last sync, returning whether it synced.  Call this
+        from a timer or idle loop so records written just before a quiet
+        period are synced on time.  Does nothing on a closed tree.
+        """
+        if (self.wal is None or not self.unsynced or
+            self.sync_interval is None or
+            time() - self.last_sync < self.sync_interval):
+            return False
+        self.sync()
+        return True
+
+    def checkpoint(self):
+        """
+        dt.checkpoint()
+
+        Write the tree to disk in sorted order and start a new, empty log.
+        The checkpoint is written to a temporary file and renamed into place,
+        so a crash leaves either the old or the new checkpoint intact.
+        Raises ValueError if the tree has been closed.
+        """
+        self.__check_open()
+        generation = self.generation + 1
+        temp_path = self.checkpoint_path + ".tmp"
+        count = 0
+        with open(temp_path, "wb") as fd:
+            # The item count is filled in once known.
+            fd.write(checkpoint_header.pack(checkpoint_magic, format_version,
+                                            generation, 0))
+            batch = []
+            for item in self.iteritems():
+                batch.append(item)
+                if len(batch) >= self.checkpoint_batch:
+                    pickle.dump(batch, fd, pickle_protocol)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                pickle.dump(batch, fd, pickle_protocol)
+                count += len(batch)
+            pickle.dump(None, fd, pickle_protocol)
+
+            fd.seek(0)
+            fd.write(checkpoint_header.pack(checkpoint_magic, format_version,
+                                            generation, count))
+            fd.flush()
+            os.fsync(fd.fileno())
+
+        replace_file(temp_path, self.checkpoint_path)
+        sync_directory(self.path)
+        self.generation = generation
+        self.__start_wal()
+        self.unsynced = 0
+        return
+
+    def close(self):
+        """
+        dt.close()
+
+        Sync the log and close it.  The tree remains readable in memory, but
+        can no longer be modified.
+        """
+        if self.wal is not None:
+            self.sync()
+            self.wal.close()
+            self.wal = None
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+def write_record(fd, payload):
+    """Append a framed, pickled record to fd."""
+    data = pickle.dumps(payload, pickle_protocol)
+    fd.write(record_header.pack(len(data), crc32(data) & 0xffffffff))
+    fd.write(data)
+    return
+
+def read_records(fd):
+    """
+    read_records(fd) -> generator
+
+    Yield (payload, end_offset) for each intact record in fd, stopping at
+    the end of the file or at the first torn or corrupt record.
+    """
+    offset = fd.tell()
+    while True:
+        header = fd.read(record_header.size)
+        if len(header) < record_header.size:
+            return
+        length, checksum = record_header.unpack(header)
+        data = fd.read(length)
+        if len(data) < length or crc32(data) & 0xffffffff != checksum:
+            return
+        offset += record_header.size + length
+        yield pickle.loads(data), offset
+
+def encode_range(start, stop):
+    """
+    encode_range(start, stop) -> tuple
+
+    Encode range bounds for the log, flagging unspecified ones, since the
+    RedBlackTree.unspecified sentinel doesn't survive pickling.
+    """
+    result = ()
+    for bound in (start, stop):
+        if bound is RedBlackTree.unspecified:
+            result += (False, None)
+        else:
+            result += (True, bound)
+    return result
+
+def decode_range(encoded):
+    """decode_range(encoded) -> (start, stop): the inverse of encode_range."""
+    start_given, start, stop_given, stop = encoded
+    return (start if start_given else RedBlackTree.unspecified,
+            stop if stop_given else RedBlackTree.unspecified)
+
+def replace_file(source, destination):
+    """Atomically rename source over destination."""
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        # os.rename only replaces existing files atomically on POSIX.
+        if os.name == "nt" and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+    return
+
+def sync_directory(path):
+    """fsync() a directory so renames and creations in it are durable."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+    return
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -0,0 +1,281 @@
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.rbtree import RedBlackTree
+from itertools import count
+from time import time
+
+class ExpiringDict(object):
+    """
+    A dictionary whose entries expire after a time-to-live (TTL).
+
+    Entries are held in a hash table, so lookups take O(1) average time.
+    Alongside it, an expiry index maps (expiry time, sequence number) to each
+    key in a RedBlackTree.  This lets evict_expired() remove every expired
+    entry from the index with a single O(lg n) range cut instead of one
+    delete per entry.
+
+    Expired entries are also removed lazily: reading an entry whose TTL has
+    passed removes it and behaves as if it were missing.  Until then, an
+    expired entry still counts toward len().
+
+    If max_size is set, inserting beyond it first evicts expired entries and
+    then, if necessary, the entries closest to expiring.  Entries without a
+    TTL are evicted in insertion order after all entries with one.
+
+    The hits, misses, evictions and expirations attributes count lookups
+    that found a live entry, lookups that did not, entries removed to honor
+    max_size, and entries removed because their TTL passed.
+    """
+    unspecified = object()
+    forever = float("inf")
+
+    def __init__(self, init=None, ttl=None, max_size=None, clock=time):
+        """
+        ExpiringDict(init=None, ttl=None, max_size=None, clock=time.time)
+
+        Create a new ExpiringDict.
+
+        init specifies the initial values, in the same forms accepted by
+        update().
+
+        ttl specifies the default time-to-live for entries, in the units of
+        clock.  If None, entries do not expire unless given a TTL explicitly.
+
+        max_size specifies the maximum number of entries to hold.  If None,
+        the size is unbounded.
+
+        clock specifies a function returning the current time.
+        """
+        super(ExpiringDict, self).__init__()
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be positive: %r" % (max_size,))
+
+        self.entries = {}
+        self.expiry_index = RedBlackTree()
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.sequence = count()
+        self.reset_stats()
+
+        if init is not None:
+            self.update(init)
+        return
+
+    def reset_stats(self):
+        """Reset the hit, miss, eviction and expiration counters to zero."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        return
+
+    def stats(self):
+        """
+        ed.stats() -> dict
+
+        Return the hit, miss, eviction and expiration counters.
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations}
+
+    def __live_entry(self, key, now=None):
+        # Return the entry for key, or None if it is missing or has expired.
+        # Expired entries are removed as a side effect.
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        if entry.expires != ExpiringDict.forever:
+            if now is None:
+                now = self.clock()
+            if entry.expires <= now:
+                self.__remove(key, entry)
+                self.expirations += 1
+                return None
+
+        return entry
+
+    def __remove(self, key, entry):
+        del self.entries[key]
+        del self.expiry_index[entry.index_key]
+        return
+
+    def set(self, key, value, ttl=unspecified):
+        """
+        ed.set(key, value, ttl=...)
+
+        Set the value for key, expiring it after ttl has elapsed.  If ttl is
+        not specified, the default TTL is used; if it is None, the entry does
+        not expire.
+        """
+        if ttl is ExpiringDict.unspecified:
+            ttl = self.ttl
+
+        now = self.clock()
+        if ttl is None:
+            expires = ExpiringDict.forever
+        else:
+            expires = now + ttl
+
+        old = self.entries.get(key)
+        if old is not None:
+            del self.expiry_index[old.index_key]
+
+        entry = ExpiringDictEntry(value, expires, next(self.sequence))
+        self.entries[key] = entry
+        self.expiry_index[entry.index_key] = key
+
+        if self.max_size is not None and len(self.entries) > self.max_size:
+            self.evict_expired(now)
+            while len(self.entries) > self.max_size:
+                index_key, victim = self.expiry_index.min()
+                self.__remove(victim, self.entries[victim])
+                self.evictions += 1
+        return
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+        return
+
+    def __getitem__(self, key):
+        entry = self.__live_entry(key)
+        if entry is None:
+            self.misses += 1
+            raise KeyError("Unknown key: %r" % (key,))
+        self.hits += 1
+        return entry.value
+
+    def get(self, key, default=None):
+        """
+        ed.get(key, default=None) -> value
+
+        Return the value for key if it is present and has not expired;
+        otherwise, return default.
+        """
+        entry = self.__live_entry(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return entry.value
+
+    def __contains__(self, key):
+        return self.__live_entry(key) is not None
+
+    def __delitem__(self, key):
+        entry = self.__live_entry(key)
+        if entry is None:
+            raise KeyError("Unknown key: %r" % (key,))
+        self.__remove(key, entry)
+        return
+
+    def pop(self, key, default=unspecified):
+        """
+        ed.pop(key[, default]) -> value
+
+        Remove key and return its value.  If key is missing or has expired,
+        return default if given; otherwise, raise KeyError.
+        """
+        entry = self.__live_entry(key)
+        if entry is None:
+            if default is ExpiringDict.unspecified:
+                raise KeyError("Unknown key: %r" % (key,))
+            return default
+        self.__remove(key, entry)
+        return entry.value
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """Remove every entry.  The statistics counters are not reset."""
+        self.entries.clear()
+        self.expiry_index = RedBlackTree()
+        return
+
+    def evict_expired(self, now=None):
+        """
+        ed.evict_expired(now=None) -> int
+
+        Remove every entry whose expiry time is at or before now (by default,
+        the current time) and return the number of entries removed.
+
+        The entries are cut from the expiry index in one O(lg n) split; only
+        the hash table removals are done per entry.
+        """
+        if now is None:
+            now = self.clock()
+
+        expired = self.expiry_index.split((now, ExpiringDict.forever),
+                                          inclusive=True)
+        removed = 0
+        for key in expired.itervalues():
+            del self.entries[key]
+            removed += 1
+
+        self.expirations += removed
+        return removed
+
+    def iteritems(self):
+        now = self.clock()
+        for key, entry in list(self.entries.items()):
+            if entry.expires > now:
+                yield key, entry.value
+
+    def iterkeys(self):
+        for key, value in self.iteritems():
+            yield key
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    __iter__ = iterkeys
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def update(self, obj):
+        if hasattr(obj, "iteritems"):
+            for key, value in obj.iteritems():
+                self[key] = value
+        elif hasattr(obj, "items"):
+            for key, value in obj.items():
+                self[key] = value
+        else:
+            for key, value in obj:
+                self[key] = value
+        return
+
+    def __repr__(self):
+        return ("ExpiringDict({" +
+                ", ".join([repr(key) + ": " + repr(value)
+                           for key, value in self.iteritems()]) + "})")
+
+class ExpiringDictEntry(object):
+    __slots__ = ["value", "expires", "index_key"]
+
+    def __init__(self, value, expires, sequence):
+        super(ExpiringDictEntry, self).__init__()
+        self.value = value
+        self.expires = expires
+        self.index_key = (expires, sequence)
+        return
+
+    def __repr__(self):
+        return ("ExpiringDictEntry(value=%r, expires=%r)" %
+                (self.value, self.expires))
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -1,9 +1,398 @@
 from __future__ import (absolute_import, division, with_statement)
+from collections import OrderedDict
+from functools import update_wrapper
+from threading import Lock
+from time import time
 
 def identity(value):
     """The identity function: returns the value passed to it."""
     return value
 
+# Returned by a cache's lookup() when the key is not cached.
+cache_miss = object()
+
+class CacheEntry(object):
+    __slots__ = ["prev", "next", "key", "value", "weight"]
+
+    def __init__(self, key=None, value=None, weight=1):
+        super(CacheEntry, self).__init__()
+        self.prev = self.next = self
+        self.key = key
+        self.value = value
+        self.weight = weight
+        return
+
+    def unlink(self):
+        self.prev.next = self.next
+        self.next.prev = self.prev
+        return
+
+    def link_after(self, other):
+        self.prev = other
+        self.next = other.next
+        other.next.prev = self
+        other.next = self
+        return
+
+    def __repr__(self):
+        return "CacheEntry(key=%r, value=%r)" % (self.key, self.value)
+
+class LRUCache(object):
+    """
+    A cache which evicts the least recently used entry once it holds more
+    than maxsize entries.
+
+    Entries are kept in a hash table and a circular doubly-linked list in
+    order of use, so lookups, stores and evictions take O(1) time.
+
+    Like the other caches here, it provides lookup(key), which returns
+    cache_miss if key is not cached, store(key, value), clear(), stats() and
+    len(), and counts hits, misses and evictions.
+    """
+    def __init__(self, maxsize=128):
+        super(LRUCache, self).__init__()
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive: %r" % (maxsize,))
+        self.maxsize = maxsize
+        self.entries = {}
+        # The most recently used entry follows root; the least recently used
+        # precedes it.
+        self.root = CacheEntry()
+        self.hits = self.misses = self.evictions = 0
+        return
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return cache_miss
+        self.hits += 1
+        entry.unlink()
+        entry.link_after(self.root)
+        return entry.value
+
+    def store(self, key, value):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.unlink()
+            entry.value = value
+        else:
+            entry = self.entries[key] = CacheEntry(key, value)
+        entry.link_after(self.root)
+
+        while len(self.entries) > self.maxsize:
+            self.evict()
+        return
+
+    def evict(self):
+        """Evict the least recently used entry."""
+        entry = self.root.prev
+        entry.unlink()
+        del self.entries[entry.key]
+        self.evictions += 1
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.root = CacheEntry()
+        return
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+class WeightedLRUCache(LRUCache):
+    """
+    A least-recently-used cache bounded by the total weight of its values
+    rather than their number.  weigher is called on each stored value to
+    find its weight; entries are evicted until the total is at most
+    max_weight.  A value heavier than max_weight is not retained, and storing
+    one evicts nothing but any older value for the same key.
+    """
+    def __init__(self, max_weight, weigher=len):
+        super(WeightedLRUCache, self).__init__(maxsize=1)
+        if max_weight <= 0:
+            raise ValueError("max_weight must be positive: %r" %
+                             (max_weight,))
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.total_weight = 0
+        return
+
+    def store(self, key, value):
+        weight = self.weigher(value)
+        entry = self.entries.get(key)
+        if weight > self.max_weight:
+            # Too heavy to keep.  Drop any stale value for key, but leave the
+            # other entries alone.
+            if entry is not None:
+                entry.unlink()
+                del self.entries[key]
+                self.total_weight -= entry.weight
+            return
+
+        if entry is not None:
+            entry.unlink()
+            self.total_weight -= entry.weight
+            entry.value = value
+            entry.weight = weight
+        else:
+            entry = self.entries[key] = CacheEntry(key, value, weight)
+        entry.link_after(self.root)
+        self.total_weight += weight
+
+        while self.total_weight > self.max_weight:
+            self.evict()
+        return
+
+    def evict(self):
+        entry = super(WeightedLRUCache, self).evict()
+        self.total_weight -= entry.weight
+        return entry
+
+    def clear(self):
+        super(WeightedLRUCache, self).clear()
+        self.total_weight = 0
+        return
+
+    def stats(self):
+        result = super(WeightedLRUCache, self).stats()
+        result["weight"] = self.total_weight
+        return result
+
+class LFUCache(object):
+    """
+    A cache which evicts the least frequently used entry once it holds more
+    than maxsize entries, breaking ties by evicting the least recently used.
+
+    Keys are grouped into buckets by use count, each bucket ordered by
+    recency, and the smallest nonempty count is tracked, so lookups, stores
+    and evictions take O(1) time.
+    """
+    def __init__(self, maxsize=128):
+        super(LFUCache, self).__init__()
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive: %r" % (maxsize,))
+        self.maxsize = maxsize
+        self.entries = {}       # key -> [value, count]
+        self.buckets = {}       # count -> OrderedDict of keys
+        self.min_count = 0
+        self.hits = self.misses = self.evictions = 0
+        return
+
+    def __touch(self, key, entry):
+        # Move key from its bucket to the next one up.
+        count = entry[1]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.min_count == count:
+                self.min_count = count + 1
+        entry[1] = count + 1
+        self.buckets.setdefault(count + 1, OrderedDict())[key] = None
+        return
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return cache_miss
+        self.hits += 1
+        self.__touch(key, entry)
+        return entry[0]
+
+    def store(self, key, value):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry[0] = value
+            self.__touch(key, entry)
+            return
+
+        if len(self.entries) >= self.maxsize:
+            bucket = self.buckets[self.min_count]
+            victim, ignored = bucket.popitem(last=False)
+            if not bucket:
+                del self.buckets[self.min_count]
+            del self.entries[victim]
+            self.evictions += 1
+
+        self.entries[key] = [value, 1]
+        self.buckets.setdefault(1, OrderedDict())[key] = None
+        self.min_count = 1
+        return
+
+    def clear(self):
+        self.entries.clear()
+        self.buckets.clear()
+        self.min_count = 0
+        return
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "size": len(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+class TTLCache(object):
+    """
+    A cache whose entries expire ttl seconds (in the units of clock) after
+    they are stored, optionally bounded to maxsize entries.  This is a thin
+    adapter over algae.expiring.ExpiringDict; expired entries count as
+    evictions in stats().
+    """
+    def __init__(self, ttl, maxsize=None, clock=time):
+        super(TTLCache, self).__init__()
+        # algae.expiring depends on this module through algae.rbtree.
+        from algae.expiring import ExpiringDict
+        self.entries = ExpiringDict(ttl=ttl, max_size=maxsize, clock=clock)
+        return
+
+    def lookup(self, key):
+        return self.entries.get(key, cache_miss)
+
+    def store(self, key, value):
+        self.entries[key] = value
+        return
+
+    def clear(self):
+        self.entries.clear()
+        return
+
+    def stats(self):
+        entries = self.entries
+        return {"hits": entries.hits, "misses": entries.misses,
+                "evictions": entries.evictions + entries.expirations,
+                "size": len(entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+class LockedCache(object):
+    """Wraps a cache so that each operation holds a lock."""
+    def __init__(self, cache):
+        super(LockedCache, self).__init__()
+        self.cache = cache
+        self.lock = Lock()
+        return
+
+    def lookup(self, key):
+        with self.lock:
+            return self.cache.lookup(key)
+
+    def store(self, key, value):
+        with self.lock:
+            self.cache.store(key, value)
+        return
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+        return
+
+    def stats(self):
+        with self.lock:
+            return self.cache.stats()
+
+    def __len__(self):
+        return len(self.cache)
+
+# Single arguments of these exact types are used as their own cache keys;
+# they can't be confused with the tuples used for other argument lists.
+_fast_key_types = set([int, float, str, bytes, type(u""), type(2 ** 64)])
+_kwargs_mark = object()
+
+def make_cache_key(*args, **kwargs):
+    """
+    make_cache_key(*args, **kwargs) -> hashable
+
+    Build the default cache key for a call: the argument itself for a
+    single int, float or string argument, else a tuple of the arguments.
+    """
+    if not kwargs:
+        if len(args) == 1 and type(args[0]) in _fast_key_types:
+            return args[0]
+        return args
+    return args + (_kwargs_mark,) + tuple(sorted(kwargs.items()))
+
+def memoize(maxsize=128, policy="lru", ttl=None, max_weight=None,
+            weigher=len, cache=None, cache_key=None, thread_safe=False):
+    """
+    memoize(maxsize=128, policy="lru", ttl=None, max_weight=None,
+            weigher=len, cache=None, cache_key=None, thread_safe=False)
+        -> decorator
+
+    Decorator which caches a function's results with bounded memory.
+
+    policy selects the eviction policy:
+        "lru"       Evict the least recently used result beyond maxsize.
+        "lfu"       Evict the least frequently used result beyond maxsize.
+        "ttl"       Expire results ttl seconds after they are computed,
+                    optionally also bounded by maxsize (None for unbounded).
+        "weighted"  Evict the least recently used results while the total
+                    of weigher(result) exceeds max_weight.
+
+    Alternatively, cache may be any object providing lookup(key), returning
+    cache_miss when absent, store(key, value), clear() and stats().
+
+    cache_key, if given, is called with the function's arguments to compute
+    the cache key; use it when arguments are unhashable or when only some of
+    them determine the result.
+
+    If thread_safe is True, cache operations hold a lock.  The function
+    itself runs outside the lock, so concurrent callers may compute the same
+    result twice.
+
+    The decorated function has cache, cache_stats() and cache_clear()
+    attributes.  Since it takes its arguments unchanged, a memoized
+    one-argument function can be passed straight to RedBlackTree(key=...).
+    """
+    if cache is None:
+        if policy == "lru":
+            cache = LRUCache(maxsize)
+        elif policy == "lfu":
+            cache = LFUCache(maxsize)
+        elif policy == "ttl":
+            if ttl is None:
+                raise ValueError("The ttl policy requires a ttl")
+            cache = TTLCache(ttl, maxsize)
+        elif policy == "weighted":
+            if max_weight is None:
+                raise ValueError("The weighted policy requires a max_weight")
+            cache = WeightedLRUCache(max_weight, weigher)
+        else:
+            raise ValueError("Unknown cache policy %r" % (policy,))
+
+    if thread_safe:
+        cache = LockedCache(cache)
+
+    if cache_key is None:
+        cache_key = make_cache_key
+
+    def decorator(function):
+        lookup = cache.lookup
+        store = cache.store
+
+        def wrapper(*args, **kwargs):
+            key = cache_key(*args, **kwargs)
+            result = lookup(key)
+            if result is cache_miss:
+                result = function(*args, **kwargs)
+                store(key, result)
+            return result
+
+        update_wrapper(wrapper, function)
+        wrapper.cache = cache
+        wrapper.cache_stats = cache.stats
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
 # Local variables:
 # mode: Python
 # tab-width: 8
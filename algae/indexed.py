@@ -0,0 +1,355 @@
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.rbtree import RedBlackTree
+from collections import OrderedDict
+from operator import lt
+
+class TableIndex(object):
+    """
+    A named secondary index of an IndexedTable.
+
+    The tree maps each index key, computed by calling key on a record, to an
+    OrderedDict of the records with that key, keyed by primary key in the
+    order they were added.  Records are held by reference, so a range scan
+    returns them without going back to the table.
+    """
+    def __init__(self, name, key, cmp=lt, unique=False):
+        super(TableIndex, self).__init__()
+        self.name = name
+        self.key = key
+        self.compare_keys = cmp
+        self.unique = unique
+        self.tree = RedBlackTree(cmp=cmp)
+        return
+
+    def same_key(self, a, b):
+        return not self.compare_keys(a, b) and not self.compare_keys(b, a)
+
+    def check_unique(self, index_key, pk):
+        """Raise ValueError if adding pk under index_key would break
+        uniqueness."""
+        if not self.unique:
+            return
+        node = self.tree.find_node(index_key)
+        if node is not None and any(other != pk for other in node.value):
+            raise ValueError("Duplicate key %r in unique index %r" %
+                             (index_key, self.name))
+        return
+
+    def add(self, index_key, pk, record):
+        node = self.tree.find_node(index_key)
+        if node is None:
+            self.tree[index_key] = OrderedDict([(pk, record)])
+        else:
+            node.value[pk] = record
+        return
+
+    def remove(self, index_key, pk):
+        node = self.tree.find_node(index_key)
+        bucket = node.value
+        del bucket[pk]
+        if not bucket:
+            del self.tree[index_key]
+        return
+
+    def replace(self, index_key, pk, record):
+        self.tree.find_node(index_key).value[pk] = record
+        return
+
+class IndexedTable(object):
+    """
+    A table of records, each stored once under a primary key, with any number
+    of named secondary indexes kept in step with it.
+
+    primary_key is called on a record to find its primary key, which must be
+    hashable.  Each index, added with add_index(), orders the records by its
+    own key function and cmp; it may be unique, in which case no two records
+    may have equal index keys.
+
+    insert(), update() and delete() apply to the table and every index
+    atomically: index keys are computed and uniqueness checked before
+    anything changes, and if an index operation fails part way, the changes
+    already made are undone before the exception propagates.
+
+    Records should not be modified in place in ways that change their index
+    keys; pass a new record to update() instead.
+    """
+    unspecified = RedBlackTree.unspecified
+
+    def __init__(self, primary_key, records=None):
+        """
+        IndexedTable(primary_key, records=None)
+
+        Create a new IndexedTable, optionally inserting records.
+        """
+        super(IndexedTable, self).__init__()
+        self.primary_key = primary_key
+        self.records = {}
+        self.indexes = OrderedDict()
+
+        if records is not None:
+            for record in records:
+                self.insert(record)
+        return
+
+    def add_index(self, name, key, cmp=lt, unique=False):
+        """
+        it.add_index(name, key, cmp=operator.lt, unique=False)
+
+        Add an index named name which orders records by key(record), compared
+        with cmp, and index the existing records.  Raises ValueError if the
+        name is taken or, for a unique index, if existing records clash.
+        """
+        if name in self.indexes:
+            raise ValueError("Index %r already exists" % (name,))
+
+        index = TableIndex(name, key, cmp=cmp, unique=unique)
+        for pk, record in self.records.items():
+            index_key = key(record)
+            index.check_unique(index_key, pk)
+            index.add(index_key, pk, record)
+        self.indexes[name] = index
+        return
+
+    def drop_index(self, name):
+        """
+        it.drop_index(name)
+
+        Remove the index named name.
+        """
+        del self.indexes[name]
+        return
+
+    def index(self, name):
+        """
+        it.index(name) -> RedBlackTree
+
+        Return the tree behind the index named name.  Its keys are index keys
+        and its values OrderedDicts mapping primary keys to records; it must
+        not be modified directly.
+        """
+        return self.__index(name).tree
+
+    def __index(self, name):
+        try:
+            return self.indexes[name]
+        except KeyError:
+            raise KeyError("Unknown index: %r" % (name,))
+
+    def __index_keys(self, record, pk):
+        # Compute each index's key for record and check uniqueness, before
+        # anything is changed.
+        keys = []
+        for index in self.indexes.values():
+            index_key = index.key(record)
+            index.check_unique(index_key, pk)
+            keys.append(index_key)
+        return keys
+
+    def __apply(self, steps):
+        # Run (do, undo) pairs in order; if one fails, undo those that ran.
+        done = []
+        try:
+            for do, undo in steps:
+                do()
+                done.append(undo)
+        except:
+            for undo in reversed(done):
+                undo()
+            raise
+        return
+
+    def insert(self, record):
+        """
+        it.insert(record)
+
+        Add record to the table and every index.  Raises ValueError if a
+        record with the same primary key exists or a unique index would hold
+        a duplicate.
+        """
+        pk = self.primary_key(record)
+        if pk in self.records:
+            raise ValueError("Duplicate primary key %r" % (pk,))
+        keys = self.__index_keys(record, pk)
+
+        steps = []
+        for index, index_key in zip(self.indexes.values(), keys):
+            steps.append((
+                lambda index=index, index_key=index_key:
+                    index.add(index_key, pk, record),
+                lambda index=index, index_key=index_key:
+                    index.remove(index_key, pk)))
+        self.__apply(steps)
+        self.records[pk] = record
+        return
+
+    def update(self, record):
+        """
+        it.update(record)
+
+        Replace the record with the same primary key as record, moving it in
+        each index whose key changed.  Raises KeyError if there is no such
+        record, and ValueError if a unique index would hold a duplicate.
+        """
+        pk = self.primary_key(record)
+        old = self.records.get(pk)
+        if old is None and pk not in self.records:
+            raise KeyError("Unknown primary key: %r" % (pk,))
+        keys = self.__index_keys(record, pk)
+
+        steps = []
+        for index, index_key in zip(self.indexes.values(), keys):
+            old_key = index.key(old)
+            if index.same_key(old_key, index_key):
+                steps.append((
+                    lambda index=index, index_key=index_key:
+                        index.replace(index_key, pk, record),
+                    lambda index=index, index_key=index_key:
+                        index.replace(index_key, pk, old)))
+            else:
+                steps.append((
+                    lambda index=index, old_key=old_key:
+                        index.remove(old_key, pk),
+                    lambda index=index, old_key=old_key:
+                        index.add(old_key, pk, old)))
+                steps.append((
+                    lambda index=index, index_key=index_key:
+                        index.add(index_key, pk, record),
+                    lambda index=index, index_key=index_key:
+                        index.remove(index_key, pk)))
+        self.__apply(steps)
+        self.records[pk] = record
+        return
+
+    def upsert(self, record):
+        """
+        it.upsert(record)
+
+        Insert record, or update the record with its primary key if one
+        exists.
+        """
+        if self.primary_key(record) in self.records:
+            self.update(record)
+        else:
+            self.insert(record)
+        return
+
+    def delete(self, pk):
+        """
+        it.delete(pk) -> record
+
+        Remove and return the record with primary key pk.  Raises KeyError if
+        there is no such record.
+        """
+        try:
+            record = self.records[pk]
+        except KeyError:
+            raise KeyError("Unknown primary key: %r" % (pk,))
+
+        steps = []
+        for index in self.indexes.values():
+            index_key = index.key(record)
+            steps.append((
+                lambda index=index, index_key=index_key:
+                    index.remove(index_key, pk),
+                lambda index=index, index_key=index_key:
+                    index.add(index_key, pk, record)))
+        self.__apply(steps)
+        del self.records[pk]
+        return record
+
+    def clear(self):
+        """Remove every record, keeping the indexes."""
+        self.records.clear()
+        for index in self.indexes.values():
+            index.tree = RedBlackTree(cmp=index.compare_keys)
+        return
+
+    def get(self, pk, default=None):
+        return self.records.get(pk, default)
+
+    def __getitem__(self, pk):
+        try:
+            return self.records[pk]
+        except KeyError:
+            raise KeyError("Unknown primary key: %r" % (pk,))
+
+    def __contains__(self, pk):
+        return pk in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def find(self, name, key):
+        """
+        it.find(name, key) -> list
+
+        Return the records whose key in the index named name equals key, in
+        the order they were added to the index.
+        """
+        node = self.__index(name).tree.find_node(key)
+        return [] if node is None else list(node.value.values())
+
+    def find_one(self, name, key, default=None):
+        """
+        it.find_one(name, key, default=None) -> record
+
+        Return the first record whose key in the index named name equals key,
+        or default if there is none.  Mainly useful with unique indexes.
+        """
+        node = self.__index(name).tree.find_node(key)
+        if node is None:
+            return default
+        for record in node.value.values():
+            return record
+
+    def iter_range(self, name, start=unspecified, stop=unspecified,
+                   reverse=False):
+        """
+        it.iter_range(name, start=..., stop=..., reverse=False) -> generator
+
+        Iterate over the records in the index named name whose keys lie in
+        range, in index order.  start and stop are interpreted as by
+        RedBlackTree.iteritems().  Records with equal index keys are returned
+        in the order they were added to the index, or the reverse if reverse
+        is True.
+        """
+        tree = self.__index(name).tree
+        for bucket in tree.itervalues(start=start, stop=stop,
+                                      reverse=reverse):
+            if reverse:
+                for pk in reversed(bucket):
+                    yield bucket[pk]
+            else:
+                for record in bucket.values():
+                    yield record
+
+    def range(self, name, start=unspecified, stop=unspecified,
+              reverse=False):
+        """
+        it.range(name, start=..., stop=..., reverse=False) -> list
+
+        Return the records iter_range() would generate.
+        """
+        return list(self.iter_range(name, start=start, stop=stop,
+                                    reverse=reverse))
+
+    def count(self, name, start=unspecified, stop=unspecified):
+        """
+        it.count(name, start=..., stop=...) -> int
+
+        Return the number of records in the index named name whose keys lie in
+        range.
+        """
+        return sum(len(bucket) for bucket in
+                   self.__index(name).tree.itervalues(start=start, stop=stop))
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -1,13 +1,21 @@
 from __future__ import (absolute_import, division, print_function,
                         with_statement)
 from algae.functions import identity
-from functools import partial
+from copy import deepcopy
+from functools import cmp_to_key, partial
 from operator import lt
+import random
+import sys
 from weakref import ref
 
 class RedBlackTree(object):
     unspecified = object()
 
+    # Lazy-delete state; see enable_lazy_delete().
+    lazy_delete = None
+    tombstones = 0
+    node_count = 0
+
     """
     A binary search tree which guarantees that basic operations take place
     in O(lg n) time.  The terminology and basic algorithmic structure is taken
@@ -23,9 +31,11 @@ class RedBlackTree(object):
     5. For each node, all paths from the node to descendant leaves contain the
        same number of black nodes.
 """
-    def __init__(self, init=None, cmp=lt, key=identity):
+    def __init__(self, init=None, cmp=lt, key=identity, balance=None,
+                 lazy_delete=None):
         """
-        RedBlackTree(init=None, cmp=operator.lt, key=identity)
+        RedBlackTree(init=None, cmp=operator.lt, key=identity, balance=None,
+                     lazy_delete=None)
 
         Create a new RedBlackTree.
 
@@ -38,11 +48,26 @@ class RedBlackTree(object):
 
         key specifies a function for obtaining the comparison key from each
         node's key.  The default is the identity function.
+
+        balance specifies how the tree rebalances itself: "red-black" (the
+        default), "avl", "wavl", or a BalancePolicy instance.  AVL trees are
+        at most about 1.44 lg n deep, against 2 lg n for red-black trees, so
+        lookups visit fewer nodes at the cost of more rotations on update.
+        WAVL trees behave like AVL trees until deletions occur, and rotate
+        at most twice per deletion.  Under policies other than red-black,
+        split() and delete_range() take O(n) time.
+
+        lazy_delete, if specified, enables lazy deletion with the given
+        rebuild fraction; see enable_lazy_delete().
         """
         super(RedBlackTree, self).__init__()
         self.root = None
         self.compare_nodes = cmp
         self.get_node_key = key
+        self.balance = balance_policy(balance)
+
+        if lazy_delete is not None:
+            self.enable_lazy_delete(lazy_delete)
 
         if init is not None:
             self.update(init)
@@ -109,6 +134,32 @@ the node must not be None.
         x.parent = y
         return
 
+    def _rotate_left(self, node):
+        """
+        rbt._rotate_left(node)
+
+        Rotate node left, for use by balance policies.
+        """
+        self.__left_rotate(node)
+        return
+
+    def _rotate_right(self, node):
+        """
+        rbt._rotate_right(node)
+
+        Rotate node right, for use by balance policies.
+        """
+        self.__right_rotate(node)
+        return
+
+    def _new_node(self, key, value):
+        """
+        rbt._new_node(key, value) -> RedBlackTreeNode
+
+        Create a node of the class the tree's balance policy uses.
+        """
+        return self.balance.node_class(key, value)
+
     def find_node_floor(self, key):
         """
         rbt.find_node_floor(key) -> RedBlackTreeNode
@@ -132,8 +183,11 @@ the node must not be None.
                 node = node.right
             else:
                 # Exact match; return this node.
-                return node
-        
+                last_smaller_node = node
+                break
+
+        if self.tombstones:
+            return _live_prev(last_smaller_node)
         return last_smaller_node
 
     def find_node_ceil(self, key):
@@ -159,8 +213,11 @@ the node must not be None.
                 node = node.right
             else:
                 # Exact match; return this node.
-                return node
-        
+                last_bigger_node = node
+                break
+
+        if self.tombstones:
+            return _live_next(last_bigger_node)
         return last_bigger_node
 
     def find_node(self, key):
@@ -172,6 +229,25 @@ the node must not be None.
         node = self.root
         key = self.get_node_key(key)
 
+        while node is not None:
+            node_key = self.get_node_key(node.key)
+            if self.compare_nodes(key, node_key):
+                # key < node; move left.
+                node = node.left
+            elif self.compare_nodes(node_key, key):
+                # key > node; move right
+                node = node.right
+            else:
+                # Found it, unless it was deleted lazily.
+                return (None if self.tombstones and node.value is tombstone
+                        else node)
+        return None
+
+    def __find_any(self, key):
+        # Find the node whose key is equal to key, even if it is a tombstone.
+        node = self.root
+        key = self.get_node_key(key)
+
         while node is not None:
             node_key = self.get_node_key(node.key)
             if self.compare_nodes(key, node_key):
@@ -205,8 +281,11 @@ the node must not be None.
         else:
             y.right = z
 
-        z.red = True
-        self.__rb_insert_fixup(z)
+        if self.balance is red_black:
+            z.red = True
+            self.__rb_insert_fixup(z)
+        else:
+            self.balance.insert_fixup(self, z)
         return
 
     def __rb_insert_fixup(self, z):
@@ -270,8 +349,13 @@ the node must not be None.
                     grandparent.red = True
                     self.__left_rotate(grandparent)
                     break
-        self.root.red = False
-        return
+
+        # The root is only red here if case 1 recolored it, in which case
+        # blackening it adds one to the tree's black height.
+        root = self.root
+        grew = root.red
+        root.red = False
+        return grew
 
     def __rb_delete(self, z):
         # y is the actual node we're going to remove.  If it's a live node,
@@ -312,7 +396,9 @@ the node must not be None.
             z.key = y.key
             z.value = y.value
 
-        if not y.red:
+        if self.balance is not red_black:
+            self.balance.delete_fixup(self, x, x_parent, y)
+        elif not y.red:
             self.__rb_delete_fixup(x, x_parent)
         
         return y
@@ -406,6 +492,456 @@ the node must not be None.
             x.red = False
         return
 
+    @staticmethod
+    def __black_height(node):
+        # Count the black nodes on the leftmost path; for a valid subtree,
+        # every path has the same count.
+        height = 0
+        while node is not None:
+            if not node.red:
+                height += 1
+            node = node.left
+        return height
+
+    def __rb_join(self, left, left_height, mid, right, right_height):
+        """
+        Join the subtrees rooted at left and right using mid as the separator,
+        returning the root of the result and its black height.  All keys in
+        left must be less than mid's key, which must be less than all keys in
+        right.  left_height and right_height are the black heights of left
+        and right once their roots are colored black.
+
+        This is the join operation from Tarjan, _Data Structures and Network
+        Algorithms_, pp. 52-53: the shorter tree is hung off the spine of the
+        taller one at the point where the black heights match, and the usual
+        insert fixup restores the invariants.  It runs in
+        O(|bh(left) - bh(right)| + 1) time.
+        """
+        for subtree in (left, right):
+            if subtree is not None:
+                subtree.parent = None
+                subtree.red = False
+
+        mid.parent = None
+        if left_height == right_height:
+            mid.red = False
+            mid.left = left
+            mid.right = right
+            if left is not None:
+                left.parent = mid
+            if right is not None:
+                right.parent = mid
+            return mid, left_height + 1
+
+        # The rotations and fixup need a tree to hold the root; use a scratch
+        # tree so we don't disturb this one.
+        scratch = RedBlackTree.__new__(RedBlackTree)
+        mid.red = True
+
+        if left_height > right_height:
+            # Walk down the right spine of left until we find a black node
+            # with the same black height as right.
+            scratch.root = left
+            parent = None
+            node = left
+            height = left_height
+            while node is not None and (node.red or height > right_height):
+                if not node.red:
+                    height -= 1
+                parent = node
+                node = node.right
+
+            mid.left = node
+            mid.right = right
+            parent.right = mid
+        else:
+            # Mirror image: walk down the left spine of right.
+            scratch.root = right
+            parent = None
+            node = right
+            height = right_height
+            while node is not None and (node.red or height > left_height):
+                if not node.red:
+                    height -= 1
+                parent = node
+                node = node.left
+
+            mid.left = left
+            mid.right = node
+            parent.left = mid
+
+        mid.parent = parent
+        if mid.left is not None:
+            mid.left.parent = mid
+        if mid.right is not None:
+            mid.right.parent = mid
+
+        grew = scratch.__rb_insert_fixup(mid)
+        height = max(left_height, right_height)
+        return scratch.root, height + 1 if grew else height
+
+    @staticmethod
+    def __blackened_height(node):
+        # The black height of the subtree rooted at node once its root is
+        # colored black.
+        if node is None:
+            return 0
+        height = RedBlackTree.__black_height(node)
+        return height + 1 if node.red else height
+
+    def __rb_split(self, node, key, inclusive):
+        """
+        Split the subtree rooted at node into two subtrees: the first holds
+        the nodes whose keys are less than key (or equal to it, if inclusive
+        is True), the second holds the rest.  Returns the pair of roots.
+
+        The black height of each subtree is carried down the recursion
+        rather than recounted for each join, so the joins' costs telescope
+        and the split takes O(lg n) time.
+        """
+        lesser, lesser_height, greater, greater_height = \
+            self.__rb_split_heights(node, RedBlackTree.__black_height(node),
+                                    key, inclusive)
+        return lesser, greater
+
+    def __rb_split_heights(self, node, height, key, inclusive):
+        # Split the subtree rooted at node, whose black height is height,
+        # returning (lesser, lesser_height, greater, greater_height) with
+        # the heights of the results once their roots are colored black.
+        if node is None:
+            return None, 0, None, 0
+
+        left, right = node.left, node.right
+        node_key = self.get_node_key(node.key)
+        child_height = height if node.red else height - 1
+
+        if (self.compare_nodes(key, node_key) or
+            (not inclusive and not self.compare_nodes(node_key, key))):
+            # node belongs to the upper half, and so does its right subtree.
+            lesser, lesser_height, greater, greater_height = \
+                self.__rb_split_heights(left, child_height, key, inclusive)
+            if right is not None and right.red:
+                child_height += 1
+            greater, greater_height = self.__rb_join(
+                greater, greater_height, node, right, child_height)
+        else:
+            # node belongs to the lower half, and so does its left subtree.
+            lesser, lesser_height, greater, greater_height = \
+                self.__rb_split_heights(right, child_height, key, inclusive)
+            if left is not None and left.red:
+                child_height += 1
+            lesser, lesser_height = self.__rb_join(
+                left, child_height, node, lesser, lesser_height)
+        return lesser, lesser_height, greater, greater_height
+
+    def _new_like(self):
+        """
+        rbt._new_like() -> RedBlackTree
+
+        Create an empty tree with the same ordering and settings as this one.
+        Subclasses holding external resources should override this, using
+        ordering() to get the cmp and key functions.
+        """
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        result.root = None
+        return result
+
+    def ordering(self):
+        """
+        rbt.ordering() -> (cmp, key)
+
+        Return the cmp and key functions the tree was created with.
+        """
+        return self.compare_nodes, self.get_node_key
+
+    def split(self, key, inclusive=False):
+        """
+        rbt.split(key, inclusive=False) -> RedBlackTree
+
+        Remove every node whose key is less than the specified key (or less
+        than or equal to it, if inclusive is True) and return them in a new
+        tree.  The remaining nodes stay in this tree.
+
+        This is a range cut: it runs in O(lg n) time no matter how many nodes
+        are moved, and makes no copies of the nodes.  (Under balance policies
+        other than red-black, the nodes are relinked in O(n) time instead.
+        With lazy deletion enabled, counting the nodes moved takes O(k) time
+        for k nodes.)
+        """
+        key = self.get_node_key(key)
+        if self.balance is red_black:
+            lesser, greater = self.__rb_split(self.root, key, inclusive)
+        else:
+            lesser, greater = self.__relink_split(key, inclusive)
+        result = self._new_like()
+        result.root = lesser
+        self.root = greater
+        self.__move_counts(result)
+        return result
+
+    def delete_range(self, start=unspecified, stop=unspecified):
+        """
+        rbt.delete_range(start=..., stop=...) -> RedBlackTree
+
+        Remove every node whose key is greater than or equal to start and
+        less than stop and return them in a new tree.  If start or stop is
+        unspecified, the range is unbounded on that side.
+
+        This is two splits and a join: it runs in O(lg n) time no matter how
+        many nodes are removed.  (Under balance policies other than red-black,
+        the nodes are relinked in O(n) time instead.  With lazy deletion
+        enabled, counting the nodes removed takes O(k) time for k nodes.)
+        """
+        if self.balance is not red_black:
+            removed, kept = [], []
+            get_node_key = self.get_node_key
+            compare_nodes = self.compare_nodes
+            low = (None if start is RedBlackTree.unspecified
+                   else get_node_key(start))
+            high = (None if stop is RedBlackTree.unspecified
+                    else get_node_key(stop))
+            for node in generate_range(self):
+                node_key = get_node_key(node.key)
+                if ((low is None or not compare_nodes(node_key, low)) and
+                    (high is None or compare_nodes(node_key, high))):
+                    removed.append(node)
+                else:
+                    kept.append(node)
+            self.root = self._link_balanced(kept)
+            result = self._new_like()
+            result.root = result._link_balanced(removed)
+            self.__move_counts(result)
+            return result
+
+        if start is RedBlackTree.unspecified:
+            lesser, rest = None, self.root
+        else:
+            lesser, rest = self.__rb_split(
+                self.root, self.get_node_key(start), False)
+
+        if stop is RedBlackTree.unspecified:
+            removed, greater = rest, None
+        else:
+            removed, greater = self.__rb_split(
+                rest, self.get_node_key(stop), False)
+
+        self.root = self.__rb_concat(lesser, greater)
+        result = self._new_like()
+        result.root = removed
+        self.__move_counts(result)
+        return result
+
+    def __move_counts(self, result):
+        """
+        Update the lazy-delete counts after the nodes of result were taken
+        from this tree.  Relinking under other balance policies drops
+        tombstones, so both trees are recounted in that case.
+        """
+        if self.lazy_delete is None:
+            return
+        result.node_count, result.tombstones = _count_nodes(result.root)
+        if self.balance is red_black:
+            self.node_count -= result.node_count
+            self.tombstones -= result.tombstones
+        else:
+            self.node_count, self.tombstones = _count_nodes(self.root)
+        return
+
+    def __relink_split(self, key, inclusive):
+        """
+        Split the tree as __rb_split does, by collecting its nodes in order
+        and linking each half into a new balanced tree.  This is the O(n)
+        fallback for balance policies without an O(lg n) join.
+        """
+        lesser, greater = [], []
+        get_node_key = self.get_node_key
+        compare_nodes = self.compare_nodes
+        for node in generate_range(self):
+            node_key = get_node_key(node.key)
+            if (compare_nodes(node_key, key) or
+                (inclusive and not compare_nodes(key, node_key))):
+                lesser.append(node)
+            else:
+                greater.append(node)
+        return self._link_balanced(lesser), self._link_balanced(greater)
+
+    def __rb_concat(self, left, right):
+        """
+        Join the subtrees rooted at left and right, all of whose keys are less
+        than all of right's, returning the root of the result.  The smallest
+        node of right is detached to serve as the separator for __rb_join.
+        """
+        if left is None:
+            return right
+        if right is None:
+            return left
+
+        mid = right
+        while mid.left is not None:
+            mid = mid.left
+
+        # The separator has no left child, so deleting it splices out the
+        # node itself rather than moving a successor's contents into it.
+        scratch = RedBlackTree.__new__(RedBlackTree)
+        scratch.balance = red_black
+        scratch.root = right
+        right.parent = None
+        scratch.__rb_delete(mid)
+        right = scratch.root
+        return self.__rb_join(
+            left, RedBlackTree.__blackened_height(left), mid,
+            right, RedBlackTree.__blackened_height(right))[0]
+
+    def iter_chunks(self, start=unspecified, stop=unspecified, size=1000,
+                    reverse=False):
+        """
+        rbt.iter_chunks(start=..., stop=..., size=1000, reverse=False)
+            -> RangeCursor
+
+        Iterate over the (key, value) pairs in range, as iteritems() does, in
+        lists of up to size items.  Each chunk is found afresh from the last
+        key of the one before, so the tree may be modified between chunks:
+        items inserted ahead of the cursor are seen, and deleted ones are
+        not.
+        """
+        return RangeCursor(self, start, stop, size, reverse)
+
+    def aiter_items(self, start=unspecified, stop=unspecified, chunk_size=1000,
+                    reverse=False):
+        """
+        rbt.aiter_items(start=..., stop=..., chunk_size=1000, reverse=False)
+            -> AsyncRangeIterator
+
+        Return an asynchronous iterator over the (key, value) pairs in range,
+        for use with "async for".  Items are fetched chunk_size at a time, as
+        by iter_chunks(), and control returns to the event loop before each
+        chunk after the first, so long ranges don't stall it.  Changes made
+        to the tree show up from the next chunk on.
+
+        This needs Python 3.5 or later.
+        """
+        return AsyncRangeIterator(self.iter_chunks(start, stop, chunk_size,
+                                                   reverse))
+
+    def nearest(self, key, k=1, distance=None):
+        """
+        rbt.nearest(key, k=1, distance=None) -> list
+
+        Return up to k (key, value) pairs whose keys are nearest the specified
+        key, nearest first; ties go to the smaller key.  distance(a, b) gives
+        the distance between two keys and defaults to abs(a - b).  It must
+        not decrease as keys get further from key in either direction.
+
+        The search starts at the floor of key and steps outward to
+        predecessors and successors, so this takes O(lg n + k) time.
+        """
+        lower = self.find_node_floor(key)
+        return self.__nearest_from(lower, key, k, distance)
+
+    def nearest_many(self, keys, k=1, distance=None):
+        """
+        rbt.nearest_many(keys, k=1, distance=None) -> list
+
+        Return nearest(key, k, distance) for each of the specified keys, in
+        order.  The keys are visited in sorted order so that each search can
+        step forward from the previous one's position rather than descending
+        from the root, which is faster for probes that are close together.
+        """
+        keys = list(keys)
+        get_node_key = self.get_node_key
+        compare_nodes = self.compare_nodes
+
+        def three_way(a, b):
+            return -1 if compare_nodes(a, b) else (
+                1 if compare_nodes(b, a) else 0)
+
+        order = sorted(range(len(keys)), key=cmp_to_key(
+            lambda i, j: three_way(get_node_key(keys[i]),
+                                   get_node_key(keys[j]))))
+
+        # Stepping more than this many nodes forward is no faster than a
+        # fresh descent.
+        max_steps = 2 * self.__black_height(self.root) + 2
+        results = [None] * len(keys)
+        lower = None
+        for i in order:
+            key = keys[i]
+            probe = get_node_key(key)
+            if lower is None:
+                lower = self.find_node_floor(key)
+            else:
+                steps = 0
+                node = _live_next(lower.next_node)
+                while (node is not None and steps < max_steps and
+                       not compare_nodes(probe, get_node_key(node.key))):
+                    lower = node
+                    node = _live_next(node.next_node)
+                    steps += 1
+                if steps == max_steps:
+                    lower = self.find_node_floor(key)
+            results[i] = self.__nearest_from(lower, key, k, distance)
+        return results
+
+    def __nearest_from(self, lower, key, k, distance):
+        # lower is the floor of key, or None if key precedes every node.
+        if distance is None:
+            distance = _absolute_distance
+        if lower is None:
+            upper = self.first_node()
+        else:
+            upper = _live_next(lower.next_node)
+
+        result = []
+        while len(result) < k:
+            if lower is None:
+                if upper is None:
+                    break
+                node = upper
+            elif upper is None:
+                node = lower
+            elif distance(upper.key, key) < distance(lower.key, key):
+                node = upper
+            else:
+                node = lower
+
+            result.append((node.key, node.value))
+            if node is lower:
+                lower = _live_prev(lower.prev_node)
+            else:
+                upper = _live_next(upper.next_node)
+        return result
+
+    def iter_prefix(self, prefix):
+        """
+        rbt.iter_prefix(prefix) -> generator
+
+        Iterate over the (key, value) pairs whose keys start with prefix,
+        which must be a str, bytes or tuple.  Only the matching nodes are
+        visited, so this takes O(lg n + k) time for k matches.
+
+        Prefix scans assume the tree uses the natural ordering of its keys
+        (the default cmp and key functions).
+        """
+        return self.iteritems(start=prefix, stop=prefix_upper_bound(prefix))
+
+    def count_prefix(self, prefix):
+        """
+        rbt.count_prefix(prefix) -> int
+
+        Return the number of keys starting with prefix, in O(lg n + k) time.
+        """
+        return sum(1 for item in self.iter_prefix(prefix))
+
+    def delete_prefix(self, prefix):
+        """
+        rbt.delete_prefix(prefix) -> RedBlackTree
+
+        Remove every node whose key starts with prefix and return them in a
+        new tree, in O(lg n) time; see delete_range().
+        """
+        return self.delete_range(prefix, prefix_upper_bound(prefix))
+
     def __getitem__(self, key):
         node = self.find_node(key)
         if node is None:
@@ -414,9 +950,16 @@ the node must not be None.
     
     def __setitem__(self, key, value):
         node = self.find_node(key)
+        if node is None and self.tombstones:
+            node = self.__find_any(key)
+            if node is not None:
+                # Revive the tombstone in place.
+                self.tombstones -= 1
         if node is None:
-            node = RedBlackTreeNode(key, value)
+            node = self._new_node(key, value)
             self.__rb_insert(node)
+            if self.lazy_delete is not None:
+                self.node_count += 1
         else:
             node.value = value
         return
@@ -428,28 +971,214 @@ the node must not be None.
         node = self.find_node(key)
         if node is None:
             raise KeyError("Unknown key: %r" % (key,))
-        self.__rb_delete(node)
+        if self.lazy_delete is None:
+            self.__rb_delete(node)
+            return
+
+        node.value = tombstone
+        self.tombstones += 1
+        if self.tombstones > self.lazy_delete * self.node_count:
+            self.__purge_tombstones()
+        return
+
+    def __purge_tombstones(self):
+        # Relink the live nodes into a balanced tree, dropping tombstones.
+        nodes = list(generate_range(self))
+        self.root = self._link_balanced(nodes)
+        self.node_count = len(nodes)
+        self.tombstones = 0
+        return
+
+    def enable_lazy_delete(self, fraction=0.5):
+        """
+        rbt.enable_lazy_delete(fraction=0.5)
+
+        Delete keys lazily from now on.  Instead of unlinking its node and
+        rebalancing, deleting a key marks the node as a tombstone, which
+        takes one O(lg n) search and no rotations.  Lookups and iteration
+        skip tombstones, and assigning to a deleted key revives its node.
+
+        Once tombstones make up more than fraction of the nodes, which must
+        be between 0 and 1, the tree relinks its live nodes into a balanced
+        tree in O(n) time, so each deletion costs O(lg n) amortized time.
+        Lazy deletion suits delete-heavy workloads, where the search paths
+        it lengthens matter less than the rebalancing it saves.
+
+        Enabling lazy deletion counts the nodes in O(n) time.
+        """
+        if not 0 < fraction < 1:
+            raise ValueError("fraction must be between 0 and 1: %r" %
+                             (fraction,))
+        if self.lazy_delete is None:
+            self.node_count, self.tombstones = _count_nodes(self.root)
+        self.lazy_delete = fraction
+        return
+
+    def disable_lazy_delete(self):
+        """
+        rbt.disable_lazy_delete()
+
+        Delete keys eagerly from now on, first rebuilding the tree without
+        any tombstones it holds.
+        """
+        if self.lazy_delete is None:
+            return
+        if self.tombstones:
+            self.__purge_tombstones()
+        self.lazy_delete = None
+        self.tombstones = 0
+        self.node_count = 0
+        return
+
+    def iterkeys(self, start=unspecified, reverse=False, stop=unspecified):
+        return generate_range(self, lambda n: n.key, start, stop, reverse)
+
+    def itervalues(self, start=unspecified, reverse=False, stop=unspecified):
+        return generate_range(self, lambda n: n.value, start, stop, reverse)
+
+    def iteritems(self, start=unspecified, reverse=False, stop=unspecified):
+        return generate_range(self, lambda n: (n.key, n.value), start, stop,
+                              reverse)
+
+    def keys(self, start=unspecified, reverse=False, stop=unspecified):
+        return list(self.iterkeys(start=start, stop=stop, reverse=reverse))
+
+    def values(self, start=unspecified, reverse=False, stop=unspecified):
+        return list(self.itervalues(start=start, stop=stop, reverse=reverse))
+
+    def items(self, start=unspecified, reverse=False, stop=unspecified):
+        return list(self.iteritems(start=start, stop=stop, reverse=reverse))
+
+    def first_node(self):
+        """
+        rbt.first_node() -> RedBlackTreeNode
+
+        Return the node with the smallest key, or None if the tree is empty.
+        """
+        node = self.root
+        if node is not None:
+            while node.left is not None:
+                node = node.left
+        if self.tombstones:
+            return _live_next(node)
+        return node
+
+    def last_node(self):
+        """
+        rbt.last_node() -> RedBlackTreeNode
+
+        Return the node with the largest key, or None if the tree is empty.
+        """
+        node = self.root
+        if node is not None:
+            while node.right is not None:
+                node = node.right
+        if self.tombstones:
+            return _live_prev(node)
+        return node
+
+    def copy(self, start=unspecified, stop=unspecified):
+        """
+        rbt.copy(start=..., stop=...) -> RedBlackTree
+
+        Return a shallow copy of the tree.
+
+        A full copy clones the node structure directly in O(n) time,
+        preserving its shape and colors, without comparing any keys.
+
+        If start or stop is specified, only the nodes whose keys are at least
+        start and less than stop are copied.  The copy is built as a balanced
+        tree directly from those nodes, so this takes O(lg n + k) time for k
+        copied nodes.
+        """
+        result = self._new_like()
+        if (start is RedBlackTree.unspecified and
+            stop is RedBlackTree.unspecified):
+            result.root = self.__clone(self.root, identity)
+        else:
+            result.root = result._link_balanced([
+                result._new_node(key, value)
+                for key, value in self.iteritems(start=start, stop=stop)])
+            if self.lazy_delete is not None:
+                result.node_count, result.tombstones = \
+                    _count_nodes(result.root)
+        return result
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        result = self._new_like()
+        memo[id(self)] = result
+        result.root = self.__clone(self.root,
+                                   lambda obj: deepcopy(obj, memo))
+        return result
 
-    def iterkeys(self, start=unspecified, reverse=False):
-        return generate_nodes(self, self.root, lambda n: n.key,
-                              self.get_node_key(start), reverse)
+    @staticmethod
+    def __clone(root, copy_object):
+        # Clone the subtree rooted at root, node for node.  Keys and values
+        # are passed through copy_object.
+        if root is None:
+            return None
 
-    def itervalues(self, start=unspecified, reverse=False):
-        return generate_nodes(self, self.root, lambda n: n.value,
-                              self.get_node_key(start), reverse)
+        new_root = root.clone(copy_object(root.key), copy_object(root.value))
+        stack = [(root, new_root)]
+        while stack:
+            node, new_node = stack.pop()
+            left = node.left
+            if left is not None:
+                new_left = left.clone(copy_object(left.key),
+                                      copy_object(left.value))
+                new_left.parent = new_node
+                new_node.left = new_left
+                stack.append((left, new_left))
+
+            right = node.right
+            if right is not None:
+                new_right = right.clone(copy_object(right.key),
+                                        copy_object(right.value))
+                new_right.parent = new_node
+                new_node.right = new_right
+                stack.append((right, new_right))
+
+        return new_root
+
+    def _link_balanced(self, nodes):
+        """
+        rbt._link_balanced(nodes) -> RedBlackTreeNode
 
-    def iteritems(self, start=unspecified, reverse=False):
-        return generate_nodes(self, self.root, lambda n: (n.key, n.value),
-                              self.get_node_key(start), reverse)
+        Link a list of nodes, sorted by key, into a balanced tree and return
+        its root.  No comparisons are made, and this takes O(n) time.
 
-    def keys(self, start=unspecified, reverse=False):
-        return list(self.iterkeys(start=start, reverse=reverse))
+        Every level but the deepest is full.  If the deepest level is
+        incomplete, its nodes are colored red and the rest black; otherwise,
+        every node is black.  Either way, every path has the same black height.
+        Under other balance policies, the policy's link_node() is called on
+        each node once its children are linked.
+        """
+        count = len(nodes)
+        if count == 0:
+            return None
 
-    def values(self, start=unspecified, reverse=False):
-        return list(self.itervalues(start=start, reverse=reverse))
+        max_depth = count.bit_length() - 1
+        full = (count & (count + 1)) == 0
+        link_node = None if self.balance is red_black else \
+            self.balance.link_node
 
-    def items(self, start=unspecified, reverse=False):
-        return list(self.iteritems(start=start, reverse=reverse))
+        def link(low, high, depth, parent):
+            if low >= high:
+                return None
+            mid = (low + high) // 2
+            node = nodes[mid]
+            node.parent = parent
+            node.red = depth == max_depth and not full
+            node.left = link(low, mid, depth + 1, node)
+            node.right = link(mid + 1, high, depth + 1, node)
+            if link_node is not None:
+                link_node(node)
+            return node
+
+        return link(0, count, 0, None)
 
     def max(self, key=unspecified):
         """
@@ -461,15 +1190,11 @@ the node must not be None.
         """
 
         if key is RedBlackTree.unspecified:
-            node = self.root
-            if node is None:
-                return None
-            while node.right is not None:
-                node = node.right
+            node = self.last_node()
         else:
             node = self.find_node_ceil(key)
-            if node is None:
-                return None
+        if node is None:
+            return None
         return (node.key, node.value)
 
     def min(self, key=unspecified):
@@ -481,15 +1206,11 @@ the node must not be None.
         (key, value) in the tree is returned.
         """
         if key is RedBlackTree.unspecified:
-            node = self.root
-            if node is None:
-                return None
-            while node.left is not None:
-                node = node.left
+            node = self.first_node()
         else:
             node = self.find_node_floor(key)
-            if node is None:
-                return None
+        if node is None:
+            return None
         return (node.key, node.value)
 
     def update(self, obj):
@@ -504,6 +1225,365 @@ the node must not be None.
                 self[key] = value
         return
 
+    def verify(self, sample=None, rng=None):
+        """
+        rbt.verify(sample=None, rng=random) -> int
+
+        Check the tree's invariants, raising AssertionError if any are
+        violated, and return the number of nodes checked.
+
+        The check covers key ordering (using the tree's cmp and key
+        functions), node colors, black heights, parent links, and any fields
+        checked by _verify_node().  Under balance policies other than
+        red-black, the policy's verify_node() checks the balance in place of
+        colors and black heights.  With lazy deletion enabled, the node and
+        tombstone counts are checked too.  It runs iteratively in O(n) time,
+        so it is usable on trees of any size or shape.
+
+        If sample is specified, only that many random root-to-leaf paths are
+        checked instead, taking O(sample * lg n) time.  Each node on a path
+        is checked against the key bounds set by its ancestors, the links and
+        colors of its children, and the black height of the tree.  rng
+        specifies the random number generator to use.
+        """
+        root = self.root
+        if root is None:
+            return 0
+
+        if root.parent is not None:
+            raise AssertionError("root node %d has a parent" % id(root))
+        if root.red:
+            raise AssertionError("root node %d is red" % id(root))
+
+        if sample is not None:
+            return self.__verify_sample(sample, rng)
+
+        get_node_key = self.get_node_key
+        compare_nodes = self.compare_nodes
+        verify_node = self._verify_node
+        verify_balance = self.__balance_verifier()
+        expected_height = RedBlackTree.__black_height(root)
+        checked = 0
+        tombstones = 0
+        previous_key = RedBlackTree.unspecified
+
+        # In-order traversal; each stack entry carries the number of black
+        # nodes from the root to that node, inclusive.
+        stack = []
+        node = root
+        height = 0
+        while stack or node is not None:
+            while node is not None:
+                if not node.red:
+                    height += 1
+                self.__verify_links(node)
+                if verify_balance is not None:
+                    verify_balance(node)
+                else:
+                    for child in (node.left, node.right):
+                        if child is None and height != expected_height:
+                            raise AssertionError(
+                                "black height %d below node %d does not "
+                                "match tree black height %d" %
+                                (height, id(node), expected_height))
+                verify_node(node)
+                stack.append((node, height))
+                node = node.left
+
+            node, height = stack.pop()
+            node_key = get_node_key(node.key)
+            if (previous_key is not RedBlackTree.unspecified and
+                not compare_nodes(previous_key, node_key)):
+                raise AssertionError("node %d is out of order: %r follows %r" %
+                                     (id(node), node.key, previous_node.key))
+            previous_key = node_key
+            previous_node = node
+            checked += 1
+            if node.value is tombstone:
+                tombstones += 1
+            node = node.right
+
+        if self.lazy_delete is not None:
+            if checked != self.node_count:
+                raise AssertionError("tree has %d nodes but counts %d" %
+                                     (checked, self.node_count))
+            if tombstones != self.tombstones:
+                raise AssertionError("tree has %d tombstones but counts %d" %
+                                     (tombstones, self.tombstones))
+        return checked
+
+    def __verify_links(self, node):
+        # Check that node's children point back to it and that a red node has
+        # no red children.
+        for child in (node.left, node.right):
+            if child is not None:
+                if child.parent is not node:
+                    raise AssertionError(
+                        "parent inconsistency on %d" % id(child))
+                if node.red and child.red:
+                    raise AssertionError(
+                        "red node %d has a red child %d" %
+                        (id(node), id(child)))
+        return
+
+    def __balance_verifier(self):
+        # The balance policy's node check, or None to check colors and black
+        # heights.
+        if self.balance is red_black:
+            return None
+        return self.balance.verify_node
+
+    def __verify_sample(self, sample, rng):
+        if rng is None:
+            rng = random
+        get_node_key = self.get_node_key
+        compare_nodes = self.compare_nodes
+        verify_node = self._verify_node
+        verify_balance = self.__balance_verifier()
+        expected_height = RedBlackTree.__black_height(self.root)
+        checked = 0
+
+        for i in range(sample):
+            node = self.root
+            height = 0
+            low = high = None
+            while node is not None:
+                node_key = get_node_key(node.key)
+                if low is not None and not compare_nodes(low, node_key):
+                    raise AssertionError(
+                        "node %d is out of order: %r is not above %r" %
+                        (id(node), node.key, low))
+                if high is not None and not compare_nodes(node_key, high):
+                    raise AssertionError(
+                        "node %d is out of order: %r is not below %r" %
+                        (id(node), node.key, high))
+
+                if not node.red:
+                    height += 1
+                self.__verify_links(node)
+                if verify_balance is not None:
+                    verify_balance(node)
+                elif ((node.left is None or node.right is None) and
+                      height != expected_height):
+                    raise AssertionError(
+                        "black height %d below node %d does not match "
+                        "tree black height %d" %
+                        (height, id(node), expected_height))
+                verify_node(node)
+                checked += 1
+
+                if rng.random() < 0.5:
+                    high = node_key
+                    node = node.left
+                else:
+                    low = node_key
+                    node = node.right
+
+        return checked
+
+    def _verify_node(self, node):
+        """
+        rbt._verify_node(node)
+
+        Called by verify() on each node checked.  Subclasses which keep
+        additional fields on their nodes should override this to check them,
+        raising AssertionError on failure.
+        """
+        return
+
+    # Statistics are collected by InstrumentedRedBlackTree; see enable_stats().
+    stats_enabled = False
+
+    def enable_stats(self):
+        """
+        rbt.enable_stats()
+
+        Start collecting operation statistics for this tree.
+
+        This switches the tree's class to an instrumented subclass and wraps
+        its cmp and key functions with counting versions.  Trees which have
+        not had statistics enabled run the uninstrumented code and pay no
+        overhead.
+        """
+        if self.stats_enabled:
+            return
+
+        self._stats_class = self.__class__
+        self._stats_functions = (self.compare_nodes, self.get_node_key)
+        self._stats = {}
+        self.__class__ = instrumented_class(self.__class__)
+        self.reset_stats()
+
+        counters = self._stats
+        compare_nodes, get_node_key = self._stats_functions
+
+        def counted_compare_nodes(a, b):
+            counters["comparisons"] += 1
+            return compare_nodes(a, b)
+
+        def counted_get_node_key(key):
+            counters["key_calls"] += 1
+            return get_node_key(key)
+
+        self.compare_nodes = counted_compare_nodes
+        self.get_node_key = counted_get_node_key
+        return
+
+    def disable_stats(self):
+        """
+        rbt.disable_stats()
+
+        Stop collecting statistics, restoring the uninstrumented class and
+        functions.  The collected statistics are discarded.
+        """
+        if not self.stats_enabled:
+            return
+
+        self.__class__ = self._stats_class
+        self.compare_nodes, self.get_node_key = self._stats_functions
+        del self._stats_class, self._stats_functions, self._stats
+        return
+
+    def reset_stats(self):
+        """
+        rbt.reset_stats()
+
+        Reset the operation counters to zero.  This does nothing if
+        statistics are not enabled.
+        """
+        return
+
+    def stats(self):
+        """
+        rbt.stats() -> dict
+
+        Return statistics about the tree.  The following are always present:
+            enabled             Whether operation counters are being kept.
+            size                The number of nodes, including tombstones.
+            height              The number of nodes on the longest path from
+                                the root to a leaf.
+            depth_histogram     A dict mapping each depth (the root is at
+                                depth 0) to the number of nodes at that depth.
+
+        If lazy deletion is enabled, the following is also present:
+            tombstones          The number of nodes deleted lazily and not
+                                yet removed; see enable_lazy_delete().
+
+        If statistics are enabled, the following counters are also present:
+            comparisons         Calls to the cmp function.
+            key_calls           Calls to the key function.
+            left_rotations, right_rotations
+                                Rotations performed while rebalancing.
+            insert_fixup_cases  A dict mapping insert fixup cases 1-3 to the
+                                number of times each was applied.
+            delete_fixup_cases  A dict mapping delete fixup cases 1-4 to the
+                                number of times each was applied.
+                                Rotations and fixups made while joining
+                                subtrees in split(), delete_range() and
+                                delete_prefix() are not counted.
+            lookups             Descents made by find_node, find_node_floor
+                                and find_node_ceil, including those made on
+                                behalf of item access, assignment and deletion.
+            nodes_visited       Nodes visited by those descents.
+            visit_histogram     A dict mapping a per-lookup visit count to the
+                                number of lookups which visited that many
+                                nodes.
+        """
+        histogram = {}
+        size = 0
+        tombstones = 0
+        height = 0
+        stack = []
+        if self.root is not None:
+            stack.append((self.root, 0))
+
+        while stack:
+            node, depth = stack.pop()
+            size += 1
+            if node.value is tombstone:
+                tombstones += 1
+            histogram[depth] = histogram.get(depth, 0) + 1
+            if depth + 1 > height:
+                height = depth + 1
+            if node.left is not None:
+                stack.append((node.left, depth + 1))
+            if node.right is not None:
+                stack.append((node.right, depth + 1))
+
+        result = {"enabled": self.stats_enabled, "size": size,
+                  "height": height, "depth_histogram": histogram}
+        if self.lazy_delete is not None:
+            result["tombstones"] = tombstones
+        return result
+
+    def memory_usage(self, deep=False):
+        """
+        rbt.memory_usage(deep=False) -> dict
+
+        Return an estimate of the memory held by the tree, in bytes, as
+        reported by sys.getsizeof():
+            nodes               The number of nodes, including tombstones.
+            node_bytes          The RedBlackTreeNode objects.
+            weakref_bytes       The weak references nodes use to point to
+                                their parents.  Children of a node share one
+                                weak reference to it, so there is one for each
+                                node with a child.
+            tree_bytes          The tree object and its attribute dict.
+            payload_bytes       If deep is True, the keys and values, not
+                                counting objects they refer to; an object used
+                                as several keys or values is counted each
+                                time.  None if deep is False.
+            total_bytes         The sum of the above.
+
+        The nodes are visited in place, in O(n) time and O(1) extra space.
+        """
+        nodes = 0
+        parents = 0
+        payload = 0
+        node = self.root
+        if node is not None:
+            while node.left is not None:
+                node = node.left
+        while node is not None:
+            nodes += 1
+            if node.left is not None or node.right is not None:
+                parents += 1
+            if deep:
+                payload += sys.getsizeof(node.key)
+                payload += sys.getsizeof(node.value)
+            node = node.next_node
+
+        node_bytes = 0
+        weakref_bytes = 0
+        if self.root is not None:
+            node_bytes = nodes * sys.getsizeof(self.root)
+            weakref_bytes = parents * sys.getsizeof(ref(self.root))
+        tree_bytes = sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+
+        return {"nodes": nodes, "node_bytes": node_bytes,
+                "weakref_bytes": weakref_bytes, "tree_bytes": tree_bytes,
+                "payload_bytes": payload if deep else None,
+                "total_bytes": (node_bytes + weakref_bytes + tree_bytes +
+                                payload)}
+
+    def compact(self):
+        """
+        rbt.compact()
+
+        Rebuild the tree from freshly allocated nodes in a perfectly balanced
+        layout, in O(n) time and without comparisons.  After heavy deletion,
+        this shortens search paths and lets the nodes be allocated together
+        again.  Tombstones left by lazy deletion are dropped.  Nodes obtained
+        from the tree beforehand are no longer part of it.
+        """
+        nodes = [self._new_node(key, value)
+                 for key, value in self.iteritems()]
+        self.root = self._link_balanced(nodes)
+        if self.lazy_delete is not None:
+            self.node_count = len(nodes)
+            self.tombstones = 0
+        return
+
     def __repr__(self):
         return ("{" + ", ".join([repr(key) + ": " + repr(value)
                                  for key, value in self.iteritems()]) + "}")
@@ -542,13 +1622,362 @@ def generate_nodes(tree, node, transform=identity,
         if is_valid:
             for child in generate_nodes(tree, left, transform, start, reverse):
                 yield child
-            yield transform(node)
+            if node.value is not tombstone:
+                yield transform(node)
         
         # However, even if the current node's key is less than the start key,
         # the right subtree might contain valid elements.
         for child in generate_nodes(tree, right, transform, start, reverse):
             yield child
 
+def _absolute_distance(a, b):
+    return abs(a - b)
+
+class Tombstone(object):
+    """
+    The value of a node which has been deleted lazily.  See
+    RedBlackTree.enable_lazy_delete().
+    """
+    def __reduce__(self):
+        # Unpickle and copy as the module's singleton.
+        return "tombstone"
+
+    def __repr__(self):
+        return "tombstone"
+
+tombstone = Tombstone()
+
+def _live_next(node):
+    # Return node, or the first node after it which isn't a tombstone.
+    while node is not None and node.value is tombstone:
+        node = node.next_node
+    return node
+
+def _live_prev(node):
+    # Return node, or the last node before it which isn't a tombstone.
+    while node is not None and node.value is tombstone:
+        node = node.prev_node
+    return node
+
+def _count_nodes(root):
+    # Return the number of nodes and tombstones in the subtree at root.
+    nodes = 0
+    tombstones = 0
+    stack = [] if root is None else [root]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        if node.value is tombstone:
+            tombstones += 1
+        if node.left is not None:
+            stack.append(node.left)
+        if node.right is not None:
+            stack.append(node.right)
+    return nodes, tombstones
+
+class PrefixEnd(object):
+    """
+    Compares greater than every object but itself.  Appended to a tuple
+    prefix, it gives a bound greater than every tuple with that prefix.
+    """
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return other is self
+
+    def __gt__(self, other):
+        return other is not self
+
+    def __ge__(self, other):
+        return True
+
+    def __eq__(self, other):
+        return other is self
+
+    def __ne__(self, other):
+        return other is not self
+
+    def __hash__(self):
+        return id(self)
+
+    def __reduce__(self):
+        # Unpickle as the module's singleton.
+        return "prefix_end"
+
+    def __repr__(self):
+        return "prefix_end"
+
+prefix_end = PrefixEnd()
+
+if sys.version_info[0] >= 3:
+    _unichr = chr
+else:
+    _unichr = unichr
+
+def prefix_upper_bound(prefix):
+    """
+    prefix_upper_bound(prefix) -> bound
+
+    Return the least value greater than every str, bytes or tuple starting
+    with prefix, or RedBlackTree.unspecified if there is no such value (the
+    prefix consists entirely of the largest possible characters).
+    """
+    if isinstance(prefix, tuple):
+        return prefix + (prefix_end,)
+
+    if isinstance(prefix, bytes):
+        codes = bytearray(prefix)
+        limit = 0xff
+    elif isinstance(prefix, type(u"")):
+        codes = [ord(c) for c in prefix]
+        limit = sys.maxunicode
+    else:
+        raise TypeError("Prefix must be a str, bytes or tuple: %r" %
+                        (prefix,))
+
+    # Drop trailing characters that can't be incremented, then increment the
+    # last one left.
+    while codes and codes[-1] == limit:
+        codes.pop()
+    if not codes:
+        return RedBlackTree.unspecified
+    codes[-1] += 1
+
+    if isinstance(prefix, bytes):
+        return bytes(codes)
+    return u"".join([_unichr(code) for code in codes])
+
+class RangeCursor(object):
+    """
+    Walks a range of a RedBlackTree in chunks, remembering its position by
+    key rather than by node so that it stays valid while the tree changes.
+
+    Iterating over a cursor yields lists of (key, value) pairs; next_chunk()
+    returns the next list, or an empty one once the range is exhausted.
+    """
+    def __init__(self, tree, start=RedBlackTree.unspecified,
+                 stop=RedBlackTree.unspecified, size=1000, reverse=False):
+        super(RangeCursor, self).__init__()
+        if size < 1:
+            raise ValueError("size must be positive: %r" % (size,))
+        self.tree = tree
+        self.start = start
+        self.stop = stop
+        self.size = size
+        self.reverse = reverse
+        self.last_key = RedBlackTree.unspecified
+        self.done = False
+        return
+
+    def __first_node(self):
+        # Find the first node of the next chunk.
+        tree = self.tree
+        if self.last_key is RedBlackTree.unspecified:
+            if self.start is RedBlackTree.unspecified:
+                return tree.last_node() if self.reverse else tree.first_node()
+            if self.reverse:
+                return tree.find_node_floor(self.start)
+            return tree.find_node_ceil(self.start)
+
+        compare_nodes = tree.compare_nodes
+        get_node_key = tree.get_node_key
+        last_key = get_node_key(self.last_key)
+        if self.reverse:
+            node = tree.find_node_floor(self.last_key)
+            if (node is not None and
+                not compare_nodes(get_node_key(node.key), last_key)):
+                node = node.prev_node
+                if tree.tombstones:
+                    node = _live_prev(node)
+        else:
+            node = tree.find_node_ceil(self.last_key)
+            if (node is not None and
+                not compare_nodes(last_key, get_node_key(node.key))):
+                node = node.next_node
+                if tree.tombstones:
+                    node = _live_next(node)
+        return node
+
+    def next_chunk(self):
+        """
+        cursor.next_chunk() -> list
+
+        Return the next chunk of (key, value) pairs, or an empty list if the
+        range is exhausted.
+        """
+        if self.done:
+            return []
+
+        tree = self.tree
+        compare_nodes = tree.compare_nodes
+        get_node_key = tree.get_node_key
+        stop = self.stop
+        if stop is not RedBlackTree.unspecified:
+            stop = get_node_key(stop)
+
+        chunk = []
+        node = self.__first_node()
+        while node is not None and len(chunk) < self.size:
+            if stop is not RedBlackTree.unspecified:
+                node_key = get_node_key(node.key)
+                if self.reverse:
+                    if not compare_nodes(stop, node_key):
+                        break
+                elif not compare_nodes(node_key, stop):
+                    break
+            chunk.append((node.key, node.value))
+            node = node.prev_node if self.reverse else node.next_node
+            if tree.tombstones:
+                node = _live_prev(node) if self.reverse else _live_next(node)
+
+        if len(chunk) < self.size:
+            self.done = True
+        if chunk:
+            self.last_key = chunk[-1][0]
+        return chunk
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = self.next_chunk()
+        if not chunk:
+            raise StopIteration()
+        return chunk
+
+    next = __next__
+
+class AsyncRangeIterator(object):
+    """
+    An asynchronous iterator over the items of a RangeCursor, returning
+    control to the event loop before fetching each chunk after the first.
+
+    This implements the asynchronous iterator protocol directly rather than
+    with "async def", so the module still loads on Python 2.
+    """
+    def __init__(self, cursor):
+        super(AsyncRangeIterator, self).__init__()
+        self.cursor = cursor
+        self.chunk = []
+        self.index = 0
+        self.started = False
+        return
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self.index < len(self.chunk):
+            return ItemAwaitable(False, self.__next_item)
+        pause = self.started
+        self.started = True
+        return ItemAwaitable(pause, self.__next_chunk)
+
+    def __next_item(self):
+        item = self.chunk[self.index]
+        self.index += 1
+        return item
+
+    def __next_chunk(self):
+        self.chunk = self.cursor.next_chunk()
+        self.index = 0
+        if not self.chunk:
+            raise StopAsyncIteration()
+        return self.__next_item()
+
+class ItemAwaitable(object):
+    """
+    The awaitable returned by AsyncRangeIterator.__anext__().  Awaiting it
+    first yields None once if pause is True, which asyncio treats as a
+    request to run other tasks, and then returns produce().
+
+    It is its own iterator, since a generator can't return a value on
+    Python 2.
+    """
+    def __init__(self, pause, produce):
+        super(ItemAwaitable, self).__init__()
+        self.pause = pause
+        self.produce = produce
+        return
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pause:
+            self.pause = False
+            return None
+        raise StopIteration(self.produce())
+
+    next = __next__
+
+    def send(self, value):
+        return self.__next__()
+
+    def throw(self, exc_type, value=None, traceback=None):
+        if value is None:
+            value = exc_type() if isinstance(exc_type, type) else exc_type
+        raise value
+
+def generate_range(tree, transform=identity, start=RedBlackTree.unspecified,
+                   stop=RedBlackTree.unspecified, reverse=False):
+    """
+    generate_range(tree, transform=identity, start=RedBlackTree.unspecified,
+                   stop=RedBlackTree.unspecified, reverse=False) -> generator
+
+    Iterate over the nodes of the tree in order, stepping from node to node
+    without recursion.  Tombstones left by lazy deletion are skipped.
+
+    If reverse is False, only nodes greater than or equal to start and less
+    than stop are returned.  If reverse is True, only nodes less than or equal
+    to start and greater than stop are returned, in reverse order.
+    """
+    if not reverse:
+        if start is RedBlackTree.unspecified:
+            node = tree.first_node()
+        else:
+            node = tree.find_node_ceil(start)
+    else:
+        if start is RedBlackTree.unspecified:
+            node = tree.last_node()
+        else:
+            node = tree.find_node_floor(start)
+
+    # Lazy deletion may add tombstones while the caller holds the generator,
+    # so the count is checked at each step; the skipping helpers are only
+    # called while there are any.
+    if stop is RedBlackTree.unspecified:
+        while node is not None:
+            yield transform(node)
+            node = node.prev_node if reverse else node.next_node
+            if tree.tombstones:
+                node = _live_prev(node) if reverse else _live_next(node)
+        return
+
+    get_node_key = tree.get_node_key
+    compare_nodes = tree.compare_nodes
+    stop = get_node_key(stop)
+    while node is not None:
+        if reverse:
+            if not compare_nodes(stop, get_node_key(node.key)):
+                break
+            yield transform(node)
+            node = node.prev_node
+            if tree.tombstones:
+                node = _live_prev(node)
+        else:
+            if not compare_nodes(get_node_key(node.key), stop):
+                break
+            yield transform(node)
+            node = node.next_node
+            if tree.tombstones:
+                node = _live_next(node)
+    return
+
 class RedBlackTreeNode(object):
     __slots__ = ["red", "parentref", "left", "right", "key", "value",
                  "__weakref__"]
@@ -693,6 +2122,398 @@ class RedBlackTreeNode(object):
         
         return pred
 
+    @property
+    def next_node(self):
+        """The node following this one in key order, or None."""
+        node = self.right
+        if node is not None:
+            while node.left is not None:
+                node = node.left
+            return node
+
+        node = self
+        parent = node.parent
+        while parent is not None and parent.right is node:
+            node = parent
+            parent = node.parent
+        return parent
+
+    @property
+    def prev_node(self):
+        """The node preceding this one in key order, or None."""
+        node = self.left
+        if node is not None:
+            while node.right is not None:
+                node = node.right
+            return node
+
+        node = self
+        parent = node.parent
+        while parent is not None and parent.left is node:
+            node = parent
+            parent = node.parent
+        return parent
+
+    def clone(self, key, value):
+        """
+        node.clone(key, value) -> RedBlackTreeNode
+
+        Create an unlinked node of the same class and balance information
+        (color, rank) holding the specified key and value.
+        """
+        result = self.__class__(key, value)
+        result.red = self.red
+        return result
+
     def __repr__(self):
         return ("RedBlackTreeNode(key=%r, value=%r, red=%r)" %
                 (self.key, self.value, self.red))
+
+class RankedTreeNode(RedBlackTreeNode):
+    """
+    A node for rank-balanced trees (AVL, WAVL), which records an integer rank
+    in place of a color.  Missing children have rank -1 and leaves rank 0.
+    """
+    __slots__ = ["rank"]
+
+    def __init__(self, key, value):
+        super(RankedTreeNode, self).__init__(key, value)
+        self.red = False
+        self.rank = 0
+        return
+
+    def clone(self, key, value):
+        result = super(RankedTreeNode, self).clone(key, value)
+        result.rank = self.rank
+        return result
+
+    def __repr__(self):
+        return ("RankedTreeNode(key=%r, value=%r, rank=%r)" %
+                (self.key, self.value, self.rank))
+
+class BalancePolicy(object):
+    """
+    How a RedBlackTree keeps itself balanced.  The tree performs the binary
+    search tree part of each insertion and deletion and calls the policy to
+    restore balance, using the tree's _rotate_left() and _rotate_right().
+
+    Policies are stateless and may be shared between trees; see
+    algae.balance for the AVL and WAVL policies.
+    """
+    # The name accepted by RedBlackTree(balance=...).
+    name = None
+
+    # The class of node the policy's trees are built from.
+    node_class = RedBlackTreeNode
+
+    def insert_fixup(self, tree, node):
+        """
+        policy.insert_fixup(tree, node)
+
+        Rebalance tree after node has been linked in as a new leaf.
+        """
+        raise NotImplementedError()
+
+    def delete_fixup(self, tree, child, parent, removed):
+        """
+        policy.delete_fixup(tree, child, parent, removed)
+
+        Rebalance tree after the node removed, which had at most one child,
+        has been spliced out.  child (possibly None) has taken its place
+        under parent (None if removed was the root).
+        """
+        raise NotImplementedError()
+
+    def link_node(self, node):
+        """
+        policy.link_node(node)
+
+        Set the balance information of a node whose children have been
+        linked by RedBlackTree._link_balanced().
+        """
+        raise NotImplementedError()
+
+    def verify_node(self, node):
+        """
+        policy.verify_node(node)
+
+        Raise AssertionError if node's balance information is invalid.
+        """
+        return
+
+    def __repr__(self):
+        return "<%s balance policy>" % (self.name,)
+
+class RedBlackBalance(BalancePolicy):
+    """
+    Red-black balancing, as built into RedBlackTree.  Trees using it call
+    their own fixup methods directly rather than going through the policy.
+    """
+    name = "red-black"
+
+    def insert_fixup(self, tree, node):
+        node.red = True
+        tree._RedBlackTree__rb_insert_fixup(node)
+        return
+
+    def delete_fixup(self, tree, child, parent, removed):
+        if not removed.red:
+            tree._RedBlackTree__rb_delete_fixup(child, parent)
+        return
+
+    def link_node(self, node):
+        # _link_balanced colors the nodes itself.
+        return
+
+red_black = RedBlackBalance()
+
+def balance_policy(balance):
+    """
+    balance_policy(balance) -> BalancePolicy
+
+    Return the policy named by balance ("red-black", "avl" or "wavl"), or
+    balance itself if it is already a BalancePolicy.  None means red-black.
+    """
+    if balance is None or balance == red_black.name:
+        return red_black
+    if isinstance(balance, BalancePolicy):
+        return balance
+
+    # algae.balance imports this module.
+    from algae.balance import policies
+    try:
+        return policies[balance]
+    except (KeyError, TypeError):
+        raise ValueError("Unknown balance policy %r" % (balance,))
+
+class InstrumentedRedBlackTree(RedBlackTree):
+    """
+    A RedBlackTree which counts comparisons, rotations, fixup cases and
+    lookup traversal lengths.
+
+    Trees are not created with this class directly; RedBlackTree.enable_stats()
+    switches an existing tree's class to it (or to a subclass combining it
+    with the tree's own class; see instrumented_class()).
+
+    The fixup methods here mirror those in RedBlackTree with counters added;
+    keeping the counters out of RedBlackTree is what makes uninstrumented
+    trees free of overhead.  Changes to either fixup must be made in both
+    places.  Rotations made by split(), delete_range() and their joins happen
+    in scratch trees and are not counted.
+    """
+    stats_enabled = True
+
+    def reset_stats(self):
+        counters = self._stats
+        counters.clear()
+        counters.update({
+            "comparisons": 0,
+            "key_calls": 0,
+            "left_rotations": 0,
+            "right_rotations": 0,
+            "insert_fixup_cases": {1: 0, 2: 0, 3: 0},
+            "delete_fixup_cases": {1: 0, 2: 0, 3: 0, 4: 0},
+            "lookups": 0,
+            "nodes_visited": 0,
+            "visit_histogram": {},
+        })
+        return
+
+    def stats(self):
+        result = super(InstrumentedRedBlackTree, self).stats()
+        for name, value in self._stats.items():
+            if isinstance(value, dict):
+                value = dict(value)
+            result[name] = value
+        return result
+
+    def _new_like(self):
+        # The copied counters and wrapped functions belong to this tree; give
+        # the new tree its own.
+        result = super(InstrumentedRedBlackTree, self)._new_like()
+        if isinstance(result, InstrumentedRedBlackTree):
+            result.__class__ = self._stats_class
+            result.compare_nodes, result.get_node_key = self._stats_functions
+            result.enable_stats()
+        return result
+
+    def ordering(self):
+        return self._stats_functions
+
+    def __record_lookup(self, key_calls):
+        # The key function is called once for the probe and once for each
+        # node visited.
+        counters = self._stats
+        visited = counters["key_calls"] - key_calls - 1
+        counters["lookups"] += 1
+        counters["nodes_visited"] += visited
+        histogram = counters["visit_histogram"]
+        histogram[visited] = histogram.get(visited, 0) + 1
+        return
+
+    def find_node_floor(self, key):
+        key_calls = self._stats["key_calls"]
+        node = super(InstrumentedRedBlackTree, self).find_node_floor(key)
+        self.__record_lookup(key_calls)
+        return node
+
+    def find_node_ceil(self, key):
+        key_calls = self._stats["key_calls"]
+        node = super(InstrumentedRedBlackTree, self).find_node_ceil(key)
+        self.__record_lookup(key_calls)
+        return node
+
+    def find_node(self, key):
+        key_calls = self._stats["key_calls"]
+        node = super(InstrumentedRedBlackTree, self).find_node(key)
+        self.__record_lookup(key_calls)
+        return node
+
+    def _RedBlackTree__left_rotate(self, x):
+        self._stats["left_rotations"] += 1
+        super(InstrumentedRedBlackTree, self)._RedBlackTree__left_rotate(x)
+        return
+
+    def _RedBlackTree__right_rotate(self, x):
+        self._stats["right_rotations"] += 1
+        super(InstrumentedRedBlackTree, self)._RedBlackTree__right_rotate(x)
+        return
+
+    def _RedBlackTree__rb_insert_fixup(self, z):
+        cases = self._stats["insert_fixup_cases"]
+        while z.parent is not None and z.parent.red:
+            parent = z.parent
+            grandparent = parent.parent
+
+            if parent is grandparent.left:
+                uncle = grandparent.right
+                if uncle is not None and uncle.red:
+                    cases[1] += 1
+                    parent.red = uncle.red = False
+                    grandparent.red = True
+                    z = grandparent
+                    continue
+                else:
+                    if z is parent.right:
+                        cases[2] += 1
+                        z, parent = parent, z
+                        self._RedBlackTree__left_rotate(z)
+
+                    cases[3] += 1
+                    parent.red = False
+                    grandparent.red = True
+                    self._RedBlackTree__right_rotate(grandparent)
+                    break
+            else:
+                uncle = grandparent.left
+                if uncle is not None and uncle.red:
+                    cases[1] += 1
+                    parent.red = uncle.red = False
+                    grandparent.red = True
+                    z = grandparent
+                    continue
+                else:
+                    if z is parent.left:
+                        cases[2] += 1
+                        z, parent = parent, z
+                        self._RedBlackTree__right_rotate(z)
+
+                    cases[3] += 1
+                    parent.red = False
+                    grandparent.red = True
+                    self._RedBlackTree__left_rotate(grandparent)
+                    break
+
+        root = self.root
+        grew = root.red
+        root.red = False
+        return grew
+
+    def _RedBlackTree__rb_delete_fixup(self, x, x_parent):
+        cases = self._stats["delete_fixup_cases"]
+        while x_parent is not None and (x is None or not x.red):
+            if x is x_parent.left:
+                w = x_parent.right
+
+                if w.red:
+                    cases[1] += 1
+                    w.red = False
+                    x_parent.red = True
+                    self._RedBlackTree__left_rotate(x_parent)
+                    w = x_parent.right
+
+                if ((w.left is None or not w.left.red) and
+                    (w.right is None or not w.right.red)):
+                    cases[2] += 1
+                    w.red = True
+                    x = x_parent
+                    x_parent = x.parent
+                else:
+                    if w.right is None or not w.right.red:
+                        cases[3] += 1
+                        if w.left is not None:
+                            w.left.red = False
+                        w.red = True
+                        self._RedBlackTree__right_rotate(w)
+                        w = x_parent.right
+
+                    cases[4] += 1
+                    w.red = x_parent.red
+                    x_parent.red = False
+                    if w.right is not None:
+                        w.right.red = False
+                    self._RedBlackTree__left_rotate(x_parent)
+                    x = self.root
+                    x_parent = None
+            else:
+                w = x_parent.left
+
+                if w.red:
+                    cases[1] += 1
+                    w.red = False
+                    x_parent.red = True
+                    self._RedBlackTree__right_rotate(x_parent)
+                    w = x_parent.left
+
+                if ((w.left is None or not w.left.red) and
+                    (w.right is None or not w.right.red)):
+                    cases[2] += 1
+                    w.red = True
+                    x = x_parent
+                    x_parent = x.parent
+                else:
+                    if w.left is None or not w.left.red:
+                        cases[3] += 1
+                        w.right.red = False
+                        w.red = True
+                        self._RedBlackTree__left_rotate(w)
+                        w = x_parent.left
+
+                    cases[4] += 1
+                    w.red = x_parent.red
+                    x_parent.red = False
+                    if w.left is not None:
+                        w.left.red = False
+                    self._RedBlackTree__right_rotate(x_parent)
+                    x = self.root
+                    x_parent = None
+
+        if x is not None:
+            x.red = False
+        return
+
+_instrumented_classes = {RedBlackTree: InstrumentedRedBlackTree}
+
+def instrumented_class(cls):
+    """
+    instrumented_class(cls) -> type
+
+    Return the instrumented counterpart of a RedBlackTree subclass, creating
+    (and caching) it if necessary.
+    """
+    result = _instrumented_classes.get(cls)
+    if result is None:
+        result = type(str("Instrumented" + cls.__name__),
+                      (InstrumentedRedBlackTree, cls), {})
+        _instrumented_classes[cls] = result
+    return result
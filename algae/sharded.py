@@ -0,0 +1,662 @@
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.functions import identity
+from algae.rbtree import RedBlackTree, prefix_upper_bound
+from functools import cmp_to_key, reduce
+from operator import itemgetter, lt
+from random import Random
+from threading import Lock
+import multiprocessing
+import os
+
+# Parallel operations fork worker processes which read their inputs from
+# this module-level state, inherited copy-on-write, so shards and functions
+# are never pickled; only results travel back to the parent.  The lock keeps
+# concurrent parallel operations from clobbering each other's state.
+_fork_state = None
+_fork_lock = Lock()
+
+def fork_context():
+    """
+    fork_context() -> multiprocessing context or None
+
+    Return a multiprocessing context that starts workers with fork(), or None
+    if this platform can't fork.
+    """
+    if not hasattr(os, "fork"):
+        return None
+    if hasattr(multiprocessing, "get_context"):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return None
+        return multiprocessing.get_context("fork")
+    # Python 2 always forks on platforms which support it.
+    return multiprocessing
+
+def _run_shard_task(index):
+    # Runs in a forked worker; see _fork_state.
+    state = _fork_state
+    op = state["op"]
+    if op == "sort":
+        return sort_unique(state["buckets"][index], state["sort_key"],
+                           state["cmp"])
+
+    tree = state["shards"][index]
+    start, stop = state["start"], state["stop"]
+    if op == "items":
+        return tree.items(start=start, stop=stop)
+    elif op == "count":
+        return sum(1 for key in tree.iterkeys(start=start, stop=stop))
+    elif op == "reduce":
+        return reduce(state["function"], tree.iteritems(start=start,
+                                                        stop=stop),
+                      state["initial"])
+    raise ValueError("Unknown shard operation %r" % (op,))
+
+def _count_items(tree):
+    return sum(1 for key in tree.iterkeys())
+
+def _absolute_distance(a, b):
+    return abs(a - b)
+
+def item_sort_key(cmp, key):
+    """
+    item_sort_key(cmp, key) -> function
+
+    Return a sort key function ordering (key, value) items as a RedBlackTree
+    with the given cmp and key functions would.
+    """
+    if cmp is lt:
+        if key is identity:
+            return itemgetter(0)
+        return lambda item: key(item[0])
+
+    three_way = cmp_to_key(lambda a, b: -1 if cmp(a, b) else
+                           (1 if cmp(b, a) else 0))
+    return lambda item: three_way(key(item[0]))
+
+def sort_unique(items, sort_key, cmp):
+    """
+    sort_unique(items, sort_key, cmp) -> list
+
+    Sort (key, value) items by key, keeping only the last item given for
+    each key.
+    """
+    items = sorted(items, key=sort_key)
+    result = []
+    previous = None
+    for item in items:
+        item_key = sort_key(item)
+        if result and not (previous < item_key):
+            # Equal to the previous key; the later item wins.
+            result[-1] = item
+        else:
+            result.append(item)
+        previous = item_key
+    return result
+
+class ShardedSortedMap(object):
+    """
+    An ordered map which range-partitions its keys across several
+    RedBlackTree shards, so bulk loads and whole-range operations can run on
+    several cores.
+
+    The shard boundaries are chosen by sampling the keys given to load() (or
+    to the constructor or update() while empty).  Point operations go
+    straight to the owning shard after a binary search of the boundaries.
+    Bulk loads sort each shard's keys in a separate process and link the
+    results into balanced trees in linear time; items(), count() and
+    reduce() over a range scan the shards in parallel and merge the results
+    in key order.
+
+    Parallel operations fork worker processes, so they are only used on
+    platforms which support fork() and when at least parallel_threshold
+    items are involved; otherwise they run in this process.  Keys and
+    results must be picklable to be returned from workers, but the shards
+    and functions passed in need not be.
+
+    Keys inserted after a load stay in the shard their key range maps to;
+    call rebalance() to re-partition after heavy skewed growth.
+
+    The map supports RedBlackTree's mapping, range and query interface: item
+    access, iteration, items()/keys()/values(), find_node(),
+    find_node_floor(), find_node_ceil(), first_node(), last_node(), min(),
+    max(), nearest(), nearest_many(), the prefix operations, split(),
+    delete_range() and copy().  split(), delete_range() and copy() return
+    ShardedSortedMaps whose shard boundaries are a subset of this map's.
+    Node-level operations such as verify(), compact() and the statistics
+    methods are available on the individual shards.
+    """
+    unspecified = RedBlackTree.unspecified
+
+    def __init__(self, init=None, shards=None, cmp=lt, key=identity,
+                 processes=None, sample_size=1024,
+                 parallel_threshold=100000):
+        """
+        ShardedSortedMap(init=None, shards=None, cmp=operator.lt, key=identity,
+                         processes=None, sample_size=1024,
+                         parallel_threshold=100000)
+
+        Create a new ShardedSortedMap.
+
+        init, cmp and key are as for RedBlackTree.  shards specifies the
+        number of shards to partition keys across, and processes the number
+        of worker processes to use; both default to the number of CPUs.
+        sample_size specifies the number of keys sampled to choose shard
+        boundaries.
+        """
+        super(ShardedSortedMap, self).__init__()
+        cpus = multiprocessing.cpu_count()
+        self.shard_count = shards if shards is not None else cpus
+        if self.shard_count < 1:
+            raise ValueError("shards must be positive: %r" % (shards,))
+        self.processes = processes if processes is not None else cpus
+        self.compare_nodes = cmp
+        self.get_node_key = key
+        self.sample_size = sample_size
+        self.parallel_threshold = parallel_threshold
+        self.rng = Random()
+        self.clear()
+
+        if init is not None:
+            self.update(init)
+        return
+
+    def clear(self):
+        """Remove every item, leaving a single empty shard."""
+        self.boundaries = []
+        self.shards = [self.__new_shard()]
+        self.sizes = [0]
+        return
+
+    def __new_shard(self):
+        return RedBlackTree(cmp=self.compare_nodes, key=self.get_node_key)
+
+    def __new_like(self):
+        # An empty map with the same settings as this one.
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        result.rng = Random()
+        result.clear()
+        return result
+
+    def shard_index(self, key):
+        """
+        sm.shard_index(key) -> int
+
+        Return the index of the shard which holds key.
+        """
+        key = self.get_node_key(key)
+        boundaries = self.boundaries
+        compare_nodes = self.compare_nodes
+        low, high = 0, len(boundaries)
+        while low < high:
+            mid = (low + high) // 2
+            if compare_nodes(key, boundaries[mid]):
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def __shard_range(self, start, stop, reverse=False):
+        # Return the indexes of the shards which may hold keys in range.
+        if not reverse:
+            first = 0 if start is self.unspecified else self.shard_index(start)
+            last = (len(self.shards) - 1 if stop is self.unspecified
+                    else self.shard_index(stop))
+            return range(first, last + 1)
+        else:
+            first = (len(self.shards) - 1 if start is self.unspecified
+                     else self.shard_index(start))
+            last = 0 if stop is self.unspecified else self.shard_index(stop)
+            return range(first, last - 1, -1)
+
+    def __run_parallel(self, state, tasks, size):
+        # Run _run_shard_task over tasks, in worker processes if worthwhile,
+        # returning the results in task order.
+        global _fork_state
+        tasks = list(tasks)
+        context = fork_context()
+        with _fork_lock:
+            _fork_state = state
+            try:
+                if (context is None or self.processes < 2 or
+                    len(tasks) < 2 or size < self.parallel_threshold):
+                    return [_run_shard_task(task) for task in tasks]
+
+                pool = context.Pool(min(self.processes, len(tasks)))
+                try:
+                    return pool.map(_run_shard_task, tasks, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                _fork_state = None
+
+    def load(self, items):
+        """
+        sm.load(items)
+
+        Replace the contents of the map with items, which may be a dict-like
+        object or a sequence of (key, value) pairs.  Shard boundaries are
+        chosen by sampling the keys; the shards are then sorted in parallel
+        and built in linear time.
+        """
+        if hasattr(items, "iteritems"):
+            items = list(items.iteritems())
+        elif hasattr(items, "items"):
+            items = list(items.items())
+        else:
+            items = list(items)
+
+        sort_key = item_sort_key(self.compare_nodes, self.get_node_key)
+        sample = self.rng.sample(items, min(self.sample_size, len(items)))
+        sample = sort_unique(sample, sort_key, self.compare_nodes)
+        boundaries = []
+        for i in range(1, self.shard_count if sample else 1):
+            boundary = self.get_node_key(
+                sample[i * len(sample) // self.shard_count][0])
+            if (not boundaries or
+                self.compare_nodes(boundaries[-1], boundary)):
+                boundaries.append(boundary)
+        self.boundaries = boundaries
+
+        buckets = [[] for i in range(len(boundaries) + 1)]
+        for item in items:
+            buckets[self.shard_index(item[0])].append(item)
+
+        sorted_buckets = self.__run_parallel(
+            {"op": "sort", "buckets": buckets, "sort_key": sort_key,
+             "cmp": self.compare_nodes},
+            range(len(buckets)), len(items))
+
+        self.shards = []
+        self.sizes = []
+        for bucket in sorted_buckets:
+            shard = self.__new_shard()
+            shard.root = shard._link_balanced([
+                shard._new_node(key, value) for key, value in bucket])
+            self.shards.append(shard)
+            self.sizes.append(len(bucket))
+        return
+
+    def rebalance(self):
+        """
+        sm.rebalance()
+
+        Re-partition the items across shards, choosing new boundaries.
+        """
+        self.load(self.iteritems())
+        return
+
+    def update(self, obj):
+        if not len(self):
+            self.load(obj)
+            return
+
+        if hasattr(obj, "iteritems"):
+            items = obj.iteritems()
+        elif hasattr(obj, "items"):
+            items = obj.items()
+        else:
+            items = obj
+        for key, value in items:
+            self[key] = value
+        return
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def find_node(self, key):
+        return self.shards[self.shard_index(key)].find_node(key)
+
+    def find_node_floor(self, key):
+        index = self.shard_index(key)
+        node = self.shards[index].find_node_floor(key)
+        while node is None and index > 0:
+            index -= 1
+            node = self.shards[index].last_node()
+        return node
+
+    def find_node_ceil(self, key):
+        index = self.shard_index(key)
+        node = self.shards[index].find_node_ceil(key)
+        while node is None and index < len(self.shards) - 1:
+            index += 1
+            node = self.shards[index].first_node()
+        return node
+
+    def first_node(self):
+        """
+        sm.first_node() -> RedBlackTreeNode
+
+        Return the node with the smallest key, or None if the map is empty.
+        """
+        for shard in self.shards:
+            node = shard.first_node()
+            if node is not None:
+                return node
+        return None
+
+    def last_node(self):
+        """
+        sm.last_node() -> RedBlackTreeNode
+
+        Return the node with the largest key, or None if the map is empty.
+        """
+        for shard in reversed(self.shards):
+            node = shard.last_node()
+            if node is not None:
+                return node
+        return None
+
+    def __getitem__(self, key):
+        node = self.find_node(key)
+        if node is None:
+            raise KeyError("Unknown key: %r" % (key,))
+        return node.value
+
+    def __setitem__(self, key, value):
+        index = self.shard_index(key)
+        shard = self.shards[index]
+        node = shard.find_node(key)
+        if node is not None:
+            node.value = value
+        else:
+            shard[key] = value
+            self.sizes[index] += 1
+        return
+
+    def __contains__(self, key):
+        return self.find_node(key) is not None
+
+    def __delitem__(self, key):
+        index = self.shard_index(key)
+        del self.shards[index][key]
+        self.sizes[index] -= 1
+        return
+
+    def iterkeys(self, start=unspecified, reverse=False, stop=unspecified):
+        for key, value in self.iteritems(start=start, stop=stop,
+                                         reverse=reverse):
+            yield key
+
+    def itervalues(self, start=unspecified, reverse=False, stop=unspecified):
+        for key, value in self.iteritems(start=start, stop=stop,
+                                         reverse=reverse):
+            yield value
+
+    def iteritems(self, start=unspecified, reverse=False, stop=unspecified):
+        for index in self.__shard_range(start, stop, reverse):
+            for item in self.shards[index].iteritems(start=start, stop=stop,
+                                                     reverse=reverse):
+                yield item
+
+    def keys(self, start=unspecified, reverse=False, stop=unspecified):
+        return [key for key, value in self.items(start=start, stop=stop,
+                                                 reverse=reverse)]
+
+    def values(self, start=unspecified, reverse=False, stop=unspecified):
+        return [value for key, value in self.items(start=start, stop=stop,
+                                                   reverse=reverse)]
+
+    def items(self, start=unspecified, reverse=False, stop=unspecified):
+        """
+        sm.items(start=..., reverse=False, stop=...) -> list
+
+        Return the items in range, as RedBlackTree.items() does, scanning the
+        shards in parallel.
+        """
+        if reverse:
+            return list(self.iteritems(start=start, stop=stop, reverse=True))
+
+        indexes = self.__shard_range(start, stop)
+        results = self.__run_parallel(
+            {"op": "items", "shards": self.shards, "start": start,
+             "stop": stop}, indexes,
+            sum(self.sizes[index] for index in indexes))
+        result = []
+        for part in results:
+            result.extend(part)
+        return result
+
+    def count(self, start=unspecified, stop=unspecified):
+        """
+        sm.count(start=..., stop=...) -> int
+
+        Return the number of keys at least start and less than stop, counting
+        the shards in parallel.  Shards entirely inside the range are counted
+        from their sizes without scanning.
+        """
+        indexes = list(self.__shard_range(start, stop))
+        if not indexes:
+            return 0
+
+        # Only the first and last shards can be partly outside the range.
+        edges = sorted(set([indexes[0], indexes[-1]]))
+        total = sum(self.sizes[index] for index in indexes
+                    if index not in edges)
+        total += sum(self.__run_parallel(
+            {"op": "count", "shards": self.shards, "start": start,
+             "stop": stop}, edges,
+            sum(self.sizes[index] for index in edges)))
+        return total
+
+    def reduce(self, function, initial, start=unspecified, stop=unspecified,
+               combine=None):
+        """
+        sm.reduce(function, initial, start=..., stop=..., combine=None)
+            -> value
+
+        Fold function(accumulator, (key, value)) over the items in range, in
+        key order, starting from initial.
+
+        If combine is given, each shard is folded separately, in parallel,
+        starting from initial, and the partial results are merged in key
+        order with combine(left, right).  This requires initial to be an
+        identity for combine.  If combine is None, the shards are folded in
+        sequence in this process.
+        """
+        if combine is None:
+            return reduce(function, self.iteritems(start=start, stop=stop),
+                          initial)
+
+        indexes = self.__shard_range(start, stop)
+        partials = self.__run_parallel(
+            {"op": "reduce", "shards": self.shards, "start": start,
+             "stop": stop, "function": function, "initial": initial},
+            indexes, sum(self.sizes[index] for index in indexes))
+        return reduce(combine, partials, initial)
+
+    def max(self, key=unspecified):
+        """
+        sm.max(key=...) -> (key, value)
+
+        As RedBlackTree.max().
+        """
+        if key is self.unspecified:
+            node = self.last_node()
+        else:
+            node = self.find_node_ceil(key)
+        return None if node is None else (node.key, node.value)
+
+    def min(self, key=unspecified):
+        """
+        sm.min(key=...) -> (key, value)
+
+        As RedBlackTree.min().
+        """
+        if key is self.unspecified:
+            node = self.first_node()
+        else:
+            node = self.find_node_floor(key)
+        return None if node is None else (node.key, node.value)
+
+    def nearest(self, key, k=1, distance=None):
+        """
+        sm.nearest(key, k=1, distance=None) -> list
+
+        As RedBlackTree.nearest().  The search steps outward from key across
+        shard boundaries as needed.
+        """
+        if distance is None:
+            distance = _absolute_distance
+        get_node_key = self.get_node_key
+        compare_nodes = self.compare_nodes
+        probe = get_node_key(key)
+        lower = self.iteritems(start=key, reverse=True)
+        upper = (item for item in self.iteritems(start=key)
+                 if compare_nodes(probe, get_node_key(item[0])))
+
+        result = []
+        below = next(lower, None)
+        above = next(upper, None)
+        while len(result) < k:
+            if below is None:
+                if above is None:
+                    break
+                take_below = False
+            elif above is None:
+                take_below = True
+            else:
+                take_below = not (distance(above[0], key) <
+                                  distance(below[0], key))
+
+            if take_below:
+                result.append(below)
+                below = next(lower, None)
+            else:
+                result.append(above)
+                above = next(upper, None)
+        return result
+
+    def nearest_many(self, keys, k=1, distance=None):
+        """
+        sm.nearest_many(keys, k=1, distance=None) -> list
+
+        Return nearest(key, k, distance) for each of the specified keys, in
+        order.
+        """
+        return [self.nearest(key, k, distance) for key in keys]
+
+    def iter_prefix(self, prefix):
+        """
+        sm.iter_prefix(prefix) -> generator
+
+        As RedBlackTree.iter_prefix().
+        """
+        return self.iteritems(start=prefix, stop=prefix_upper_bound(prefix))
+
+    def count_prefix(self, prefix):
+        """
+        sm.count_prefix(prefix) -> int
+
+        Return the number of keys starting with prefix.
+        """
+        return self.count(prefix, prefix_upper_bound(prefix))
+
+    def delete_prefix(self, prefix):
+        """
+        sm.delete_prefix(prefix) -> ShardedSortedMap
+
+        Remove every item whose key starts with prefix and return them in a
+        new map; see delete_range().
+        """
+        return self.delete_range(prefix, prefix_upper_bound(prefix))
+
+    def split(self, key, inclusive=False):
+        """
+        sm.split(key, inclusive=False) -> ShardedSortedMap
+
+        Remove every item whose key is less than key (or less than or equal
+        to it, if inclusive is True) and return them in a new map.  Shards
+        entirely below key move to the new map as they are; the shard holding
+        key is split with RedBlackTree.split(), and the nodes moved from it
+        are counted, so this takes O(lg n + k) time for k nodes moved out of
+        that shard.
+        """
+        index = self.shard_index(key)
+        lesser = self.shards[index].split(key, inclusive)
+        size = _count_items(lesser)
+
+        result = self.__new_like()
+        result.boundaries = self.boundaries[:index]
+        result.shards = self.shards[:index] + [lesser]
+        result.sizes = self.sizes[:index] + [size]
+
+        self.boundaries = self.boundaries[index:]
+        self.shards = self.shards[index:]
+        self.sizes = [self.sizes[index] - size] + self.sizes[index + 1:]
+        return result
+
+    def delete_range(self, start=unspecified, stop=unspecified):
+        """
+        sm.delete_range(start=..., stop=...) -> ShardedSortedMap
+
+        Remove every item whose key is at least start and less than stop and
+        return them in a new map.  Shards entirely inside the range move to
+        the new map as they are, leaving empty shards behind; the shards at
+        either end use RedBlackTree.delete_range(), and the nodes removed
+        from them are counted.
+        """
+        result = self.__new_like()
+        indexes = list(self.__shard_range(start, stop))
+        if not indexes:
+            return result
+
+        first, last = indexes[0], indexes[-1]
+        result.boundaries = self.boundaries[first:last]
+        result.shards = []
+        result.sizes = []
+        for index in indexes:
+            shard = self.shards[index]
+            if first < index < last:
+                removed = shard
+                size = self.sizes[index]
+                self.shards[index] = self.__new_shard()
+            else:
+                removed = shard.delete_range(
+                    start if index == first else self.unspecified,
+                    stop if index == last else self.unspecified)
+                size = _count_items(removed)
+            self.sizes[index] -= size
+            result.shards.append(removed)
+            result.sizes.append(size)
+        return result
+
+    def copy(self, start=unspecified, stop=unspecified):
+        """
+        sm.copy(start=..., stop=...) -> ShardedSortedMap
+
+        Return a shallow copy of the map, or of the items whose keys are at
+        least start and less than stop, copying each shard with
+        RedBlackTree.copy().
+        """
+        result = self.__new_like()
+        if start is self.unspecified and stop is self.unspecified:
+            result.boundaries = list(self.boundaries)
+            result.shards = [shard.copy() for shard in self.shards]
+            result.sizes = list(self.sizes)
+            return result
+
+        indexes = list(self.__shard_range(start, stop))
+        if not indexes:
+            return result
+        result.boundaries = self.boundaries[indexes[0]:indexes[-1]]
+        result.shards = [self.shards[index].copy(start, stop)
+                         for index in indexes]
+        result.sizes = [_count_items(shard) for shard in result.shards]
+        return result
+
+    def __copy__(self):
+        return self.copy()
+
+    def __repr__(self):
+        return ("{" + ", ".join([repr(key) + ": " + repr(value)
+                                 for key, value in self.iteritems()]) + "}")
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
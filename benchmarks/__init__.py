@@ -0,0 +1,232 @@
+"""
+Performance benchmarks for algae.
+
+Each suite is a module in this package exposing run(sizes, repeat, memory),
+which yields result dicts built by measure().  Run the benchmarks with:
+
+    python -m benchmarks --sizes 1e3,1e4,1e5 --output results.json
+
+and diff two runs with:
+
+    python -m benchmarks --compare old.json new.json
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from datetime import datetime
+from importlib import import_module
+from timeit import default_timer
+import gc
+import json
+import platform
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Suite modules, in the order they are run.
+suites = ["rbtree", "balance", "annotations", "durable"]
+
+def time_function(function, repeat=1):
+    """
+    time_function(function, repeat=1) -> float
+
+    Call function repeat times and return the best wall-clock time, in
+    seconds.
+    """
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = default_timer()
+        function()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def current_rss():
+    """
+    current_rss() -> int or None
+
+    Return the process's current resident set size in bytes, or None if it
+    cannot be determined.
+    """
+    try:
+        with open("/proc/self/statm", "r") as fd:
+            pages = int(fd.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+    if resource is not None:
+        return pages * resource.getpagesize()
+    return pages * 4096
+
+def peak_memory(function):
+    """
+    peak_memory(function) -> int or None
+
+    Call function and return the peak number of bytes allocated while it ran.
+    This uses tracemalloc where available.  Otherwise, it falls back to the
+    growth in resident set size while function's return value is still alive,
+    which approximates the peak for functions that build a structure.
+    Returns None if neither is available.
+    """
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            function()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak
+
+    before = current_rss()
+    if before is None:
+        return None
+    result = function()
+    growth = current_rss() - before
+    result = None
+    return max(growth, 0)
+
+def measure(suite, impl, workload, operation, size, ops, function,
+            setup=None, repeat=1, memory=False):
+    """
+    measure(suite, impl, workload, operation, size, ops, function,
+            setup=None, repeat=1, memory=False) -> dict
+
+    Benchmark function, which performs ops operations, and return a result
+    dict.  If setup is given, it is called before each run and its return
+    value is passed to function; setup time is not measured.  If memory is
+    True, the peak memory of a separate, untimed run is also recorded.
+    """
+    if setup is None:
+        run = function
+    else:
+        def run():
+            function(setup())
+
+    seconds = time_function(run, repeat)
+    result = {
+        "suite": suite,
+        "impl": impl,
+        "workload": workload,
+        "operation": operation,
+        "size": size,
+        "ops": ops,
+        "seconds": seconds,
+        "ops_per_sec": ops / seconds if seconds > 0 else None,
+        "peak_memory": None,
+    }
+
+    if memory:
+        if setup is None:
+            result["peak_memory"] = peak_memory(function)
+        else:
+            state = setup()
+            result["peak_memory"] = peak_memory(lambda: function(state))
+
+    return result
+
+def result_key(result):
+    return (result["suite"], result["impl"], result["workload"],
+            result["operation"], result["size"])
+
+def run_suites(names, sizes, repeat=1, memory=True, match=None,
+               report=None):
+    """
+    run_suites(names, sizes, repeat=1, memory=True, match=None,
+               report=None) -> list
+
+    Run the named suites at each size and return their results.  If match
+    is given, only results whose "impl/workload/operation" string contains
+    it are kept.  If report is given, it is called with each result as it is
+    produced.
+    """
+    results = []
+    for name in names:
+        module = import_module("benchmarks." + name)
+        for result in module.run(sizes, repeat=repeat, memory=memory,
+                                 match=match):
+            results.append(result)
+            if report is not None:
+                report(result)
+    return results
+
+def selected(match, impl, workload, operation):
+    """Return True if the benchmark named by its parts matches the filter."""
+    return match is None or match in "/".join((impl, workload, operation))
+
+def metadata():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+def save_results(results, path):
+    with open(path, "w") as fd:
+        json.dump({"meta": metadata(), "results": results}, fd, indent=1,
+                  sort_keys=True)
+    return
+
+def load_results(path):
+    with open(path, "r") as fd:
+        return json.load(fd)["results"]
+
+def compare_results(old, new, threshold=0.1):
+    """
+    compare_results(old, new, threshold=0.1) -> list
+
+    Pair up the results from two runs and return a list of
+    (key, old_ops_per_sec, new_ops_per_sec, ratio, regressed) tuples, where
+    ratio is new/old throughput and regressed is True if throughput fell by
+    more than threshold.
+    """
+    old_by_key = dict((result_key(result), result) for result in old)
+    comparison = []
+    for result in new:
+        key = result_key(result)
+        before = old_by_key.get(key)
+        if before is None:
+            continue
+        old_ops = before["ops_per_sec"]
+        new_ops = result["ops_per_sec"]
+        if not old_ops or not new_ops:
+            continue
+        ratio = new_ops / old_ops
+        comparison.append((key, old_ops, new_ops, ratio,
+                           ratio < 1.0 - threshold))
+    return comparison
+
+def format_result(result):
+    if result["peak_memory"] is None:
+        memory = "-"
+    else:
+        memory = "%.1f MiB" % (result["peak_memory"] / 1048576.0)
+    line = "%-10s %-22s %-12s %-14s %9d %14.0f ops/s %12s" % (
+        result["suite"], result["impl"], result["workload"],
+        result["operation"], result["size"], result["ops_per_sec"] or 0,
+        memory)
+    if result.get("average_depth") is not None:
+        line += "  depth %.2f" % result["average_depth"]
+    return line
+
+def format_comparison(entry):
+    key, old_ops, new_ops, ratio, regressed = entry
+    return "%-60s %14.0f -> %14.0f ops/s  %+6.1f%%%s" % (
+        "/".join(str(part) for part in key), old_ops, new_ops,
+        (ratio - 1.0) * 100, "  REGRESSION" if regressed else "")
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -0,0 +1,64 @@
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from argparse import ArgumentParser
+from benchmarks import (
+    compare_results, format_comparison, format_result, load_results,
+    run_suites, save_results, suites)
+import sys
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(",") if size]
+
+def main(args=None):
+    parser = ArgumentParser(prog="python -m benchmarks",
+                            description="Run the algae benchmarks.")
+    parser.add_argument(
+        "--sizes", type=parse_sizes, default=parse_sizes("1e3,1e4,1e5"),
+        help="Comma-separated structure sizes (default: 1e3,1e4,1e5); "
+        "sizes up to 1e7 are supported but slow.")
+    parser.add_argument(
+        "--suite", action="append", choices=suites, dest="suites",
+        help="Suite to run; may be repeated (default: all).")
+    parser.add_argument(
+        "--match", help="Only run benchmarks whose impl/workload/operation "
+        "contains this string.")
+    parser.add_argument(
+        "--repeat", type=int, default=1,
+        help="Number of timed runs per benchmark; the best is kept.")
+    parser.add_argument(
+        "--no-memory", action="store_false", dest="memory",
+        help="Skip peak memory measurement.")
+    parser.add_argument(
+        "--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"),
+        help="Compare two result files instead of running benchmarks.")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="Throughput drop treated as a regression (default: 0.1).")
+    options = parser.parse_args(args)
+
+    if options.compare:
+        old, new = [load_results(path) for path in options.compare]
+        comparison = compare_results(old, new, options.threshold)
+        for entry in comparison:
+            print(format_comparison(entry))
+        return 1 if any(entry[-1] for entry in comparison) else 0
+
+    results = run_suites(options.suites or suites, options.sizes,
+                         repeat=options.repeat, memory=options.memory,
+                         match=options.match,
+                         report=lambda result: print(format_result(result)))
+    if options.output:
+        save_results(results, options.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -0,0 +1,115 @@
+"""
+typechecked_property benchmarks.
+
+Compares attribute get/set throughput and per-instance memory for classes
+with two int attributes stored as:
+    slots                   Plain __slots__, no type checking.
+    dict                    Plain instance __dict__, no type checking.
+    typechecked-slots       typechecked_property backed by slots.
+    typechecked-dict        typechecked_property backed by __dict__.
+    typechecked-class       typechecked-slots with the @typechecked
+                            compiled __init__.
+    typechecked-off         typechecked-class with checks turned off.
+
+The size is the number of objects created (for example, --sizes 1e6).
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.annotations import typechecked, typechecked_property
+from benchmarks import measure, selected
+
+class SlotsRecord(object):
+    __slots__ = ["x", "y"]
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class DictRecord(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class TypecheckedSlotsRecord(object):
+    __slots__ = ["_x", "_y"]
+    x = typechecked_property(int, slot="_x")
+    y = typechecked_property(int, slot="_y")
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class TypecheckedDictRecord(object):
+    x = typechecked_property(int)
+    y = typechecked_property(int)
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+@typechecked
+class TypecheckedClassRecord(object):
+    __slots__ = ["_x", "_y"]
+    x = typechecked_property(int, slot="_x")
+    y = typechecked_property(int, slot="_y")
+
+@typechecked(enabled=False)
+class UncheckedClassRecord(object):
+    __slots__ = ["_x", "_y"]
+    x = typechecked_property(int, slot="_x")
+    y = typechecked_property(int, slot="_y")
+
+impls = [("slots", SlotsRecord), ("dict", DictRecord),
+         ("typechecked-slots", TypecheckedSlotsRecord),
+         ("typechecked-dict", TypecheckedDictRecord),
+         ("typechecked-class", TypecheckedClassRecord),
+         ("typechecked-off", UncheckedClassRecord)]
+
+def create(cls, size):
+    return [cls(i, i) for i in range(size)]
+
+def get_all(objects):
+    for obj in objects:
+        obj.x
+        obj.y
+
+def set_all(objects):
+    for obj in objects:
+        obj.x = 1
+        obj.y = 2
+
+def run(sizes, repeat=1, memory=True, match=None):
+    for size in sizes:
+        for name, cls in impls:
+            if selected(match, name, "attribute", "create"):
+                # The peak includes the list holding the objects, which
+                # costs the same for every class.
+                result = measure("annotations", name, "attribute", "create",
+                                 size, size, lambda: create(cls, size),
+                                 repeat=repeat, memory=memory)
+                if result["peak_memory"] is not None:
+                    result["bytes_per_object"] = (
+                        result["peak_memory"] / size if size else 0)
+                yield result
+
+            if not (selected(match, name, "attribute", "get") or
+                    selected(match, name, "attribute", "set")):
+                continue
+
+            objects = create(cls, size)
+            if selected(match, name, "attribute", "get"):
+                yield measure("annotations", name, "attribute", "get",
+                              size, 2 * size, lambda: get_all(objects),
+                              repeat=repeat)
+            if selected(match, name, "attribute", "set"):
+                yield measure("annotations", name, "attribute", "set",
+                              size, 2 * size, lambda: set_all(objects),
+                              repeat=repeat)
+            objects = None
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
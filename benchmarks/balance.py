@@ -0,0 +1,118 @@
+"""
+Balance policy benchmarks: RedBlackTree under red-black, AVL and WAVL
+balancing.
+
+Workloads follow the insertion patterns of test.py:
+    ascending, descending   Distinct keys in that order.
+    even                    0, then 1 and -1, 2 and -2, and so on.
+    mixed                   Distinct keys in a shuffled order.
+    churn                   The mixed keys, then every other key deleted.
+
+Operations: insert (building the tree from the workload), lookup (every
+live key, in shuffled order) and floor (a probe between each pair of keys).
+Lookup and floor results also record average_depth, the mean number of
+nodes a successful search visits.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.rbtree import RedBlackTree
+from benchmarks import measure, selected
+from random import Random
+
+policies = ["red-black", "avl", "wavl"]
+workloads = ["ascending", "descending", "even", "mixed", "churn"]
+seed = 0x5eed
+
+def workload_keys(workload, size, rng):
+    """
+    workload_keys(workload, size, rng) -> (inserted, deleted)
+
+    Return the keys the workload inserts and then deletes, in order.
+    """
+    if workload == "ascending":
+        return list(range(size)), []
+    elif workload == "descending":
+        return list(range(size - 1, -1, -1)), []
+    elif workload == "even":
+        keys = [0]
+        for key in range(1, (size + 1) // 2):
+            keys.extend((key, -key))
+        return keys, []
+    elif workload in ("mixed", "churn"):
+        keys = list(range(size))
+        rng.shuffle(keys)
+        if workload == "mixed":
+            return keys, []
+        return keys, keys[::2]
+    raise ValueError("Unknown workload %r" % (workload,))
+
+def build(policy, inserted, deleted):
+    tree = RedBlackTree(balance=policy)
+    for key in inserted:
+        tree[key] = key
+    for key in deleted:
+        del tree[key]
+    return tree
+
+def average_depth(tree):
+    """Return the mean number of nodes visited finding each key of tree."""
+    histogram = tree.stats()["depth_histogram"]
+    count = sum(histogram.values())
+    if not count:
+        return 0.0
+    return sum((depth + 1) * nodes
+               for depth, nodes in histogram.items()) / count
+
+def run(sizes, repeat=1, memory=True, match=None):
+    for size in sizes:
+        for workload in workloads:
+            rng = Random(seed)
+            inserted, deleted = workload_keys(workload, size, rng)
+            live = sorted(set(inserted) - set(deleted))
+            shuffled = list(live)
+            rng.shuffle(shuffled)
+            probes = [key + 0.5 for key in shuffled]
+
+            for policy in policies:
+                def want(operation):
+                    return selected(match, policy, workload, operation)
+
+                if want("insert"):
+                    yield measure("balance", policy, workload, "insert", size,
+                                  len(inserted) + len(deleted),
+                                  lambda: build(policy, inserted, deleted),
+                                  repeat=repeat, memory=memory)
+
+                if not (want("lookup") or want("floor")):
+                    continue
+
+                tree = build(policy, inserted, deleted)
+                depth = average_depth(tree)
+
+                if want("lookup"):
+                    def lookup(tree=tree):
+                        for key in shuffled:
+                            tree[key]
+                    result = measure("balance", policy, workload, "lookup",
+                                     size, len(shuffled), lookup,
+                                     repeat=repeat)
+                    result["average_depth"] = depth
+                    yield result
+
+                if want("floor"):
+                    def floor(tree=tree):
+                        find_node_floor = tree.find_node_floor
+                        for probe in probes:
+                            find_node_floor(probe)
+                    result = measure("balance", policy, workload, "floor",
+                                     size, len(probes), floor, repeat=repeat)
+                    result["average_depth"] = depth
+                    yield result
+                tree = None
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -0,0 +1,102 @@
+"""
+DurableRedBlackTree benchmarks.
+
+Workloads:
+    sync-1, sync-100, sync-1000     Random inserts with an fsync every 1, 100
+                                    or 1000 operations (group commit).  The
+                                    sync-1 workload is capped at 1000
+                                    operations, since each one waits on disk.
+    recover                         Reopening a tree of the given size from a
+                                    checkpoint alone ("checkpoint") and from a
+                                    checkpoint plus a log holding a further
+                                    10% of the size in inserts ("log-tail").
+    checkpoint                      Writing a checkpoint of the whole tree.
+
+Trees are written under a temporary directory, which is removed afterwards.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.durable import DurableRedBlackTree
+from benchmarks import measure, selected
+from random import Random
+import shutil
+import tempfile
+
+seed = 0x5eed
+sync_cap = 1000
+
+def insert_all(path, keys, sync_every):
+    tree = DurableRedBlackTree(path, sync_every=sync_every)
+    for key in keys:
+        tree[key] = key
+    tree.close()
+    return tree
+
+def run(sizes, repeat=1, memory=True, match=None):
+    for size in sizes:
+        rng = Random(seed)
+        keys = list(range(size))
+        rng.shuffle(keys)
+
+        for sync_every in (1, 100, 1000):
+            workload = "sync-%d" % sync_every
+            if not selected(match, "DurableRedBlackTree", workload, "insert"):
+                continue
+            ops = keys[:sync_cap] if sync_every == 1 else keys
+
+            def setup():
+                return tempfile.mkdtemp()
+
+            def insert(path, ops=ops, sync_every=sync_every):
+                try:
+                    insert_all(path, ops, sync_every)
+                finally:
+                    shutil.rmtree(path)
+
+            yield measure("durable", "DurableRedBlackTree", workload,
+                          "insert", size, len(ops), insert, setup=setup,
+                          repeat=repeat)
+
+        if not any(selected(match, "DurableRedBlackTree", workload, operation)
+                   for workload, operation in (("recover", "checkpoint"),
+                                               ("recover", "log-tail"),
+                                               ("checkpoint", "write"))):
+            continue
+
+        path = tempfile.mkdtemp()
+        try:
+            tree = DurableRedBlackTree(path, sync_every=max(size, 1))
+            tree.update((key, key) for key in keys)
+
+            if selected(match, "DurableRedBlackTree", "checkpoint", "write"):
+                yield measure("durable", "DurableRedBlackTree", "checkpoint",
+                              "write", size, size, tree.checkpoint,
+                              repeat=repeat)
+            else:
+                tree.checkpoint()
+            tree.close()
+
+            def reopen():
+                return DurableRedBlackTree(path).close()
+
+            if selected(match, "DurableRedBlackTree", "recover",
+                        "checkpoint"):
+                yield measure("durable", "DurableRedBlackTree", "recover",
+                              "checkpoint", size, size, reopen,
+                              repeat=repeat)
+
+            if selected(match, "DurableRedBlackTree", "recover", "log-tail"):
+                tail = size // 10
+                insert_all(path, range(size, size + tail), max(tail, 1))
+                yield measure("durable", "DurableRedBlackTree", "recover",
+                              "log-tail", size, size + tail, reopen,
+                              repeat=repeat)
+        finally:
+            shutil.rmtree(path)
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -0,0 +1,292 @@
+"""
+RedBlackTree benchmarks, with eager and lazy deletion and a dict + bisect
+sorted-list baseline.
+
+Workloads:
+    ascending, descending, random   Distinct keys in that insertion order.
+    zipfian                         Keys drawn from a Zipf(1.1) distribution,
+                                    so popular keys are overwritten often.
+    interleaved                     Two inserts followed by one delete of an
+                                    earlier key, repeated.
+    churn                           The random keys, then three quarters of
+                                    them deleted in a shuffled order.
+
+Operations: insert (building the structure from the workload), lookup,
+floor, ceil, iterate (full), range (iterate 100 items from a random
+start), update (bulk load from a dict) and delete.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        with_statement)
+from algae.rbtree import RedBlackTree
+from benchmarks import measure, selected
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from random import Random
+
+workloads = ["ascending", "descending", "random", "zipfian", "interleaved",
+             "churn"]
+range_length = 100
+seed = 0x5eed
+
+def zipf_keys(size, rng, exponent=1.1):
+    """Draw size keys from [0, size) with Zipf-distributed popularity."""
+    cumulative = []
+    total = 0.0
+    for rank in range(1, size + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+
+    # Map popularity ranks onto shuffled keys so popular keys are scattered
+    # through the key space.
+    keys = list(range(size))
+    rng.shuffle(keys)
+    return [keys[min(bisect_left(cumulative, rng.random() * total),
+                     size - 1)]
+            for i in range(size)]
+
+def workload_ops(workload, size, rng):
+    """
+    workload_ops(workload, size, rng) -> list
+
+    Return the workload as a list of (is_insert, key) pairs.
+    """
+    if workload == "ascending":
+        return [(True, key) for key in range(size)]
+    elif workload == "descending":
+        return [(True, key) for key in range(size - 1, -1, -1)]
+    elif workload == "random":
+        keys = list(range(size))
+        rng.shuffle(keys)
+        return [(True, key) for key in keys]
+    elif workload == "zipfian":
+        return [(True, key) for key in zipf_keys(size, rng)]
+    elif workload == "interleaved":
+        keys = list(range(size))
+        rng.shuffle(keys)
+        ops = []
+        live = []
+        for key in keys:
+            ops.append((True, key))
+            live.append(key)
+            if len(ops) % 3 == 2:
+                # Delete a random earlier key.
+                index = rng.randrange(len(live))
+                live[index], live[-1] = live[-1], live[index]
+                ops.append((False, live.pop()))
+        return ops
+    elif workload == "churn":
+        keys = list(range(size))
+        rng.shuffle(keys)
+        deleted = keys[:size * 3 // 4]
+        rng.shuffle(deleted)
+        return ([(True, key) for key in keys] +
+                [(False, key) for key in deleted])
+    raise ValueError("Unknown workload %r" % (workload,))
+
+class TreeAdapter(object):
+    """Runs the benchmark operations against a RedBlackTree."""
+    name = "RedBlackTree"
+
+    def new(self):
+        return RedBlackTree()
+
+    def apply(self, tree, ops):
+        for is_insert, key in ops:
+            if is_insert:
+                tree[key] = key
+            else:
+                del tree[key]
+        return tree
+
+    def lookup(self, tree, keys):
+        for key in keys:
+            tree[key]
+
+    def floor(self, tree, probes):
+        find_node_floor = tree.find_node_floor
+        for probe in probes:
+            find_node_floor(probe)
+
+    def ceil(self, tree, probes):
+        find_node_ceil = tree.find_node_ceil
+        for probe in probes:
+            find_node_ceil(probe)
+
+    def iterate(self, tree):
+        for item in tree.iteritems():
+            pass
+
+    def range(self, tree, starts):
+        for start in starts:
+            for item in islice(tree.iteritems(start=start), range_length):
+                pass
+
+    def update(self, items):
+        tree = self.new()
+        tree.update(items)
+        return tree
+
+    def delete(self, tree, keys):
+        for key in keys:
+            del tree[key]
+
+class LazyTreeAdapter(TreeAdapter):
+    """
+    Runs the benchmark operations against a RedBlackTree which deletes
+    lazily, rebuilding once half of its nodes are tombstones.
+    """
+    name = "RedBlackTree-lazy"
+
+    def new(self):
+        return RedBlackTree(lazy_delete=0.5)
+
+class DictBisectAdapter(object):
+    """
+    Runs the benchmark operations against a dict plus a sorted key list
+    maintained with bisect.
+    """
+    name = "dict+bisect"
+
+    def new(self):
+        return ({}, [])
+
+    def apply(self, state, ops):
+        mapping, keys = state
+        for is_insert, key in ops:
+            if is_insert:
+                if key not in mapping:
+                    insort(keys, key)
+                mapping[key] = key
+            else:
+                del mapping[key]
+                del keys[bisect_left(keys, key)]
+        return state
+
+    def lookup(self, state, keys):
+        mapping = state[0]
+        for key in keys:
+            mapping[key]
+
+    def floor(self, state, probes):
+        mapping, keys = state
+        for probe in probes:
+            index = bisect_right(keys, probe)
+            if index:
+                mapping[keys[index - 1]]
+
+    def ceil(self, state, probes):
+        mapping, keys = state
+        for probe in probes:
+            index = bisect_left(keys, probe)
+            if index < len(keys):
+                mapping[keys[index]]
+
+    def iterate(self, state):
+        mapping, keys = state
+        for key in keys:
+            (key, mapping[key])
+
+    def range(self, state, starts):
+        mapping, keys = state
+        for start in starts:
+            index = bisect_left(keys, start)
+            for key in islice(keys, index, index + range_length):
+                (key, mapping[key])
+
+    def update(self, items):
+        mapping = dict(items)
+        return (mapping, sorted(mapping))
+
+    def delete(self, state, keys):
+        mapping, sorted_keys = state
+        for key in keys:
+            del mapping[key]
+            del sorted_keys[bisect_left(sorted_keys, key)]
+
+adapters = [TreeAdapter(), LazyTreeAdapter(), DictBisectAdapter()]
+
+def run(sizes, repeat=1, memory=True, match=None):
+    for size in sizes:
+        for workload in workloads:
+            rng = Random(seed)
+            ops = workload_ops(workload, size, rng)
+            live = set()
+            for is_insert, key in ops:
+                if is_insert:
+                    live.add(key)
+                else:
+                    live.discard(key)
+            present = sorted(live)
+            shuffled = list(present)
+            rng.shuffle(shuffled)
+            probes = [key + 0.5 for key in shuffled]
+            starts = shuffled[:max(1, size // range_length)]
+            # Windows near the end of the keys are cut short; count only the
+            # items actually visited.
+            range_items = sum(
+                min(range_length, len(present) - bisect_left(present, start))
+                for start in starts)
+            items = dict((key, key) for key in present)
+
+            for adapter in adapters:
+                def want(operation):
+                    return selected(match, adapter.name, workload, operation)
+
+                def build(adapter=adapter):
+                    return adapter.apply(adapter.new(), ops)
+
+                if want("insert"):
+                    yield measure("rbtree", adapter.name, workload, "insert",
+                                  size, len(ops), build, repeat=repeat,
+                                  memory=memory)
+
+                if not any(want(operation) for operation in (
+                        "lookup", "floor", "ceil", "iterate", "range",
+                        "update", "delete")):
+                    continue
+
+                built = build()
+                if want("lookup"):
+                    yield measure("rbtree", adapter.name, workload, "lookup",
+                                  size, len(shuffled),
+                                  lambda: adapter.lookup(built, shuffled),
+                                  repeat=repeat)
+                if want("floor"):
+                    yield measure("rbtree", adapter.name, workload, "floor",
+                                  size, len(probes),
+                                  lambda: adapter.floor(built, probes),
+                                  repeat=repeat)
+                if want("ceil"):
+                    yield measure("rbtree", adapter.name, workload, "ceil",
+                                  size, len(probes),
+                                  lambda: adapter.ceil(built, probes),
+                                  repeat=repeat)
+                if want("iterate"):
+                    yield measure("rbtree", adapter.name, workload, "iterate",
+                                  size, len(present),
+                                  lambda: adapter.iterate(built),
+                                  repeat=repeat)
+                if want("range"):
+                    yield measure("rbtree", adapter.name, workload, "range",
+                                  size, range_items,
+                                  lambda: adapter.range(built, starts),
+                                  repeat=repeat)
+                if want("update"):
+                    yield measure("rbtree", adapter.name, workload, "update",
+                                  size, len(items),
+                                  lambda: adapter.update(items),
+                                  repeat=repeat, memory=memory)
+                if want("delete"):
+                    yield measure("rbtree", adapter.name, workload, "delete",
+                                  size, len(shuffled),
+                                  lambda state: adapter.delete(state,
+                                                               shuffled),
+                                  setup=build, repeat=repeat)
+                built = None
+
+# Local variables:
+# mode: Python
+# tab-width: 8
+# indent-tabs-mode: nil
+# End:
+# vi: set expandtab tabstop=8
@@ -1,10 +1,16 @@
 from math import e, pi
-import os, sys
+from random import Random
+import os, shutil, sys, tempfile
 import unittest
 
 sys.path = [os.getcwd()] + sys.path
 
-from algae.collections import RedBlackTree
+from algae.annotations import typechecked, typechecked_property
+from algae.collections import (
+    DurableRedBlackTree, ExpiringDict, IndexedTable, RedBlackTree,
+    ShardedSortedMap)
+from algae.functions import (
+    LFUCache, LRUCache, WeightedLRUCache, cache_miss, memoize)
 from algae.rbtree import RedBlackTreeNode
 
 class TestRedBlackTree(unittest.TestCase):
@@ -279,5 +285,1101 @@ class TestRedBlackTree(unittest.TestCase):
         self.assertIs(root.successor, root.right.left.left)
         return
 
+    def test_split(self):
+        for cut in xrange(-1, 66):
+            x = RedBlackTree()
+            for key in xrange(64):
+                x[key] = -key
+
+            lower = x.split(cut)
+            self.assertEqual(lower.keys(), range(max(0, min(cut, 64))))
+            self.assertEqual(x.keys(), range(max(0, min(cut, 64)), 64))
+            for tree in (lower, x):
+                if tree.root is not None:
+                    self.assertIsNone(tree.root.parent)
+                    self.assertFalse(tree.root.red)
+                    tree.root.check()
+
+            # Splitting again on an exact key with inclusive moves that key.
+            if cut < 63:
+                lower = x.split(cut + 1, inclusive=True)
+                self.assertEqual(lower.keys()[-1:], [cut + 1])
+                self.assertNotIn(cut + 1, x)
+                if x.root is not None:
+                    x.root.check()
+        return
+
+    def test_delete_range(self):
+        for start in (None, 0, 10, 37):
+            for stop in (None, 10, 40, 200):
+                x = RedBlackTree((key, key) for key in xrange(100))
+                bounds = {}
+                if start is not None:
+                    bounds["start"] = start
+                if stop is not None:
+                    bounds["stop"] = stop
+                removed = x.delete_range(**bounds)
+
+                low = 0 if start is None else start
+                high = 100 if stop is None else min(stop, 100)
+                middle = range(low, max(low, high))
+                self.assertEqual(removed.keys(), middle)
+                self.assertEqual(x.keys(), [key for key in xrange(100)
+                                            if key not in middle])
+                self.assertEqual(x.verify(), 100 - len(middle))
+                self.assertEqual(removed.verify(), len(middle))
+        return
+
+    def test_balance_policies(self):
+        self.assertRaises(ValueError, RedBlackTree, balance="splay")
+        for balance in ("avl", "wavl"):
+            rng = Random(2)
+            x = RedBlackTree(balance=balance)
+            self.assertEqual(x.balance.name, balance)
+            for key in xrange(1023):
+                x[key] = key
+            # Ascending inserts build a perfect tree under both policies.
+            self.assertEqual(x.stats()["height"], 10)
+            self.assertEqual(x.verify(), 1023)
+
+            expected = dict((key, key) for key in xrange(1023))
+            for i in xrange(3000):
+                key = rng.randrange(1500)
+                if key in expected and rng.random() < 0.6:
+                    del x[key]
+                    del expected[key]
+                else:
+                    x[key] = i
+                    expected[key] = i
+                if i % 250 == 0:
+                    x.verify()
+            self.assertEqual(x.items(), sorted(expected.items()))
+            self.assertEqual(x.verify(), len(expected))
+            self.assertTrue(x.verify(sample=20, rng=rng) >= 20)
+
+            copied = x.copy()
+            self.assertIs(copied.balance, x.balance)
+            self.assertEqual(copied.verify(), len(expected))
+
+            lower = x.split(700)
+            self.assertEqual(lower.verify() + x.verify(), len(expected))
+            removed = x.delete_range(900, 1200)
+            self.assertEqual(removed.keys(), sorted(
+                key for key in expected if 900 <= key < 1200))
+            x.verify()
+            x.compact()
+            x.verify()
+        return
+
+    def test_memory_usage(self):
+        x = RedBlackTree()
+        empty = x.memory_usage(deep=True)
+        self.assertEqual(empty["nodes"], 0)
+        self.assertEqual(empty["node_bytes"], 0)
+        self.assertEqual(empty["payload_bytes"], 0)
+
+        for key in xrange(100):
+            x[key] = "v" * key
+        usage = x.memory_usage()
+        node_size = sys.getsizeof(x.root)
+        self.assertEqual(usage["nodes"], 100)
+        self.assertEqual(usage["node_bytes"], 100 * node_size)
+        self.assertIsNone(usage["payload_bytes"])
+        self.assertTrue(0 < usage["weakref_bytes"] < usage["node_bytes"])
+        self.assertEqual(usage["total_bytes"],
+                         usage["node_bytes"] + usage["weakref_bytes"] +
+                         usage["tree_bytes"])
+
+        deep = x.memory_usage(deep=True)
+        self.assertEqual(deep["payload_bytes"],
+                         sum(sys.getsizeof(key) + sys.getsizeof(value)
+                             for key, value in x.iteritems()))
+        return
+
+    def test_compact(self):
+        x = RedBlackTree((key, -key) for key in xrange(1000))
+        for key in xrange(0, 1000, 3):
+            del x[key]
+        for key in xrange(900):
+            if key % 3 and key % 7:
+                del x[key]
+        items = x.items()
+        old_root = x.root
+
+        x.compact()
+        self.assertEqual(x.items(), items)
+        self.assertIsNot(x.root, old_root)
+        self.assertEqual(x.verify(), len(items))
+        self.assertEqual(x.stats()["height"], len(items).bit_length())
+        x[2000] = 0
+        self.assertEqual(x.verify(), len(items) + 1)
+        return
+
+    def test_lazy_delete(self):
+        x = RedBlackTree(((key, -key) for key in xrange(100)),
+                         lazy_delete=0.5)
+        root = x.root
+        for key in xrange(0, 40, 2):
+            del x[key]
+        self.assertIs(x.root, root)
+        self.assertEqual(x.tombstones, 20)
+        self.assertEqual(x.stats()["tombstones"], 20)
+        self.assertEqual(x.verify(), 100)
+        self.assertRaises(KeyError, x.__delitem__, 0)
+        self.assertRaises(KeyError, x.__getitem__, 0)
+        self.assertFalse(0 in x)
+        self.assertEqual(x.keys(stop=6), [1, 3, 5])
+        self.assertEqual(x.keys(7, stop=1, reverse=True), [7, 5, 3])
+        self.assertEqual(x.find_node_floor(2).key, 1)
+        self.assertEqual(x.find_node_ceil(2).key, 3)
+        self.assertEqual(x.min(), (1, -1))
+        self.assertEqual(x.nearest(4, 2), [(3, -3), (5, -5)])
+        self.assertEqual(sum(x.iter_chunks(stop=8, size=2), []),
+                         [(1, -1), (3, -3), (5, -5), (7, -7)])
+
+        # Assigning to a deleted key revives its node.
+        x[4] = "back"
+        self.assertIs(x.root, root)
+        self.assertEqual(x.tombstones, 19)
+        self.assertEqual(x.keys(stop=6), [1, 3, 4, 5])
+
+        # Splits carry their share of the tombstones with them.
+        lesser = x.split(10)
+        self.assertEqual(lesser.keys(), [1, 3, 4, 5, 7, 9])
+        self.assertEqual((lesser.node_count, lesser.tombstones), (10, 4))
+        self.assertEqual((x.node_count, x.tombstones), (90, 15))
+        self.assertEqual(lesser.verify(), 10)
+        self.assertEqual(x.verify(), 90)
+
+        # Passing half the nodes triggers a rebuild without tombstones.
+        for key in xrange(10, 40, 2):
+            x[key] = key
+        for key in xrange(10, 55):
+            del x[key]
+        self.assertEqual(x.tombstones, 45)
+        del x[55]
+        self.assertEqual((x.node_count, x.tombstones), (44, 0))
+        self.assertEqual(x.keys(), list(xrange(56, 100)))
+        self.assertEqual(x.verify(), 44)
+
+        del x[56]
+        x.disable_lazy_delete()
+        self.assertIsNone(x.lazy_delete)
+        self.assertEqual(x.verify(), 43)
+        del x[57]
+        self.assertEqual(x.verify(), 42)
+        self.assertRaises(ValueError, x.enable_lazy_delete, 1)
+
+        # Tombstones made while iterating are skipped.
+        y = RedBlackTree(((key, key) for key in xrange(10)), lazy_delete=0.9)
+        seen = []
+        for key in y.iterkeys():
+            seen.append(key)
+            if key + 1 in y:
+                del y[key + 1]
+        self.assertEqual(seen, [0, 2, 4, 6, 8])
+        return
+
+    def test_iter_chunks(self):
+        x = RedBlackTree((key, -key) for key in xrange(25))
+        chunks = list(x.iter_chunks(3, 20, size=5))
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5, 5, 2])
+        self.assertEqual(sum(chunks, []), x.items(3, stop=20))
+        self.assertEqual(sum(x.iter_chunks(20, 3, size=4, reverse=True), []),
+                         x.items(20, stop=3, reverse=True))
+        self.assertEqual(list(x.iter_chunks(size=25)), [x.items()])
+        self.assertEqual(list(RedBlackTree().iter_chunks()), [])
+
+        # The cursor resumes by key, so changes between chunks are seen.
+        cursor = x.iter_chunks(size=4)
+        self.assertEqual(cursor.next_chunk()[-1], (3, -3))
+        del x[3]
+        del x[4]
+        x[3.5] = "new"
+        x[-1] = "behind"
+        self.assertEqual(cursor.next_chunk(),
+                         [(3.5, "new"), (5, -5), (6, -6), (7, -7)])
+        self.assertEqual(len(sum(cursor, [])), 17)
+        self.assertEqual(cursor.next_chunk(), [])
+        self.assertRaises(ValueError, x.iter_chunks, size=0)
+        return
+
+    @unittest.skipIf(sys.version_info < (3, 5), "needs async iteration")
+    def test_aiter_items(self):
+        x = RedBlackTree((key, -key) for key in range(10))
+        iterator = x.aiter_items(2, 9, chunk_size=3)
+        self.assertIs(iterator.__aiter__(), iterator)
+
+        # Drive the awaitables by hand, as an event loop would.
+        items = []
+        pauses = []
+        while True:
+            awaitable = iterator.__anext__().__await__()
+            try:
+                while True:
+                    self.assertIsNone(next(awaitable))
+                    pauses.append(len(items))
+            except StopIteration as stop:
+                items.append(stop.args[0])
+            except StopAsyncIteration:
+                break
+        self.assertEqual(items, x.items(2, stop=9))
+        self.assertEqual(pauses, [3, 6, 7])
+        return
+
+    def test_nearest(self):
+        x = RedBlackTree((key, str(key)) for key in xrange(0, 100, 10))
+        self.assertEqual(x.nearest(33, 3),
+                         [(30, "30"), (40, "40"), (20, "20")])
+        self.assertEqual(x.nearest(35, 2), [(30, "30"), (40, "40")])
+        self.assertEqual([key for key, value in x.nearest(-5, 3)],
+                         [0, 10, 20])
+        self.assertEqual([key for key, value in x.nearest(200, 2)], [90, 80])
+        self.assertEqual(len(x.nearest(50, 20)), 10)
+        self.assertEqual(RedBlackTree().nearest(1, 3), [])
+        self.assertEqual(x.nearest(61, 1, distance=lambda a, b: 0),
+                         [(60, "60")])
+
+        rng = Random(1)
+        probes = [rng.uniform(-20, 120) for i in xrange(200)]
+        batched = x.nearest_many(probes, 4)
+        for probe, result in zip(probes, batched):
+            self.assertEqual(result, x.nearest(probe, 4))
+            self.assertEqual(result, sorted(
+                x.items(), key=lambda item: (abs(item[0] - probe),
+                                             item[0]))[:4])
+        return
+
+    def test_prefix(self):
+        x = RedBlackTree()
+        for path in ["/a", "/a/b", "/a/c", "/ab", "/b", "/a\xff", "/a/"]:
+            x[path] = len(path)
+        self.assertEqual([key for key, value in x.iter_prefix("/a/")],
+                         ["/a/", "/a/b", "/a/c"])
+        self.assertEqual(x.count_prefix("/a"), 6)
+        self.assertEqual(x.count_prefix(""), 7)
+        self.assertEqual(x.count_prefix("/c"), 0)
+        self.assertEqual(x.count_prefix("/a\xff"), 1)
+        self.assertEqual(x.delete_prefix("/a/").keys(),
+                         ["/a/", "/a/b", "/a/c"])
+        self.assertEqual(x.keys(), ["/a", "/ab", "/a\xff", "/b"])
+        self.assertEqual(x.verify(), 4)
+
+        y = RedBlackTree()
+        for tenant in xrange(3):
+            for time in xrange(10):
+                y[(tenant, time)] = None
+        y[(1,)] = None
+        y[(1, 5, 0)] = None
+        self.assertEqual(y.count_prefix((1,)), 12)
+        self.assertEqual(y.count_prefix((1, 5)), 2)
+        self.assertEqual(y.delete_prefix((1,)).keys()[:3],
+                         [(1,), (1, 0), (1, 1)])
+        self.assertEqual(y.count_prefix(()), 20)
+        self.assertRaises(TypeError, y.count_prefix, 1)
+        return
+
+    def test_verify(self):
+        x = RedBlackTree()
+        self.assertEqual(x.verify(), 0)
+        numbers = range(500)
+        numbers.sort(key=lambda x: (
+            str(pi ** x).replace(".", "")[x % 5:x % 5 + 4]))
+        for i in numbers:
+            x[i] = i
+        self.assertEqual(x.verify(), 500)
+        self.assertTrue(x.verify(sample=10) >= 10)
+
+        # A deep skewed tree (valid ordering, invalid balance) must not hit
+        # the recursion limit.
+        y = RedBlackTree()
+        node = y.root = RedBlackTreeNode(0, 0)
+        node.red = False
+        for key in xrange(1, 5000):
+            node.right = RedBlackTreeNode(key, key)
+            node.right.parent = node
+            node = node.right
+            node.red = False
+        try:
+            y.verify()
+            self.fail("Expected AssertionError")
+        except AssertionError as e:
+            self.assertIn("black height", str(e))
+
+        def expect_failure(message, **kw):
+            try:
+                x.verify(**kw)
+                self.fail("Expected AssertionError")
+            except AssertionError as e:
+                self.assertIn(message, str(e))
+
+        # Break the ordering.
+        node = x.root.left
+        key = node.key
+        node.key = 1000
+        expect_failure("out of order")
+        expect_failure("out of order", sample=20, rng=Random(0))
+        node.key = key
+
+        # Break a parent link.
+        node = x.root.left
+        node.parent = x.root.right
+        expect_failure("parent inconsistency")
+        expect_failure("parent inconsistency", sample=20)
+        node.parent = x.root
+
+        # Recolor the root.
+        x.root.red = True
+        expect_failure("is red")
+        x.root.red = False
+        x.verify()
+        return
+
+    def test_copy(self):
+        from copy import copy, deepcopy
+        x = RedBlackTree()
+        for key in xrange(100):
+            x[key] = [key]
+
+        for y in (x.copy(), copy(x)):
+            self.assertEqual(y.items(), x.items())
+            self.assertEqual(y.verify(), 100)
+            self.assertEqual(y.root.debug(), x.root.debug())
+            self.assertIsNot(y.root, x.root)
+            self.assertIs(y[5], x[5])
+            y[1000] = 0
+            self.assertNotIn(1000, x)
+
+        y = deepcopy(x)
+        self.assertEqual(y.items(), x.items())
+        self.assertEqual(y.root.debug(), x.root.debug())
+        self.assertIsNot(y[5], x[5])
+
+        # The cmp and key functions are carried over; no comparisons are made
+        # for a full copy.
+        x = RedBlackTree(cmp=lambda a, b: a > b)
+        x.update((key, key) for key in xrange(10))
+        x.enable_stats()
+        y = x.copy()
+        self.assertEqual(x.stats()["comparisons"], 0)
+        self.assertEqual(y.keys(), range(9, -1, -1))
+        return
+
+    def test_copy_range(self):
+        x = RedBlackTree()
+        for key in xrange(100):
+            x[key] = -key
+
+        for start, stop in ((10, 20), (-5, 3), (97, 200), (50, 50), (60, 40)):
+            y = x.copy(start=start, stop=stop)
+            expected = [(key, -key) for key in xrange(max(start, 0),
+                                                      min(stop, 100))]
+            self.assertEqual(y.items(), expected)
+            self.assertEqual(y.verify(), len(expected))
+
+        self.assertEqual(x.copy(start=95).keys(), range(95, 100))
+        self.assertEqual(x.copy(stop=5).keys(), range(5))
+        for count in xrange(70):
+            y = x.copy(stop=count)
+            self.assertEqual(y.verify(), count)
+        return
+
+    def test_ranged_iteration(self):
+        x = RedBlackTree()
+        for key in xrange(0, 100, 2):
+            x[key] = key
+
+        self.assertEqual(x.keys(start=10, stop=20), [10, 12, 14, 16, 18])
+        self.assertEqual(x.keys(start=11, stop=19), [12, 14, 16, 18])
+        self.assertEqual(x.keys(stop=5), [0, 2, 4])
+        self.assertEqual(x.keys(start=20, stop=10, reverse=True),
+                         [20, 18, 16, 14, 12])
+        self.assertEqual(x.values(start=93, reverse=True)[:2], [92, 90])
+        self.assertEqual(x.items(start=97), [(98, 98)])
+        self.assertEqual(x.keys(start=100), [])
+        self.assertEqual(x.keys(reverse=True), range(98, -1, -2))
+
+        # reverse is still the second positional argument.
+        self.assertEqual(x.keys(6, True), [6, 4, 2, 0])
+        self.assertEqual(list(x.iteritems(3, True)), [(2, 2), (0, 0)])
+        return
+
+    def test_stats(self):
+        x = RedBlackTree()
+        self.assertEqual(x.stats(), {"enabled": False, "size": 0,
+                                     "height": 0, "depth_histogram": {}})
+
+        x.enable_stats()
+        self.assertEqual(type(x).__name__, "InstrumentedRedBlackTree")
+        for key in xrange(16):
+            x[key] = key
+        stats = x.stats()
+        self.assertTrue(stats["enabled"])
+        self.assertEqual(stats["size"], 16)
+        self.assertEqual(stats["depth_histogram"], {0: 1, 1: 2, 2: 4, 3: 4,
+                                                    4: 4, 5: 1})
+        self.assertEqual(stats["height"], 6)
+        self.assertEqual(stats["lookups"], 16)
+        # Ascending inserts only ever need case 3 left rotations.
+        self.assertEqual(stats["left_rotations"], 10)
+        self.assertEqual(stats["right_rotations"], 0)
+        self.assertEqual(stats["insert_fixup_cases"], {1: 9, 2: 0, 3: 10})
+        self.assertEqual(sum(stats["visit_histogram"].values()), 16)
+        self.assertEqual(
+            sum(visits * count
+                for visits, count in stats["visit_histogram"].items()),
+            stats["nodes_visited"])
+
+        x.reset_stats()
+        x[15]
+        stats = x.stats()
+        self.assertEqual(stats["lookups"], 1)
+        self.assertEqual(stats["nodes_visited"], 6)
+        self.assertEqual(stats["comparisons"], 12)
+
+        for key in xrange(16):
+            del x[key]
+            x.root is None or x.root.check()
+        self.assertTrue(sum(x.stats()["delete_fixup_cases"].values()) > 0)
+
+        # Trees split off an instrumented tree count separately.
+        for key in xrange(16):
+            x[key] = key
+        lower = x.split(8)
+        self.assertTrue(lower.stats_enabled)
+        lower.reset_stats()
+        x.reset_stats()
+        lower[0]
+        self.assertEqual(lower.stats()["lookups"], 1)
+        self.assertEqual(x.stats()["lookups"], 0)
+
+        x.disable_stats()
+        self.assertIs(type(x), RedBlackTree)
+        self.assertFalse(x.stats()["enabled"])
+        self.assertEqual(x.keys(), range(8, 16))
+        return
+
+class TestTypecheckedProperty(unittest.TestCase):
+    def test_dict_storage(self):
+        class Record(object):
+            x = typechecked_property(int)
+            y = typechecked_property((int, float), deletion=True)
+
+        r = Record()
+        self.assertRaises(AttributeError, getattr, r, "x")
+        r.x = 1
+        r.y = 2.5
+        self.assertEqual((r.x, r.y), (1, 2.5))
+        self.assertRaises(TypeError, setattr, r, "x", "1")
+        self.assertRaises(TypeError, delattr, r, "x")
+        del r.y
+        self.assertRaises(AttributeError, getattr, r, "y")
+        return
+
+    def test_slot_storage(self):
+        class Record(object):
+            __slots__ = ["_x", "_y"]
+            x = typechecked_property(int, slot="_x")
+            y = typechecked_property((int, float), slot="_y", deletion=True)
+
+        class SubRecord(Record):
+            __slots__ = []
+
+        for cls in (Record, SubRecord):
+            r = cls()
+            self.assertFalse(hasattr(r, "__dict__"))
+            self.assertRaises(AttributeError, getattr, r, "x")
+            r.x = 1
+            r.y = 2.5
+            self.assertEqual((r.x, r.y), (1, 2.5))
+            self.assertEqual(r._x, 1)
+            try:
+                r.x = "1"
+                self.fail("Expected TypeError")
+            except TypeError as e:
+                self.assertEqual(str(e), "Cannot set attribute to str: "
+                                 "allowed types are int")
+            self.assertRaises(TypeError, delattr, r, "x")
+            del r.y
+            self.assertRaises(AttributeError, getattr, r, "y")
+
+        def define_broken():
+            class Broken(object):
+                __slots__ = []
+                x = typechecked_property(int, slot="_x")
+            return Broken
+
+        if sys.version_info >= (3, 6):
+            # __set_name__ looks the slot up when the class is created.
+            # Before Python 3.12, its TypeError is wrapped in a RuntimeError.
+            self.assertRaises((TypeError, RuntimeError), define_broken)
+        else:
+            self.assertRaises(TypeError, setattr, define_broken()(), "x", 1)
+        return
+
+    def test_typechecked_class(self):
+        @typechecked
+        class Point(object):
+            __slots__ = ["_x", "_y"]
+            x = typechecked_property(int, slot="_x")
+            y = typechecked_property((int, float), slot="_y")
+
+        @typechecked
+        class Point3(Point):
+            __slots__ = ["_z", "_label"]
+            z = typechecked_property(int, slot="_z")
+            label = typechecked_property(str, slot="_label")
+
+        self.assertEqual(Point.__typechecked_fields__, ("x", "y"))
+        self.assertEqual(Point3.__typechecked_fields__,
+                         ("x", "y", "z", "label"))
+        p = Point3(1, 2.5, 3, "p")
+        self.assertEqual((p.x, p.y, p.z, p.label), (1, 2.5, 3, "p"))
+        self.assertRaises(TypeError, Point3, 1, 2, "3", "p")
+        self.assertRaises(TypeError, Point, 1.5, 2)
+        self.assertRaises(TypeError, setattr, p, "x", None)
+
+        class NoDict(object):
+            __slots__ = []
+            x = typechecked_property(int)
+        self.assertRaises(TypeError, typechecked, NoDict)
+
+        # A class's own __init__ is kept; it can call _init_fields.
+        @typechecked
+        class Scaled(object):
+            value = typechecked_property(int)
+
+            def __init__(self, value, scale):
+                self._init_fields(value * scale)
+
+        self.assertEqual(Scaled(2, 3).value, 6)
+        self.assertRaises(TypeError, Scaled, 2, 1.5)
+
+        # Fields may share names with the initializer's own variables.
+        for enabled in (True, False):
+            @typechecked(enabled=enabled)
+            class Row(object):
+                values = typechecked_property(list)
+                self = typechecked_property(str)
+                name = typechecked_property(str)
+
+            r = Row([1], "me", "a")
+            self.assertEqual((r.values, r.self, r.name), ([1], "me", "a"))
+            if enabled:
+                self.assertRaises(TypeError, Row, [1], 2, "a")
+        return
+
+    def test_typechecked_disabled(self):
+        @typechecked(enabled=False)
+        class Point(object):
+            __slots__ = ["_x", "_y"]
+            x = typechecked_property(int, slot="_x")
+            y = typechecked_property(int, slot="_y")
+
+        @typechecked(enabled=False)
+        class Record(object):
+            name = typechecked_property(str)
+
+        @typechecked
+        class Checked(Record):
+            size = typechecked_property(int)
+
+        p = Point(1, "2")
+        self.assertEqual((p.x, p.y), (1, "2"))
+        self.assertIs(Point.__dict__["x"], Point.__dict__["_x"])
+        p.x = "one"
+        self.assertEqual(p._x, "one")
+
+        r = Record(5)
+        self.assertEqual(r.__dict__, {"name": 5})
+        r.name = None
+        self.assertIsNone(r.name)
+
+        # Checks come back on in a checked subclass.
+        self.assertRaises(TypeError, Checked, 5, 1)
+        c = Checked("c", 1)
+        self.assertEqual((c.name, c.size), ("c", 1))
+        self.assertRaises(TypeError, setattr, c, "name", 5)
+        return
+
+class TestMemoize(unittest.TestCase):
+    def test_lru(self):
+        calls = []
+
+        @memoize(maxsize=2)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        self.assertEqual([square(i) for i in (1, 2, 1, 3, 2, 1)],
+                         [1, 4, 1, 9, 4, 1])
+        # 2 is evicted when 3 arrives (1 was used more recently), then 1 is
+        # evicted when 2 returns.
+        self.assertEqual(calls, [1, 2, 3, 2, 1])
+        self.assertEqual(square.cache_stats(), {"hits": 1, "misses": 5,
+                                                "evictions": 3, "size": 2})
+        square.cache_clear()
+        self.assertEqual(len(square.cache), 0)
+        self.assertEqual(square.__name__, "square")
+        return
+
+    def test_lfu(self):
+        cache = LFUCache(maxsize=2)
+        cache.store("a", 1)
+        cache.store("b", 2)
+        self.assertEqual(cache.lookup("a"), 1)
+        cache.store("c", 3)
+        self.assertIs(cache.lookup("b"), cache_miss)
+        self.assertEqual(cache.lookup("c"), 3)
+        self.assertEqual(cache.lookup("c"), 3)
+        cache.store("d", 4)
+        self.assertIs(cache.lookup("a"), cache_miss)
+        self.assertEqual(cache.lookup("c"), 3)
+        self.assertEqual(cache.stats(), {"hits": 4, "misses": 2,
+                                         "evictions": 2, "size": 2})
+        return
+
+    def test_ttl(self):
+        clock = FakeClock()
+        calls = []
+
+        @memoize(policy="ttl", ttl=10)
+        def ident(x):
+            calls.append(x)
+            return x
+
+        ident.cache.entries.clock = clock
+        ident(1)
+        ident(1)
+        clock.now = 10
+        ident(1)
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(ident.cache_stats()["evictions"], 1)
+        self.assertRaises(ValueError, memoize, policy="ttl")
+        return
+
+    def test_weighted(self):
+        cache = WeightedLRUCache(max_weight=10)
+        cache.store("a", "xxxx")
+        cache.store("b", "xxxx")
+        cache.store("c", "xx")
+        self.assertEqual(len(cache), 3)
+        cache.store("d", "x")
+        self.assertIs(cache.lookup("a"), cache_miss)
+        self.assertEqual(cache.stats()["weight"], 7)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        # An oversized value is not kept and evicts nothing else, but does
+        # replace an older value for its key.
+        cache.store("e", "x" * 11)
+        self.assertEqual(len(cache), 3)
+        self.assertIs(cache.lookup("e"), cache_miss)
+        cache.store("c", "x" * 11)
+        self.assertIs(cache.lookup("c"), cache_miss)
+        self.assertEqual(cache.stats()["weight"], 5)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertEqual(cache.lookup("b"), "xxxx")
+        return
+
+    def test_cache_key_and_tree(self):
+        @memoize(cache_key=lambda items, scale=1: (tuple(items), scale),
+                 thread_safe=True)
+        def total(items, scale=1):
+            return sum(items) * scale
+
+        self.assertEqual(total([1, 2, 3]), 6)
+        self.assertEqual(total([1, 2, 3], scale=2), 12)
+        self.assertEqual(total([1, 2, 3]), 6)
+        self.assertEqual(total.cache_stats()["hits"], 1)
+
+        # Distinct argument lists don't collide.
+        @memoize()
+        def args(*a, **kw):
+            return (a, kw)
+
+        self.assertEqual(args(1), ((1,), {}))
+        self.assertEqual(args((1,)), (((1,),), {}))
+        self.assertEqual(args(1, x=2), ((1,), {"x": 2}))
+
+        @memoize(maxsize=1000)
+        def reverse_key(key):
+            return -key
+
+        x = RedBlackTree(key=reverse_key)
+        for key in xrange(10):
+            x[key] = key
+        self.assertEqual(x.keys(), range(9, -1, -1))
+        self.assertTrue(reverse_key.cache_stats()["hits"] > 0)
+        return
+
+class TestDurableRedBlackTree(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        return
+
+    def test_recover_from_log(self):
+        with DurableRedBlackTree(self.path, sync_every=10) as x:
+            for key in xrange(100):
+                x[key] = str(key)
+            x[5] = "five"
+            del x[6]
+            lower = x.split(10)
+            self.assertIs(type(lower), RedBlackTree)
+            self.assertRaises(KeyError, x.__delitem__, 6)
+
+        x = DurableRedBlackTree(self.path)
+        self.assertEqual(x.keys(), range(10, 100))
+        self.assertEqual(x[10], "10")
+        self.assertEqual(x.verify(), 90)
+        x.close()
+        self.assertRaises(ValueError, x.__setitem__, 1, 1)
+        self.assertRaises(ValueError, x.checkpoint)
+        self.assertRaises(ValueError, x.sync)
+        return
+
+    def test_sync_interval(self):
+        x = DurableRedBlackTree(self.path, sync_every=1000, sync_interval=60)
+        x[1] = 1
+        self.assertEqual(x.unsynced, 1)
+        self.assertFalse(x.maybe_sync())
+
+        # Once the interval has passed, an idle tree syncs on maybe_sync().
+        x.last_sync -= 60
+        self.assertTrue(x.maybe_sync())
+        self.assertEqual(x.unsynced, 0)
+        self.assertFalse(x.maybe_sync())
+
+        x.last_sync -= 60
+        x[2] = 2
+        self.assertEqual(x.unsynced, 0)
+        x.close()
+        self.assertFalse(x.maybe_sync())
+        return
+
+    def test_checkpoint(self):
+        x = DurableRedBlackTree(self.path, checkpoint_every=50)
+        for key in xrange(120):
+            x[key] = key
+        self.assertEqual(x.generation, 2)
+        old_wal = open(x.wal_path, "rb").read()
+        x.checkpoint()
+        x[1000] = 1000
+        del x[0]
+        x.close()
+
+        x = DurableRedBlackTree(self.path)
+        self.assertEqual(x.keys(), range(1, 120) + [1000])
+        self.assertEqual(x.verify(), 120)
+        x.close()
+
+        # A log left over from before the latest checkpoint is ignored.
+        with open(x.wal_path, "wb") as fd:
+            fd.write(old_wal)
+        x = DurableRedBlackTree(self.path)
+        self.assertEqual(x.keys(), range(120))
+        x.close()
+        return
+
+    def test_delete_range(self):
+        with DurableRedBlackTree(self.path) as x:
+            for key in ["a", "ab", "abc", "b", "bc"]:
+                x[key] = key
+            x.delete_prefix("ab")
+            x.delete_range(start="bc")
+
+        x = DurableRedBlackTree(self.path)
+        self.assertEqual(x.keys(), ["a", "b"])
+        x.close()
+        return
+
+    def test_torn_log(self):
+        x = DurableRedBlackTree(self.path)
+        for key in xrange(10):
+            x[key] = key
+        x.close()
+
+        with open(x.wal_path, "ab") as fd:
+            fd.write(b"\x10\x00\x00\x00garbage")
+
+        x = DurableRedBlackTree(self.path)
+        self.assertEqual(x.keys(), range(10))
+        x[10] = 10
+        x.close()
+
+        x = DurableRedBlackTree(self.path)
+        self.assertEqual(x.keys(), range(11))
+        x.close()
+        return
+
+class TestIndexedTable(unittest.TestCase):
+    def setUp(self):
+        self.table = IndexedTable(lambda record: record["id"])
+        self.table.add_index("time", lambda record: record["time"])
+        self.table.add_index("user", lambda record: record["user"])
+        self.table.add_index("email", lambda record: record["email"],
+                             unique=True)
+        for i in xrange(10):
+            self.table.insert({"id": i, "time": 100 - i, "user": i % 3,
+                               "email": "u%d@example.com" % i})
+        return
+
+    def test_queries(self):
+        table = self.table
+        self.assertEqual(len(table), 10)
+        self.assertEqual([r["id"] for r in table.range("time", 93, 97)],
+                         [7, 6, 5, 4])
+        self.assertEqual([r["id"] for r in table.range("user", 1, 2)],
+                         [1, 4, 7])
+        self.assertEqual([r["id"] for r in
+                          table.range("user", 1, 0, reverse=True)],
+                         [7, 4, 1])
+        self.assertEqual(table.count("user", 0, 2), 7)
+        self.assertEqual(table.find_one("email", "u3@example.com")["id"], 3)
+        self.assertIs(table.find("time", 91)[0], table[9])
+        self.assertEqual(table.find("time", 1000), [])
+        self.assertRaises(KeyError, table.range, "score")
+        return
+
+    def test_mutation(self):
+        table = self.table
+        table.update({"id": 4, "time": 1, "user": 4,
+                      "email": "u4@example.com"})
+        self.assertEqual(table.range("time")[0]["id"], 4)
+        self.assertEqual(table.find("user", 1), [table[1], table[7]])
+        self.assertEqual(table.find("user", 4), [table[4]])
+
+        deleted = table.delete(0)
+        self.assertEqual(deleted["id"], 0)
+        self.assertFalse(0 in table)
+        self.assertEqual(table.find("time", 100), [])
+        self.assertRaises(KeyError, table.delete, 0)
+        self.assertRaises(KeyError, table.update, deleted)
+
+        table.add_index("email_domain",
+                        lambda record: record["email"].split("@")[1])
+        self.assertEqual(table.count("email_domain"), 9)
+        return
+
+    def test_atomicity(self):
+        table = self.table
+        # A duplicate in a unique index is rejected before any change.
+        self.assertRaises(ValueError, table.insert,
+                          {"id": 20, "time": 0, "user": 0,
+                           "email": "u1@example.com"})
+        self.assertRaises(ValueError, table.insert, dict(table[1]))
+        self.assertFalse(20 in table)
+        self.assertEqual(table.find("time", 0), [])
+
+        # An index operation failing part way is rolled back.
+        def fail_add(index_key, pk, record):
+            del table.indexes["email"].add
+            raise RuntimeError("disk full")
+        table.indexes["email"].add = fail_add
+        self.assertRaises(RuntimeError, table.update,
+                          {"id": 2, "time": 0, "user": 5,
+                           "email": "new@example.com"})
+        self.assertEqual(table[2]["time"], 98)
+        self.assertEqual(table.find("time", 0), [])
+        self.assertEqual(table.find("time", 98), [table[2]])
+        self.assertEqual(sorted(r["id"] for r in table.find("user", 2)),
+                         [2, 5, 8])
+        self.assertEqual(table.find("email", "u2@example.com"), [table[2]])
+        self.assertEqual(table.index("email").verify(), 10)
+        return
+
+class TestShardedSortedMap(unittest.TestCase):
+    def test_load(self):
+        rng = Random(0)
+        keys = range(1000) * 2
+        rng.shuffle(keys)
+        items = [(key, -key) for key in keys]
+        items.append((7, "seven"))
+
+        # parallel_threshold=0 forces the worker processes to be used.
+        for threshold in (0, 10 ** 9):
+            x = ShardedSortedMap(items, shards=4, processes=2,
+                                 parallel_threshold=threshold)
+            self.assertEqual(len(x.shards), 4)
+            self.assertEqual(len(x), 1000)
+            self.assertEqual(x.keys(), range(1000))
+            self.assertEqual(x[7], "seven")
+            self.assertEqual(x[8], -8)
+            for shard in x.shards:
+                shard.verify()
+        return
+
+    def test_operations(self):
+        x = ShardedSortedMap(((key * 2, key) for key in xrange(500)),
+                             shards=3, processes=2, parallel_threshold=0)
+        x[1001] = "new"
+        x[4] = "four"
+        del x[0]
+        self.assertRaises(KeyError, x.__delitem__, 0)
+        self.assertFalse(0 in x)
+        self.assertTrue(1001 in x)
+        self.assertEqual(len(x), 500)
+
+        self.assertEqual(x.min(), (2, 1))
+        self.assertEqual(x.max(), (1001, "new"))
+        for probe in (0, 1, 3, 333, 334, 666, 667, 997, 1001, 2000):
+            expected = [key for key in x.keys() if key <= probe]
+            node = x.find_node_floor(probe)
+            self.assertEqual(node and node.key,
+                             expected[-1] if expected else None)
+            expected = [key for key in x.keys() if key >= probe]
+            node = x.find_node_ceil(probe)
+            self.assertEqual(node and node.key,
+                             expected[0] if expected else None)
+
+        self.assertEqual(x.keys(100, stop=900), range(100, 900, 2))
+        self.assertEqual(x.keys(900, stop=100, reverse=True),
+                         range(900, 100, -2))
+        self.assertEqual(x.keys(7, True), [6, 4, 2])
+        self.assertEqual(x.count(), 500)
+        self.assertEqual(x.count(101, 900), 399)
+        self.assertEqual(x.count(900, 100), 0)
+
+        def add_key(total, item):
+            return total + item[0]
+        self.assertEqual(x.reduce(add_key, 0, 100, 900),
+                         sum(range(100, 900, 2)))
+        self.assertEqual(x.reduce(add_key, 0, 100, 900, 
+                                  combine=lambda a, b: a + b),
+                         sum(range(100, 900, 2)))
+
+        x.rebalance()
+        self.assertEqual(x.keys(), range(2, 1000, 2) + [1001])
+        return
+
+    def test_tree_interface(self):
+        x = ShardedSortedMap(((key, -key) for key in xrange(300)), shards=3)
+        self.assertEqual(x.first_node().key, 0)
+        self.assertEqual(x.last_node().key, 299)
+        self.assertEqual(ShardedSortedMap([], shards=3).first_node(), None)
+
+        for probe in (-5, 0, 99.5, 150, 299, 400):
+            self.assertEqual(
+                x.nearest(probe, 3),
+                sorted(x.items(), key=lambda item: (abs(item[0] - probe),
+                                                    item[0]))[:3])
+        self.assertEqual(x.nearest_many([10, 250], 1),
+                         [[(10, -10)], [(250, -250)]])
+
+        copied = x.copy(50, 250)
+        self.assertEqual(copied.keys(), range(50, 250))
+        self.assertEqual(len(copied), 200)
+        whole = x.copy()
+        del whole[0]
+        self.assertEqual(len(x), 300)
+
+        removed = x.delete_range(20, 280)
+        self.assertEqual(removed.keys(), range(20, 280))
+        self.assertEqual(len(removed), 260)
+        self.assertEqual(x.keys(), range(20) + range(280, 300))
+        self.assertEqual(len(x), 40)
+
+        lower = x.split(10, inclusive=True)
+        self.assertEqual(lower.keys(), range(11))
+        self.assertEqual(len(lower), 11)
+        self.assertEqual(x.keys(), range(11, 20) + range(280, 300))
+        self.assertEqual(len(x), 29)
+        self.assertEqual(x.min(), (11, -11))
+        x[5] = "back"
+        self.assertEqual(x.shards[x.shard_index(5)].find_node(5).value,
+                         "back")
+        self.assertEqual(len(x), 30)
+
+        words = ShardedSortedMap([(word, len(word)) for word in
+                                  ["a", "ab", "abc", "b", "bc", "c"]],
+                                 shards=2)
+        self.assertEqual(list(words.iter_prefix("ab")),
+                         [("ab", 2), ("abc", 3)])
+        self.assertEqual(words.count_prefix("b"), 2)
+        self.assertEqual(words.delete_prefix("a").keys(), ["a", "ab", "abc"])
+        self.assertEqual(words.keys(), ["b", "bc", "c"])
+        return
+
+class FakeClock(object):
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TestExpiringDict(unittest.TestCase):
+    def test_lazy_expiry(self):
+        clock = FakeClock()
+        x = ExpiringDict(ttl=10, clock=clock)
+        x["a"] = 1
+        x.set("b", 2, ttl=20)
+        x.set("c", 3, ttl=None)
+
+        clock.now = 10
+        self.assertNotIn("a", x)
+        self.assertEqual(x["b"], 2)
+        self.assertEqual(x.get("a", 0), 0)
+        self.assertEqual(len(x), 2)
+
+        clock.now = 1000
+        try:
+            x["b"]
+            self.fail("Expected KeyError")
+        except KeyError:
+            pass
+        self.assertEqual(x.items(), [("c", 3)])
+        self.assertEqual(x.stats(), {"hits": 1, "misses": 2, "evictions": 0,
+                                     "expirations": 2})
+        return
+
+    def test_evict_expired(self):
+        clock = FakeClock()
+        x = ExpiringDict(clock=clock)
+        for i in xrange(100):
+            x.set(i, i, ttl=i % 10)
+        x.set("forever", None)
+
+        # Overwriting an entry replaces its expiry.
+        x.set(0, 0, ttl=50)
+
+        self.assertEqual(x.evict_expired(4), 49)
+        self.assertEqual(len(x), 52)
+        self.assertEqual(sorted(k for k in x.keys() if k != "forever"),
+                         [0] + [i for i in xrange(100) if i % 10 > 4])
+        x.expiry_index.root.check()
+
+        self.assertEqual(x.evict_expired(1000), 51)
+        self.assertEqual(x.keys(), ["forever"])
+        self.assertEqual(x.expirations, 100)
+        return
+
+    def test_max_size(self):
+        clock = FakeClock()
+        x = ExpiringDict(ttl=100, max_size=3, clock=clock)
+        x.set("a", 1, ttl=5)
+        x.set("b", 2)
+        x.set("c", 3, ttl=None)
+        x.set("d", 4)
+        self.assertEqual(sorted(x.keys()), ["b", "c", "d"])
+        self.assertEqual(x.evictions, 1)
+
+        # Expired entries are evicted before live ones.
+        del x["b"]
+        x.set("e", 5, ttl=1)
+        clock.now = 2
+        x.set("f", 6)
+        self.assertEqual(sorted(x.keys()), ["c", "d", "f"])
+        self.assertEqual(x.evictions, 1)
+        self.assertEqual(x.expirations, 1)
+
+        del x["d"]
+        self.assertEqual(x.pop("c"), 3)
+        self.assertEqual(x.pop("c", None), None)
+        self.assertEqual(x.keys(), ["f"])
+        return
+
 if __name__ == "__main__":
     unittest.main()